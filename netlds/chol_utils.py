@@ -7,7 +7,7 @@ import tensorflow as tf
 import numpy as np
 
 
-def blk_tridiag_chol(D, B):
+def blk_tridiag_chol(D, B, use_inverse=False, custom_grad=True):
     """
     Compute the Cholesky decomposition of a symmetric, positive definite
     block-tridiagonal matrix.
@@ -18,6 +18,15 @@ def blk_tridiag_chol(D, B):
         D (T x n x n tensor): each D[i, :, :] is the ith block diagonal matrix
         B (T-1 x n x n tensor): each B[i, :, :] is the ith (lower) 1st block
             off-diagonal matrix
+        use_inverse (bool): compute off-diagonal blocks with explicit matrix
+            inverses rather than triangular solves
+            DEFAULT: False
+        custom_grad (bool): use the hand-written adjoint of the decomposition
+            for the gradient, which is computed in a single reverse sweep from
+            the factor blocks, rather than differentiating through the scan
+            (which stores all intermediate results); ignored if `use_inverse`
+            is `True`
+            DEFAULT: True
 
     Returns:
         chol_blocks (list of tensors)
@@ -28,6 +37,55 @@ def blk_tridiag_chol(D, B):
 
     """
 
+    chol_blocks = blk_tridiag_chol_batch(
+        tf.expand_dims(D, axis=0), tf.expand_dims(B, axis=0),
+        use_inverse=use_inverse, custom_grad=custom_grad)
+
+    return [chol_blocks[0][0], chol_blocks[1][0]]
+
+
+def blk_tridiag_chol_batch(D, B, use_inverse=False, custom_grad=True):
+    """
+    Compute the Cholesky decomposition of a batch of symmetric, positive
+    definite block-tridiagonal matrices. The recursion is a scan over time
+    only; each step operates on all batch elements at once.
+
+    Args:
+        D (batch_size x T x n x n tensor): each D[b, i, :, :] is the ith block
+            diagonal matrix of the bth batch element
+        B (batch_size x T-1 x n x n tensor): each B[b, i, :, :] is the ith
+            (lower) 1st block off-diagonal matrix of the bth batch element
+        use_inverse (bool): see `blk_tridiag_chol`
+        custom_grad (bool): see `blk_tridiag_chol`
+
+    Returns:
+        chol_blocks (list of tensors)
+            chol_blocks[0] (batch_size x T x n x n tensor): block diagonal
+                elements of Cholesky decomposition
+            chol_blocks[1] (batch_size x T-1 x n x n tensor): (lower) 1st
+                block off-diagonal elements of Cholesky decomposition
+
+    """
+
+    if use_inverse or not custom_grad:
+        return _blk_tridiag_chol_batch(D, B, use_inverse=use_inverse)
+
+    @tf.custom_gradient
+    def chol(D, B):
+        chol_blocks = _blk_tridiag_chol_batch(D, B)
+
+        def grad(grad_L, grad_C):
+            return _blk_tridiag_chol_grad(
+                chol_blocks[0], chol_blocks[1], grad_L, grad_C)
+
+        return chol_blocks, grad
+
+    return chol(D, B)
+
+
+def _blk_tridiag_chol_batch(D, B, use_inverse=False):
+    """Recursion for `blk_tridiag_chol_batch` without the custom gradient"""
+
     # Code for computing the Cholesky decomposition of a symmetric block
     # tridiagonal matrix
     def compute_chol(outputs, inputs):
@@ -35,13 +93,11 @@ def blk_tridiag_chol(D, B):
         [Li, Ci] = outputs
         [Di, Bi] = inputs
 
-        # compute the off-diagonal block of the triangular factor
-        Ci = tf.matmul(Bi, tf.matrix_inverse(Li), transpose_b=True)
-        # update the diagonal block with the newly computed off-diagonal block
-        Dii = Di - tf.matmul(Ci, Ci, transpose_b=True)
-        # perform Cholesky factorization of a diagonal block
-        Li = tf.cholesky(Dii)
-        return [Li, Ci]
+        return _chol_step(Li, Di, Bi, use_inverse=use_inverse)
+
+    # scan over time dimension: T x batch_size x n x n
+    D = tf.transpose(D, perm=[1, 0, 2, 3])
+    B = tf.transpose(B, perm=[1, 0, 2, 3])
 
     # perform Cholesky factorization of the first block
     L1 = tf.cholesky(D[0])
@@ -58,10 +114,389 @@ def blk_tridiag_chol(D, B):
         [tf.expand_dims(L1, axis=0), chol_blocks[0]],
         axis=0)
 
-    return chol_blocks
+    # move batch dimension back to front
+    return [tf.transpose(chol_blocks[0], perm=[1, 0, 2, 3]),
+            tf.transpose(chol_blocks[1], perm=[1, 0, 2, 3])]
+
+
+def blk_tridiag_chol_static(
+        D, D_static, B_static, use_inverse=False, custom_grad=True):
+    """
+    Compute the Cholesky decomposition of a batch of symmetric, positive
+    definite block-tridiagonal matrices whose blocks are the sum of a
+    data-dependent diagonal term and a small number of static blocks that are
+    shared across time and batch elements (as in the precision matrix of an
+    LDS posterior). The static blocks are added inside the recursion, so the
+    full set of blocks is never materialized.
+
+    Args:
+        D (batch_size x T x n x n tensor): data-dependent term of the diagonal
+            blocks
+        D_static (K x n x n tensor): static diagonal blocks; the tth diagonal
+            block of the matrix is D[:, t] + D_static[min(t, K-1)]
+        B_static (M x n x n tensor): static (lower) 1st block off-diagonal
+            blocks; the tth off-diagonal block of the matrix is
+            B_static[min(t, M-1)]
+        use_inverse (bool): see `blk_tridiag_chol`
+        custom_grad (bool): see `blk_tridiag_chol`; gradients with respect to
+            the static blocks are accumulated over time and batch elements
+
+    Returns:
+        chol_blocks (list of tensors)
+            batch_size x T x n x n tensor: block diagonal elements of
+                Cholesky decomposition
+            batch_size x T-1 x n x n tensor: (lower) 1st block off-diagonal
+                elements of Cholesky decomposition
+
+    """
+
+    if use_inverse or not custom_grad:
+        return _blk_tridiag_chol_static(
+            D, D_static, B_static, use_inverse=use_inverse)
+
+    @tf.custom_gradient
+    def chol(D, D_static, B_static):
+        chol_blocks = _blk_tridiag_chol_static(D, D_static, B_static)
+
+        def grad(grad_L, grad_C):
+            [grad_D, grad_B] = _blk_tridiag_chol_grad(
+                chol_blocks[0], chol_blocks[1], grad_L, grad_C)
+            # static blocks are shared across batch and (some) time points
+            [diag_ids, ldiag_ids] = _static_block_ids(
+                tf.shape(D)[1], D_static, B_static)
+            grad_D_static = tf.unsorted_segment_sum(
+                tf.reduce_sum(grad_D, axis=0), diag_ids,
+                tf.shape(D_static)[0])
+            grad_B_static = tf.unsorted_segment_sum(
+                tf.reduce_sum(grad_B, axis=0), ldiag_ids,
+                tf.shape(B_static)[0])
+            return [grad_D, grad_D_static, grad_B_static]
+
+        return chol_blocks, grad
+
+    return chol(D, D_static, B_static)
 
 
-def blk_chol_inv(D, B, b, lower=True, transpose=False):
+def _blk_tridiag_chol_static(D, D_static, B_static, use_inverse=False):
+    """Recursion for `blk_tridiag_chol_static` without the custom gradient"""
+
+    batch_size = tf.shape(D)[0]
+    [diag_ids, ldiag_ids] = _static_block_ids(
+        tf.shape(D)[1], D_static, B_static)
+
+    def compute_chol(outputs, inputs):
+
+        [Li, Ci] = outputs
+        [Di, diag_id, ldiag_id] = inputs
+
+        # add static blocks to the data-dependent term
+        Di = Di + tf.gather(D_static, diag_id)
+        Bi = tf.tile(
+            tf.expand_dims(tf.gather(B_static, ldiag_id), axis=0),
+            [batch_size, 1, 1])
+
+        return _chol_step(Li, Di, Bi, use_inverse=use_inverse)
+
+    # scan over time dimension: T x batch_size x n x n
+    D = tf.transpose(D, perm=[1, 0, 2, 3])
+
+    # perform Cholesky factorization of the first block
+    L1 = tf.cholesky(D[0] + D_static[0])
+    # initializer for scan function (not used on first iteration)
+    C1 = tf.zeros_like(L1)
+
+    chol_blocks = tf.scan(
+        fn=compute_chol, elems=[D[1:], diag_ids[1:], ldiag_ids],
+        initializer=[L1, C1])
+
+    # add Cholesky factorization of first block to diagonal entries
+    chol_blocks[0] = tf.concat(
+        [tf.expand_dims(L1, axis=0), chol_blocks[0]],
+        axis=0)
+
+    # move batch dimension back to front
+    return [tf.transpose(chol_blocks[0], perm=[1, 0, 2, 3]),
+            tf.transpose(chol_blocks[1], perm=[1, 0, 2, 3])]
+
+
+def _static_block_ids(num_time_pts, D_static, B_static):
+    """Index of the static diagonal/off-diagonal block used at each time"""
+    diag_ids = tf.minimum(
+        tf.range(num_time_pts), tf.shape(D_static)[0] - 1)
+    ldiag_ids = tf.minimum(
+        tf.range(num_time_pts - 1), tf.shape(B_static)[0] - 1)
+    return [diag_ids, ldiag_ids]
+
+
+def blk_tridiag_expand_static(D, D_static, B_static):
+    """
+    Materialize the full set of blocks of the matrices used by
+    `blk_tridiag_chol_static`, for use with the other routines in this module
+
+    Args:
+        D (batch_size x T x n x n tensor): data-dependent term of the diagonal
+            blocks
+        D_static (K x n x n tensor): static diagonal blocks
+        B_static (M x n x n tensor): static (lower) 1st block off-diagonal
+            blocks
+
+    Returns:
+        list of tensors
+            batch_size x T x n x n tensor: block diagonal matrices
+            batch_size x T-1 x n x n tensor: (lower) 1st block off-diagonal
+                matrices
+
+    """
+
+    [diag_ids, ldiag_ids] = _static_block_ids(
+        tf.shape(D)[1], D_static, B_static)
+    D = D + tf.gather(D_static, diag_ids)
+    B = tf.tile(
+        tf.expand_dims(tf.gather(B_static, ldiag_ids), axis=0),
+        [tf.shape(D)[0], 1, 1, 1])
+
+    return [D, B]
+
+
+def _cholesky_grad(L, grad_L):
+    """
+    Adjoint of the Cholesky decomposition of a symmetric matrix (as in the
+    gradient registered for `tf.cholesky`, using triangular solves)
+
+    Args:
+        L (... x n x n tensor): lower triangular Cholesky factor
+        grad_L (... x n x n tensor): gradient with respect to L
+
+    Returns:
+        ... x n x n tensor: symmetric gradient with respect to L L^T
+
+    """
+
+    P = tf.matmul(L, grad_L, transpose_a=True)
+    P = tf.matrix_band_part(P, -1, 0) \
+        - 0.5 * tf.matrix_diag(tf.matrix_diag_part(P))
+    # L^{-T} P L^{-1}
+    X = tf.matrix_triangular_solve(L, P, lower=True, adjoint=True)
+    X = tf.matrix_transpose(tf.matrix_triangular_solve(
+        L, tf.matrix_transpose(X), lower=True, adjoint=True))
+
+    return 0.5 * (X + tf.matrix_transpose(X))
+
+
+def _blk_tridiag_chol_grad(L, C, grad_L, grad_C):
+    """
+    Adjoint of the block-tridiagonal Cholesky decomposition; a single reverse
+    sweep over time that only requires the factor blocks
+
+    Args:
+        L (batch_size x T x n x n tensor): block diagonal elements of Cholesky
+            decomposition
+        C (batch_size x T-1 x n x n tensor): (lower) 1st block off-diagonal
+            elements of Cholesky decomposition
+        grad_L (batch_size x T x n x n tensor): gradient with respect to L
+        grad_C (batch_size x T-1 x n x n tensor): gradient with respect to C
+
+    Returns:
+        list of tensors: gradients with respect to the block diagonal and
+            (lower) 1st block off-diagonal matrices
+
+    """
+
+    if grad_L is None:
+        grad_L = tf.zeros_like(L)
+    if grad_C is None:
+        grad_C = tf.zeros_like(C)
+
+    def update(outputs, inputs):
+
+        [_, _, grad_Li_next] = outputs
+        [Li, Ci, Li_prev, grad_Li, grad_Ci] = inputs
+
+        # Li = chol(Di - Ci Ci^T)
+        grad_Di = _cholesky_grad(Li, grad_Li + grad_Li_next)
+        grad_Ci = grad_Ci - 2.0 * tf.matmul(grad_Di, Ci)
+        # Ci = Bi Li_prev^{-T}
+        grad_Bi = tf.matrix_transpose(tf.matrix_triangular_solve(
+            Li_prev, tf.matrix_transpose(grad_Ci), lower=True, adjoint=True))
+        grad_Li_prev = -tf.matmul(grad_Bi, Ci, transpose_a=True)
+
+        return [grad_Di, grad_Bi, grad_Li_prev]
+
+    # reverse sweep over time dimension: T x batch_size x n x n
+    L = tf.transpose(L, perm=[1, 0, 2, 3])
+    C = tf.transpose(C, perm=[1, 0, 2, 3])
+    grad_L = tf.transpose(grad_L, perm=[1, 0, 2, 3])
+    grad_C = tf.transpose(grad_C, perm=[1, 0, 2, 3])
+
+    [grad_D, grad_B, grad_L_prev] = tf.scan(
+        fn=update,
+        elems=[L[1:][::-1], C[::-1], L[:-1][::-1], grad_L[1:][::-1],
+               grad_C[::-1]],
+        initializer=[L[0], C[0], tf.zeros_like(L[0])])
+
+    # first diagonal block
+    grad_D0 = _cholesky_grad(L[0], grad_L[0] + grad_L_prev[-1])
+
+    grad_D = tf.concat([tf.expand_dims(grad_D0, axis=0), grad_D[::-1]], axis=0)
+    grad_B = grad_B[::-1]
+
+    # move batch dimension back to front
+    return [tf.transpose(grad_D, perm=[1, 0, 2, 3]),
+            tf.transpose(grad_B, perm=[1, 0, 2, 3])]
+
+
+def blk_tridiag_chol_steady_state(D, B, tol=1e-6, use_inverse=False):
+    """
+    Compute the Cholesky decomposition of a batch of symmetric, positive
+    definite block-tridiagonal matrices, stopping the recursion once the
+    factor blocks have converged.
+
+    When the blocks of the matrix are (close to) constant over time, the
+    recursion for the factor blocks converges to a fixed point. The last
+    blocks are repeated for the remaining time points once both the largest
+    absolute change of the factor blocks between consecutive time points and
+    the largest absolute change of all remaining blocks of the matrix from
+    the last ones used (over all batch elements) fall below `tol`; otherwise
+    the recursion continues, so that inputs which are not stationary give
+    the same factor as `blk_tridiag_chol_batch`. The recursion is capped at
+    T-1 steps, and a single-block input (T = 1) returns the Cholesky factor
+    of that block directly.
+
+    Args:
+        D (batch_size x T x n x n tensor): block diagonal matrices
+        B (batch_size x T-1 x n x n tensor): (lower) 1st block off-diagonal
+            matrices
+        tol (float): convergence tolerance on the factor blocks and on the
+            stationarity of the remaining matrix blocks
+            DEFAULT: 1e-6
+        use_inverse (bool): see `blk_tridiag_chol`
+
+    Returns:
+        chol_blocks (list of tensors)
+            chol_blocks[0] (batch_size x T x n x n tensor): block diagonal
+                elements of Cholesky decomposition
+            chol_blocks[1] (batch_size x T-1 x n x n tensor): (lower) 1st
+                block off-diagonal elements of Cholesky decomposition
+        num_steps (int tensor): number of diagonal blocks actually computed
+
+    """
+
+    num_time_pts = tf.shape(D)[1]
+
+    # loop over time dimension: T x batch_size x n x n
+    D = tf.transpose(D, perm=[1, 0, 2, 3])
+    B = tf.transpose(B, perm=[1, 0, 2, 3])
+
+    def max_remaining_change(X, lag):
+        # largest absolute change of X[t:] from X[t-1] for t = lag, lag+1,
+        # ..., from the reverse cumulative elementwise max and min of X
+        X_max = tf.scan(tf.maximum, X, reverse=True)[lag:]
+        X_min = tf.scan(tf.minimum, X, reverse=True)[lag:]
+        X_prev = X[lag - 1:-1]
+        return tf.reduce_max(
+            tf.maximum(X_max - X_prev, X_prev - X_min), axis=[1, 2, 3])
+
+    def body(t, Li, Ci, delta, L_array, C_array):
+        [Lj, Cj] = _chol_step(Li, D[t], B[t - 1], use_inverse=use_inverse)
+        delta = tf.maximum(
+            tf.reduce_max(tf.abs(Lj - Li)), tf.reduce_max(tf.abs(Cj - Ci)))
+        L_array = L_array.write(t, Lj)
+        C_array = C_array.write(t - 1, Cj)
+        return [t + 1, Lj, Cj, delta, L_array, C_array]
+
+    def recursion():
+        # freezing before time point t repeats the factor blocks computed
+        # from D[t-1] and B[t-2], which is exact only if D[t:] and B[t-1:]
+        # match them; `input_change[t]` is the largest deviation (never
+        # freeze before t = 2, and the loop ends at t = T)
+        input_change = tf.concat(
+            [tf.constant(np.inf, D.dtype, shape=[2]),
+             tf.maximum(max_remaining_change(D, 2),
+                        max_remaining_change(B, 1)),
+             tf.zeros([1], dtype=D.dtype)], axis=0)
+
+        def cond(t, Li, Ci, delta, L_array, C_array):
+            return tf.logical_and(
+                t < num_time_pts,
+                tf.logical_or(delta >= tol, input_change[t] >= tol))
+
+        L_array = tf.TensorArray(D.dtype, size=num_time_pts).write(0, L1)
+        C_array = tf.TensorArray(D.dtype, size=num_time_pts - 1)
+
+        # the recursion needs at most T-1 steps, whether or not the factor
+        # blocks converge to within `tol`
+        [num_steps, L_last, C_last, _, L_array, C_array] = tf.while_loop(
+            cond=cond, body=body,
+            loop_vars=[tf.constant(1), L1, C1, tf.constant(np.inf, D.dtype),
+                       L_array, C_array],
+            maximum_iterations=num_time_pts - 1)
+
+        # repeat converged blocks for remaining time points
+        num_remaining = num_time_pts - num_steps
+        L = tf.concat(
+            [L_array.gather(tf.range(num_steps)),
+             tf.tile(tf.expand_dims(L_last, axis=0),
+                     [num_remaining, 1, 1, 1])],
+            axis=0)
+        C = tf.concat(
+            [C_array.gather(tf.range(num_steps - 1)),
+             tf.tile(tf.expand_dims(C_last, axis=0),
+                     [num_remaining, 1, 1, 1])],
+            axis=0)
+        return [L, C, num_steps]
+
+    def single_block():
+        # no off-diagonal blocks; the factor is the Cholesky of the only
+        # diagonal block
+        return [tf.expand_dims(L1, axis=0), B, tf.constant(1)]
+
+    # perform Cholesky factorization of the first block
+    L1 = tf.cholesky(D[0])
+    C1 = tf.zeros_like(D[0])
+
+    [L, C, num_steps] = tf.cond(
+        num_time_pts > 1, recursion, single_block)
+
+    # move batch dimension back to front
+    chol_blocks = [tf.transpose(L, perm=[1, 0, 2, 3]),
+                   tf.transpose(C, perm=[1, 0, 2, 3])]
+
+    return chol_blocks, num_steps
+
+
+def _chol_step(Li, Di, Bi, use_inverse=False):
+    """
+    One step of the block Cholesky recursion; computes the factor blocks of
+    the current time point from the diagonal factor block of the previous one
+
+    Args:
+        Li (... x n x n tensor): previous diagonal block of factor
+        Di (... x n x n tensor): current diagonal block of matrix
+        Bi (... x n x n tensor): current (lower) off-diagonal block of matrix
+        use_inverse (bool): see `blk_tridiag_chol`
+
+    Returns:
+        list of tensors: current diagonal and off-diagonal blocks of factor
+
+    """
+
+    # compute the off-diagonal block of the triangular factor,
+    # Ci = Bi Li^{-T}
+    if use_inverse:
+        Ci = tf.matmul(Bi, tf.matrix_inverse(Li), transpose_b=True)
+    else:
+        Ci = tf.matrix_transpose(tf.matrix_triangular_solve(
+            Li, tf.matrix_transpose(Bi), lower=True))
+    # update the diagonal block with the newly computed off-diagonal block
+    Dii = Di - tf.matmul(Ci, Ci, transpose_b=True)
+    # perform Cholesky factorization of a diagonal block
+    Li = tf.cholesky(Dii)
+    return [Li, Ci]
+
+
+def blk_chol_inv(
+        D, B, b, lower=True, transpose=False, use_inverse=False,
+        custom_grad=True):
     """
     Solve the equation Cx = b for x, where C is assumed to be a
     block-bidiagonal matrix (where only the first (lower or upper) off-diagonal
@@ -81,49 +516,59 @@ def blk_chol_inv(D, B, b, lower=True, transpose=False):
             B[i, :, :] (useful if you want to solve the problem C^T x = b
             with a representation of C)
             DEFAULT: False
+        use_inverse (bool): solve with explicit inverses of the diagonal
+            blocks; otherwise the diagonal blocks are assumed to be lower
+            triangular (e.g. Cholesky factors) and triangular solves are used
+            DEFAULT: False
+        custom_grad (bool): compute the gradient with a single adjoint solve
+            rather than differentiating through the scan (which stores all
+            intermediate results); ignored if `use_inverse` is `True`
+            DEFAULT: True
 
     Returns:
         X (T x n tensor): solutions of Cx = b
 
     """
 
-    if transpose:
-        D = tf.transpose(D, perm=[0, 2, 1])
-        B = tf.transpose(B, perm=[0, 2, 1])
+    X = blk_chol_inv_batch(
+        tf.expand_dims(D, axis=0), tf.expand_dims(B, axis=0),
+        tf.expand_dims(b, axis=0), lower=lower, transpose=transpose,
+        use_inverse=use_inverse, custom_grad=custom_grad)
 
-    def tf_dot(A, x):
-        return tf.reduce_sum(tf.multiply(A, x), axis=1)
-
-    def update(outputs, inputs):
+    return X[0]
 
-        [Di, Bi, bi] = inputs
-        xi = outputs
-        Gi = bi - tf_dot(Bi, xi)
 
-        return tf_dot(tf.matrix_inverse(Di), Gi)
+def blk_chol_inv_batch(
+        D, B, b, lower=True, transpose=False, use_inverse=False,
+        custom_grad=True):
+    """
+    Batched version of `blk_chol_inv`; solves Cx = b for each batch element.
 
-    if lower:
+    Args:
+        D (batch_size x T x n x n tensor): block diagonal matrices
+        B (batch_size x T-1 x n x n tensor): (upper or lower) 1st block
+            off-diagonal matrices
+        b (batch_size x T x n tensor)
+        lower (bool): see `blk_chol_inv`
+        transpose (bool): see `blk_chol_inv`
+        use_inverse (bool): see `blk_chol_inv`
+        custom_grad (bool): see `blk_chol_inv`
 
-        x0 = tf_dot(tf.matrix_inverse(D[0]), b[0])
-        X = tf.scan(
-            fn=update, elems=[D[1:], B, b[1:]], initializer=x0)
-        X = tf.concat([tf.expand_dims(x0, axis=0), X], axis=0)
+    Returns:
+        X (batch_size x T x n tensor): solutions of Cx = b
 
-    else:
+    """
 
-        # computation is the same, just need to reverse the order in which we
-        # iterate over the blocks
-        xN = tf_dot(tf.matrix_inverse(D[-1]), b[-1])
-        X = tf.scan(
-            fn=update, elems=[D[:-1][::-1], B[::-1], b[:-1][::-1]],
-            initializer=xN)
-        # reverse results to put back in correct order
-        X = tf.concat([tf.expand_dims(xN, axis=0), X], axis=0)[::-1]
+    X = blk_chol_inv_multi_batch(
+        D, B, tf.expand_dims(b, axis=-1), lower=lower, transpose=transpose,
+        use_inverse=use_inverse, custom_grad=custom_grad)
 
-    return X
+    return tf.squeeze(X, axis=-1)
 
 
-def blk_chol_inv_multi(D, B, y, lower=True, transpose=False):
+def blk_chol_inv_multi(
+        D, B, y, lower=True, transpose=False, use_inverse=False,
+        custom_grad=True):
     """
     Solve the equation C[x_1 ... x_N] = [y_1 ... y_N] for x_i, where C is
     assumed to be a block-bidiagonal matrix (where only the first (lower or
@@ -143,36 +588,116 @@ def blk_chol_inv_multi(D, B, y, lower=True, transpose=False):
             B[i, :, :] (useful if you want to solve the problem C^T x = y
             with a representation of C)
             DEFAULT: False
+        use_inverse (bool): solve with explicit inverses of the diagonal
+            blocks; otherwise the diagonal blocks are assumed to be lower
+            triangular (e.g. Cholesky factors) and triangular solves are used
+            DEFAULT: False
+        custom_grad (bool): compute the gradient with a single adjoint solve
+            rather than differentiating through the scan (which stores all
+            intermediate results); ignored if `use_inverse` is `True`
+            DEFAULT: True
 
     Returns:
         T x K x N tensor: solutions of CX = Y
 
     """
 
+    X = blk_chol_inv_multi_batch(
+        tf.expand_dims(D, axis=0), tf.expand_dims(B, axis=0),
+        tf.expand_dims(y, axis=0), lower=lower, transpose=transpose,
+        use_inverse=use_inverse, custom_grad=custom_grad)
+
+    return X[0]
+
+
+def blk_chol_inv_multi_batch(
+        D, B, y, lower=True, transpose=False, use_inverse=False,
+        custom_grad=True):
+    """
+    Batched version of `blk_chol_inv_multi`; solves CX = Y for each batch
+    element. The recursion is a scan over time only; each step operates on all
+    batch elements at once.
+
+    Args:
+        D (batch_size x T x K x K tensor): block diagonal matrices
+        B (batch_size x T-1 x K x K tensor): (upper or lower) 1st block
+            off-diagonal matrices
+        y (batch_size x T x K x N tensor)
+        lower (bool): see `blk_chol_inv_multi`
+        transpose (bool): see `blk_chol_inv_multi`
+        use_inverse (bool): see `blk_chol_inv_multi`
+        custom_grad (bool): see `blk_chol_inv_multi`
+
+    Returns:
+        batch_size x T x K x N tensor: solutions of CX = Y
+
+    """
+
+    if use_inverse or not custom_grad:
+        return _blk_chol_inv_multi_batch(
+            D, B, y, lower=lower, transpose=transpose, use_inverse=use_inverse)
+
+    @tf.custom_gradient
+    def solve(D, B, y):
+        X = _blk_chol_inv_multi_batch(
+            D, B, y, lower=lower, transpose=transpose)
+
+        def grad(grad_X):
+            return _blk_chol_inv_multi_grad(
+                D, B, X, grad_X, lower=lower, transpose=transpose)
+
+        return X, grad
+
+    return solve(D, B, y)
+
+
+def _blk_chol_inv_multi_batch(
+        D, B, y, lower=True, transpose=False, use_inverse=False):
+    """Recursion for `blk_chol_inv_multi_batch` without the custom gradient"""
+
     if transpose:
-        D = tf.transpose(D, perm=[0, 2, 1])
-        B = tf.transpose(B, perm=[0, 2, 1])
+        B = tf.transpose(B, perm=[0, 1, 3, 2])
+
+    if use_inverse:
+        if transpose:
+            D = tf.transpose(D, perm=[0, 1, 3, 2])
+
+        def solve(Di, yi):
+            return tf.matmul(tf.matrix_inverse(Di), yi)
+    else:
+        # lower triangular diagonal blocks; solve the transposed (upper
+        # triangular) system directly rather than transposing the blocks
+        def solve(Di, yi):
+            return tf.matrix_triangular_solve(
+                Di, yi, lower=True, adjoint=transpose)
 
     def update(outputs, inputs):
         """
 
         Args:
-            outputs (K x S tf.Tensor): RHS of CX=Y for a single time point
-            inputs (list of tf.Tensors): Di (K x K), Bi (K x K), yi (K x S):
+            outputs (batch_size x K x S tf.Tensor): RHS of CX=Y for a single
+                time point
+            inputs (list of tf.Tensors): Di (batch_size x K x K),
+                Bi (batch_size x K x K), yi (batch_size x K x S)
 
         Returns:
-            xi (K x S): LHS X of CX=Y for a single time point
+            xi (batch_size x K x S): LHS X of CX=Y for a single time point
 
         """
         [Di, Bi, yi] = inputs
         xi = outputs
         Gi = yi - tf.matmul(Bi, xi)
 
-        return tf.matmul(tf.matrix_inverse(Di), Gi)
+        return solve(Di, Gi)
+
+    # scan over time dimension: T x batch_size x K x K
+    D = tf.transpose(D, perm=[1, 0, 2, 3])
+    B = tf.transpose(B, perm=[1, 0, 2, 3])
+    y = tf.transpose(y, perm=[1, 0, 2, 3])
 
     if lower:
 
-        x0 = tf.matmul(tf.matrix_inverse(D[0]), y[0])
+        x0 = solve(D[0], y[0])
         X = tf.scan(
             fn=update, elems=[D[1:], B, y[1:]], initializer=x0)
         X = tf.concat([tf.expand_dims(x0, axis=0), X], axis=0)
@@ -181,14 +706,392 @@ def blk_chol_inv_multi(D, B, y, lower=True, transpose=False):
 
         # computation is the same, just need to reverse the order in which we
         # iterate over the blocks
-        xN = tf.matmul(tf.matrix_inverse(D[-1]), y[-1])
+        xN = solve(D[-1], y[-1])
         X = tf.scan(
             fn=update, elems=[D[:-1][::-1], B[::-1], y[:-1][::-1]],
             initializer=xN)
         # reverse results to put back in correct order
         X = tf.concat([tf.expand_dims(xN, axis=0), X], axis=0)[::-1]
 
-    return X
+    # move batch dimension back to front
+    return tf.transpose(X, perm=[1, 0, 2, 3])
+
+
+def _blk_chol_inv_multi_grad(D, B, X, grad_X, lower=True, transpose=False):
+    """
+    Adjoint of the block-bidiagonal solve CX = Y; the gradient with respect to
+    Y is a single solve with C^T, and the gradients with respect to the blocks
+    of C are the corresponding blocks of -grad_Y X^T
+
+    Args:
+        D (batch_size x T x K x K tensor): lower triangular block diagonal
+            matrices
+        B (batch_size x T-1 x K x K tensor): (upper or lower) 1st block
+            off-diagonal matrices
+        X (batch_size x T x K x N tensor): solutions of CX = Y
+        grad_X (batch_size x T x K x N tensor): gradient with respect to X
+        lower (bool): see `blk_chol_inv_multi`
+        transpose (bool): see `blk_chol_inv_multi`
+
+    Returns:
+        list of tensors: gradients with respect to D, B and Y
+
+    """
+
+    # C^T has the off-diagonal blocks on the opposite side of the diagonal
+    grad_Y = _blk_chol_inv_multi_batch(
+        D, B, grad_X, lower=not lower, transpose=not transpose)
+
+    if transpose:
+        # blocks of C are transposed blocks of D and B
+        grad_D = -tf.matmul(X, grad_Y, transpose_b=True)
+        if lower:
+            grad_B = -tf.matmul(X[:, :-1], grad_Y[:, 1:], transpose_b=True)
+        else:
+            grad_B = -tf.matmul(X[:, 1:], grad_Y[:, :-1], transpose_b=True)
+    else:
+        grad_D = -tf.matmul(grad_Y, X, transpose_b=True)
+        if lower:
+            grad_B = -tf.matmul(grad_Y[:, 1:], X[:, :-1], transpose_b=True)
+        else:
+            grad_B = -tf.matmul(grad_Y[:, :-1], X[:, 1:], transpose_b=True)
+
+    # only the lower triangle of the diagonal blocks is used by the solve
+    grad_D = tf.matrix_band_part(grad_D, -1, 0)
+
+    return [grad_D, grad_B, grad_Y]
+
+
+def _parallel_scan(fn, elems):
+    """
+    Inclusive prefix scan over the leading (time) dimension of `elems` using
+    the Hillis-Steele scheme; requires O(log T) sequential steps rather than
+    the O(T) steps of `tf.scan`, at the cost of O(T log T) total work.
+
+    Args:
+        fn (callable): associative binary operator; fn(a, b) combines the
+            earlier elements a with the later elements b, where a and b are
+            lists of tensors with matching leading dimensions
+        elems (list of tensors): each of shape T x ...; T must be known when
+            the graph is constructed
+
+    Returns:
+        list of tensors: prefix combinations, same shapes as `elems`
+
+    """
+
+    num_time_pts = int(elems[0].shape[0])
+
+    offset = 1
+    while offset < num_time_pts:
+        combined = fn(
+            [elem[:-offset] for elem in elems],
+            [elem[offset:] for elem in elems])
+        elems = [tf.concat([elem[:offset], comb], axis=0)
+                 for elem, comb in zip(elems, combined)]
+        offset *= 2
+
+    return elems
+
+
+def blk_tridiag_chol_parallel(D, B):
+    """
+    Compute the Cholesky decomposition of a batch of symmetric, positive
+    definite block-tridiagonal matrices in O(log T) sequential steps.
+
+    The Schur complements S_t = D_t - B_t S_{t-1}^{-1} B_t^T, whose Cholesky
+    factors are the diagonal blocks of the decomposition, are computed with a
+    parallel prefix scan. Each scan element represents a contiguous chain of
+    blocks with its interior eliminated, i.e. a 2 x 2 block matrix
+    [[P, R^T], [R, U]] coupling the node preceding the chain to its last node;
+    joining two chains eliminates their shared node, which is associative.
+    Returns the same blocks as `blk_tridiag_chol_batch`.
+
+    Args:
+        D (batch_size x T x n x n tensor): block diagonal matrices
+        B (batch_size x T-1 x n x n tensor): (lower) 1st block off-diagonal
+            matrices
+
+    Returns:
+        chol_blocks (list of tensors)
+            chol_blocks[0] (batch_size x T x n x n tensor): block diagonal
+                elements of Cholesky decomposition
+            chol_blocks[1] (batch_size x T-1 x n x n tensor): (lower) 1st
+                block off-diagonal elements of Cholesky decomposition
+
+    """
+
+    def eliminate(elems_a, elems_b):
+        [P1, R1, U1] = elems_a
+        [P2, R2, U2] = elems_b
+        # eliminate node shared by the two chains
+        K_chol = tf.cholesky(U1 + P2)
+        W1 = tf.matrix_triangular_solve(K_chol, R1, lower=True)
+        W2 = tf.matrix_triangular_solve(
+            K_chol, tf.matrix_transpose(R2), lower=True)
+        P = P1 - tf.matmul(W1, W1, transpose_a=True)
+        R = -tf.matmul(W2, W1, transpose_a=True)
+        U = U2 - tf.matmul(W2, W2, transpose_a=True)
+        return [P, R, U]
+
+    # scan over time dimension: T x batch_size x n x n
+    D = tf.transpose(D, perm=[1, 0, 2, 3])
+    B = tf.transpose(B, perm=[1, 0, 2, 3])
+
+    # first chain is not coupled to a preceding node
+    R = tf.concat([tf.zeros_like(D[:1]), B], axis=0)
+    P = tf.zeros_like(D)
+
+    # last nodes of the prefix chains hold the Schur complements
+    [_, _, S] = _parallel_scan(eliminate, [P, R, D])
+
+    L = tf.cholesky(S)
+    # C_t = B_t L_{t-1}^{-T} for all time points at once
+    C = tf.matrix_transpose(tf.matrix_triangular_solve(
+        L[:-1], tf.matrix_transpose(B), lower=True))
+
+    # move batch dimension back to front
+    return [tf.transpose(L, perm=[1, 0, 2, 3]),
+            tf.transpose(C, perm=[1, 0, 2, 3])]
+
+
+def blk_chol_inv_parallel(D, B, b, lower=True, transpose=False):
+    """
+    Parallel-in-time version of `blk_chol_inv_batch`; see
+    `blk_chol_inv_multi_parallel`
+
+    Args:
+        D (batch_size x T x n x n tensor): lower triangular block diagonal
+            matrices
+        B (batch_size x T-1 x n x n tensor): (upper or lower) 1st block
+            off-diagonal matrices
+        b (batch_size x T x n tensor)
+        lower (bool): see `blk_chol_inv`
+        transpose (bool): see `blk_chol_inv`
+
+    Returns:
+        X (batch_size x T x n tensor): solutions of Cx = b
+
+    """
+
+    X = blk_chol_inv_multi_parallel(
+        D, B, tf.expand_dims(b, axis=-1), lower=lower, transpose=transpose)
+
+    return tf.squeeze(X, axis=-1)
+
+
+def blk_chol_inv_multi_parallel(D, B, y, lower=True, transpose=False):
+    """
+    Solve the equation CX = Y for each batch element in O(log T) sequential
+    steps, where C is a block-bidiagonal matrix with lower triangular diagonal
+    blocks (e.g. the output of `blk_tridiag_chol_parallel`).
+
+    The block substitution x_t = M_t x_{t-1} + v_t is an affine recursion;
+    affine maps compose associatively, so all x_t are computed with a
+    parallel prefix scan. Returns the same solutions as
+    `blk_chol_inv_multi_batch`.
+
+    Args:
+        D (batch_size x T x K x K tensor): lower triangular block diagonal
+            matrices
+        B (batch_size x T-1 x K x K tensor): (upper or lower) 1st block
+            off-diagonal matrices
+        y (batch_size x T x K x N tensor)
+        lower (bool): see `blk_chol_inv_multi`
+        transpose (bool): see `blk_chol_inv_multi`
+
+    Returns:
+        batch_size x T x K x N tensor: solutions of CX = Y
+
+    """
+
+    def compose(elems_a, elems_b):
+        [M1, v1] = elems_a
+        [M2, v2] = elems_b
+        return [tf.matmul(M2, M1), tf.matmul(M2, v1) + v2]
+
+    if transpose:
+        B = tf.transpose(B, perm=[0, 1, 3, 2])
+
+    # scan over time dimension: T x batch_size x K x K
+    D = tf.transpose(D, perm=[1, 0, 2, 3])
+    B = tf.transpose(B, perm=[1, 0, 2, 3])
+    y = tf.transpose(y, perm=[1, 0, 2, 3])
+
+    if lower:
+        # x_t depends on x_{t-1} through B_{t-1}
+        D_coupled = D[1:]
+    else:
+        # x_t depends on x_{t+1} through B_t; iterate backwards in time
+        D_coupled = D[:-1]
+
+    v = tf.matrix_triangular_solve(D, y, lower=True, adjoint=transpose)
+    M = -tf.matrix_triangular_solve(
+        D_coupled, B, lower=True, adjoint=transpose)
+
+    if lower:
+        M = tf.concat([tf.zeros_like(M[:1]), M], axis=0)
+        [_, X] = _parallel_scan(compose, [M, v])
+    else:
+        M = tf.concat([M, tf.zeros_like(M[:1])], axis=0)
+        [_, X] = _parallel_scan(compose, [M[::-1], v[::-1]])
+        X = X[::-1]
+
+    # move batch dimension back to front
+    return tf.transpose(X, perm=[1, 0, 2, 3])
+
+
+def blk_chol_selective_inv(D, B):
+    """
+    Compute the diagonal and 1st (lower) off-diagonal blocks of the inverse of
+    a symmetric, positive definite block-tridiagonal matrix from its
+    block-bidiagonal Cholesky factor, without forming the full inverse.
+
+    With S = (L L^T)^{-1} and G_t = L_t^{-T} C_t^T, the blocks of S satisfy
+    the backward recursion
+        S_{t,t} = L_t^{-T} L_t^{-1} + G_t S_{t+1,t+1} G_t^T
+        S_{t+1,t} = -S_{t+1,t+1} G_t^T
+    which requires O(T n^3) operations.
+
+    Args:
+        D (T x n x n tensor): block diagonal elements of the Cholesky
+            decomposition (output of `blk_tridiag_chol`)
+        B (T-1 x n x n tensor): (lower) 1st block off-diagonal elements of the
+            Cholesky decomposition
+
+    Returns:
+        inv_blocks (list of tensors)
+            inv_blocks[0] (T x n x n tensor): block diagonal elements of the
+                inverse
+            inv_blocks[1] (T-1 x n x n tensor): (lower) 1st block off-diagonal
+                elements of the inverse
+
+    """
+
+    inv_blocks = blk_chol_selective_inv_batch(
+        tf.expand_dims(D, axis=0), tf.expand_dims(B, axis=0))
+
+    return [inv_blocks[0][0], inv_blocks[1][0]]
+
+
+def blk_chol_selective_inv_batch(D, B, parallel=False):
+    """
+    Batched version of `blk_chol_selective_inv`
+
+    Args:
+        D (batch_size x T x n x n tensor): block diagonal elements of the
+            Cholesky decompositions
+        B (batch_size x T-1 x n x n tensor): (lower) 1st block off-diagonal
+            elements of the Cholesky decompositions
+        parallel (bool): compute the backward recursion with a parallel prefix
+            scan in O(log T) sequential steps rather than a scan over time
+            DEFAULT: False
+
+    Returns:
+        inv_blocks (list of tensors)
+            inv_blocks[0] (batch_size x T x n x n tensor): block diagonal
+                elements of the inverse
+            inv_blocks[1] (batch_size x T-1 x n x n tensor): (lower) 1st block
+                off-diagonal elements of the inverse
+
+    """
+
+    def update(outputs, inputs):
+        S = outputs
+        [Pi, Gi] = inputs
+        return Pi + tf.matmul(tf.matmul(Gi, S), Gi, transpose_b=True)
+
+    def compose(elems_a, elems_b):
+        [G1, P1] = elems_a
+        [G2, P2] = elems_b
+        return [tf.matmul(G2, G1),
+                tf.matmul(tf.matmul(G2, P1), G2, transpose_b=True) + P2]
+
+    # scan over time dimension: T x batch_size x n x n
+    D = tf.transpose(D, perm=[1, 0, 2, 3])
+    B = tf.transpose(B, perm=[1, 0, 2, 3])
+
+    # terms that do not depend on the recursion, for all time points at once
+    eye = tf.eye(tf.shape(D)[-1], batch_shape=tf.shape(D)[:2], dtype=D.dtype)
+    D_inv = tf.matrix_triangular_solve(D, eye, lower=True)
+    P = tf.matmul(D_inv, D_inv, transpose_a=True)
+    G = tf.matrix_triangular_solve(
+        D[:-1], tf.matrix_transpose(B), lower=True, adjoint=True)
+
+    # backward recursion for diagonal blocks
+    if parallel:
+        G_rev = tf.concat([tf.zeros_like(G[:1]), G[::-1]], axis=0)
+        [_, S_diag] = _parallel_scan(compose, [G_rev, P[::-1]])
+        S_diag = S_diag[::-1]
+    else:
+        S_diag = tf.scan(
+            fn=update, elems=[P[:-1][::-1], G[::-1]], initializer=P[-1])
+        S_diag = tf.concat([S_diag[::-1], P[-1:]], axis=0)
+
+    S_ldiag = -tf.matmul(S_diag[1:], G, transpose_b=True)
+
+    # move batch dimension back to front
+    return [tf.transpose(S_diag, perm=[1, 0, 2, 3]),
+            tf.transpose(S_ldiag, perm=[1, 0, 2, 3])]
+
+
+def blk_diag(blocks):
+    """
+    Assemble a dense block-diagonal matrix
+
+    Args:
+        blocks (list of n_i x n_i tensors)
+
+    Returns:
+        sum(n_i) x sum(n_i) tensor
+
+    """
+
+    dims = [int(block.shape[0]) for block in blocks]
+    rows = []
+    indx_start = 0
+    for block, dim in zip(blocks, dims):
+        indx_end = indx_start + dim
+        rows.append(tf.pad(
+            block, [[0, 0], [indx_start, sum(dims) - indx_end]]))
+        indx_start = indx_end
+
+    return tf.concat(rows, axis=0)
+
+
+def blk_diag_low_rank_apply(blocks, factors, x):
+    """
+    Apply a block-diagonal plus low-rank matrix M = blk_diag(blocks) + U V^T
+    to the row vectors of x, i.e. compute x M^T, without forming M; requires
+    O(sum(n_i^2) + n r) rather than O(n^2) operations per row
+
+    Args:
+        blocks (list of n_i x n_i tensors)
+        factors (list of two n x r tensors [U, V]): low-rank part; `None` for
+            a block-diagonal matrix
+        x (... x n tensor)
+
+    Returns:
+        ... x n tensor
+
+    """
+
+    axis = len(x.shape) - 1
+    outputs = []
+    indx_start = 0
+    for block in blocks:
+        indx_end = indx_start + int(block.shape[0])
+        outputs.append(tf.tensordot(
+            x[..., indx_start:indx_end], block, axes=[[axis], [1]]))
+        indx_start = indx_end
+    y = tf.concat(outputs, axis=axis)
+
+    if factors is not None:
+        y += tf.tensordot(
+            tf.tensordot(x, factors[1], axes=[[axis], [0]]), factors[0],
+            axes=[[axis], [1]])
+
+    return y
 
 
 if __name__ == '__main__':
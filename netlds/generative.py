@@ -3,6 +3,7 @@
 import numpy as np
 import tensorflow as tf
 from netlds.network import Network
+from netlds.chol_utils import blk_diag, blk_diag_low_rank_apply
 
 
 class GenerativeModel(object):
@@ -37,7 +38,7 @@ class GenerativeModel(object):
         """Build tensorflow computation graph for generative model"""
         raise NotImplementedError
 
-    def log_density(self, y, z):
+    def log_density(self, y, z, y_consts=None, y_sparse=None):
         """Evaluate log density of generative model"""
         raise NotImplementedError
 
@@ -59,7 +60,9 @@ class NetFLDS(GenerativeModel):
     def __init__(
             self, dim_obs=None, dim_latent=None, linear_predictors=None,
             num_time_pts=None, gen_params=None, noise_dist='gaussian',
-            nn_params=None, post_z_samples=None):
+            nn_params=None, post_z_samples=None, grouped_readout=False,
+            poisson_link='softplus', innovation_rank=None,
+            block_dynamics=False, coupling_rank=0):
         """
         Args:
             dim_obs (list): observation dimension for each population
@@ -78,12 +81,46 @@ class NetFLDS(GenerativeModel):
             gen_params (dict): dictionary of generative params for initializing
                 model
             noise_dist (str): 'gaussian' | 'poisson'
+            poisson_link (str): 'softplus' | 'exponential'; nonlinearity
+                mapping the output of the final layer to poisson rates
             nn_params (list): dictionaries for building each layer of the
                 mapping from the latent space to observations; the same
                 network architecture is used for each population
             post_z_samples (batch_size x num_mc_samples x num_time_pts x
                 dim_latent tf.Tensor): samples from the (appx) posterior of the
                 latent states
+            grouped_readout (bool): `True` to apply the mappings of all
+                populations as a single block-diagonal network and evaluate
+                the per-population likelihoods with segment reductions,
+                rather than building separate ops for each population;
+                variables are still created for each population
+            innovation_rank (int, optional): if not `None`, the innovation
+                covariance is parameterized as diagonal plus low-rank,
+                Q = diag(q^2) + V V^T with V of size dim_latent x
+                `innovation_rank`, and the prior density and samples use
+                this structure (Woodbury identity and matrix determinant
+                lemma) rather than a dense Cholesky factor; initial values
+                can be specified with the 'Q_diag_sqrt' and 'Q_factor' keys of
+                `gen_params`
+            block_dynamics (bool): `True` to constrain the dynamics to
+                within-population blocks plus low-rank coupling across
+                populations, A = blk_diag(A_i) + U V^T and
+                Q = blk_diag(Q_i) + W W^T, where the ith block acts on the
+                latent states of the ith population; the prior density,
+                prior samples and the precision assembly of SmoothingLDS then
+                use per-population blocks rather than dense matrices. Initial
+                values of the blocks are taken from the diagonal blocks of the
+                'A' and 'Q_sqrt' Q_sqrt^T entries of `gen_params`, if present
+            coupling_rank (int): rank of the cross-population coupling terms
+                U V^T and W W^T when `block_dynamics` is `True`; 0 for
+                block-diagonal dynamics
+
+        Raises:
+            ValueError: if `grouped_readout` is `True` and linear predictors
+                are specified
+            ValueError: if `poisson_link` is not a valid string
+            ValueError: if `block_dynamics` is `True` and `innovation_rank`
+                is specified
 
         """
 
@@ -101,6 +138,15 @@ class NetFLDS(GenerativeModel):
             else:
                 predictor_params = None
 
+        self.grouped_readout = grouped_readout
+        if grouped_readout and self.dim_predictors is not None:
+            raise ValueError(
+                'grouped readouts are not available with linear predictors')
+        # population of each observation dimension, for segment reductions
+        self.obs_segment_ids = np.concatenate(
+            [pop * np.ones(pop_dim, dtype=np.int32)
+             for pop, pop_dim in enumerate(dim_obs)])
+
         self.num_time_pts = num_time_pts
         if gen_params is None:
             self.gen_params = {}
@@ -112,9 +158,24 @@ class NetFLDS(GenerativeModel):
         if noise_dist is 'gaussian':
             activation = 'linear'
         elif noise_dist is 'poisson':
-            activation = 'softplus'
+            if poisson_link not in ['softplus', 'exponential']:
+                raise ValueError(
+                    '"%s" is not a valid string for specifying the poisson '
+                    'link function' % poisson_link)
+            # literal strings; `Network` matches activations with `is`
+            if poisson_link == 'exponential':
+                activation = 'exponential'
+            else:
+                activation = 'softplus'
         else:
             raise ValueError
+        self.poisson_link = poisson_link
+        self.innovation_rank = innovation_rank
+        if block_dynamics and innovation_rank is not None:
+            raise ValueError(
+                'innovation_rank is not available with block dynamics')
+        self.block_dynamics = block_dynamics
+        self.coupling_rank = coupling_rank
 
         if nn_params is None:
             # use Network defaults
@@ -168,6 +229,9 @@ class NetFLDS(GenerativeModel):
             self.R_sqrt = []
             self.R = []
             self.R_inv = []
+        # set by `initialize_readout_vars` when the readout variables are
+        # created ahead of `build_graph`
+        self.readout_vars_initialized = False
 
     def build_graph(self, z_samples, lin_preds, param_dict):
         """
@@ -188,11 +252,30 @@ class NetFLDS(GenerativeModel):
         self.Q_sqrt = param_dict['Q_sqrt']
         self.Q0 = param_dict['Q0']
         self.Q = param_dict['Q']
-        self.Q0_inv = param_dict['Q0_inv']
-        self.Q_inv = param_dict['Q_inv']
+        self.Q0_chol = param_dict['Q0_chol']
+        self.Q_chol = param_dict['Q_chol']
+        self.Q_diag = param_dict['Q_diag']
+        self.Q_factor = param_dict['Q_factor']
+        self.Q_inv_factor = param_dict['Q_inv_factor']
+        self.Q_cap_chol = param_dict['Q_cap_chol']
+        self.Q_blk_chols = param_dict['Q_blk_chols']
+        self.A_blocks = param_dict['A_blocks']
+        self.A_factors = param_dict['A_factors']
 
         self.lin_predictors = lin_preds
         
+        if self.grouped_readout:
+            self._build_grouped_readout(z_samples)
+        else:
+            self._build_readout(z_samples)
+
+        # define branch of graph for evaluating prior model
+        with tf.variable_scope('generative_samples'):
+            self._sample_yz()
+
+    def _build_readout(self, z_samples):
+        """Map latent states to observations separately for each population"""
+
         # keep track of which latent states belong to each population
         indx_start = 0
         for pop, pop_dim_latent in enumerate(self.dim_latent):
@@ -231,11 +314,72 @@ class NetFLDS(GenerativeModel):
                         self.y_pred_lp[-1])))
                 else:
                     self.y_pred.append(self.y_pred_ls[-1])
-                self._initialize_noise_dist_vars(pop)
+                if not self.readout_vars_initialized:
+                    self._initialize_noise_dist_vars(pop)
 
-        # define branch of graph for evaluating prior model
-        with tf.variable_scope('generative_samples'):
-            self._sample_yz()
+    def _build_grouped_readout(self, z_samples):
+        """
+        Map latent states to observations of all populations at once, using
+        one block-diagonal kernel per layer assembled from the variables of
+        each population's network
+        """
+
+        # create variables of each population's network
+        indx_start = 0
+        for pop, pop_dim_latent in enumerate(self.dim_latent):
+            with tf.variable_scope(str('population_%02i' % pop)):
+                with tf.variable_scope('latent_space_mapping'):
+                    self.networks[pop].build_graph()
+                    if not self.networks[pop].layers[0].built:
+                        self.networks[pop].apply_network(
+                            tf.zeros([1, pop_dim_latent], dtype=self.dtype))
+                    indx_end = indx_start + pop_dim_latent
+                    self.latent_indxs.append(
+                        np.arange(indx_start, indx_end+1, dtype=np.int32))
+                    indx_start = indx_end
+                if not self.readout_vars_initialized:
+                    self._initialize_noise_dist_vars(pop)
+
+        # block-diagonal kernels and concatenated biases of each layer
+        with tf.variable_scope('grouped_readout'):
+            self.grouped_layers = []
+            dims_in = list(self.dim_latent)
+            for layer_num, layer_params in enumerate(self.networks[0].params):
+                kernels = []
+                indx_start = 0
+                for pop, network in enumerate(self.networks):
+                    indx_end = indx_start + dims_in[pop]
+                    kernels.append(tf.pad(
+                        network.layers[layer_num].kernel,
+                        [[indx_start, sum(dims_in) - indx_end], [0, 0]]))
+                    indx_start = indx_end
+                self.grouped_layers.append({
+                    'kernel': tf.concat(kernels, axis=1),
+                    'bias': tf.concat(
+                        [network.layers[layer_num].bias
+                         for network in self.networks], axis=0),
+                    'activation': layer_params['activation']})
+                dims_in = [network.layers[layer_num].units
+                           for network in self.networks]
+
+            # batch_size x num_mc_samples x num_time_pts x sum(dim_obs)
+            self.y_pred_grouped = self._apply_grouped_readout(z_samples)
+
+        # per-population views for code that expects them
+        self.y_pred_ls = tf.split(self.y_pred_grouped, self.dim_obs, axis=3)
+        self.y_pred = list(self.y_pred_ls)
+
+    def _apply_grouped_readout(self, z):
+        """Apply block-diagonal network to latent states along last axis"""
+
+        for layer in self.grouped_layers:
+            z = tf.tensordot(
+                z, layer['kernel'], axes=[[len(z.shape) - 1], [0]]) \
+                + layer['bias']
+            if layer['activation'] is not None:
+                z = layer['activation'](z)
+
+        return z
 
     def initialize_prior_vars(self):
         """Initialize variables of prior"""
@@ -258,7 +402,9 @@ class NetFLDS(GenerativeModel):
                 dtype=self.dtype)
 
         # means of transition matrix
-        if 'A' in self.gen_params:
+        if self.block_dynamics:
+            A = None
+        elif 'A' in self.gen_params:
             A = tf.get_variable(
                 'A',
                 initializer=self.gen_params['A'],
@@ -271,7 +417,9 @@ class NetFLDS(GenerativeModel):
                 dtype=self.dtype)
 
         # square root of the innovation precision matrix
-        if 'Q_sqrt' in self.gen_params:
+        if self.innovation_rank is not None or self.block_dynamics:
+            Q_sqrt = None
+        elif 'Q_sqrt' in self.gen_params:
             Q_sqrt = tf.get_variable(
                 'Q_sqrt',
                 initializer=self.gen_params['Q_sqrt'],
@@ -307,21 +455,362 @@ class NetFLDS(GenerativeModel):
 
         if sum(self.dim_latent) > 1:
             Q0 = tf.matmul(Q0_sqrt, Q0_sqrt, transpose_b=True, name='Q0') + diag
-            Q = tf.matmul(Q_sqrt, Q_sqrt, transpose_b=True, name='Q') + diag
         else:
             Q0 = tf.square(Q0_sqrt, name='Q0') + diag
-            Q = tf.square(Q_sqrt, name='Q') + diag
 
-        Q0_inv = tf.matrix_inverse(Q0, name='Q0_inv')
-        Q_inv = tf.matrix_inverse(Q, name='Q_inv')
+        # lower-triangular cholesky factors; used for log-determinants and
+        # solves in place of determinants and general matrix inverses (dense
+        # inverses are only built on request, see
+        # `initialize_prior_precisions`)
+        Q0_chol = tf.cholesky(Q0, name='Q0_chol')
 
         param_dict = {
-            'z0_mean': z0_mean, 'A': A,
-            'Q_sqrt': Q_sqrt, 'Q': Q, 'Q_inv': Q_inv,
-            'Q0_sqrt': Q0_sqrt, 'Q0': Q0, 'Q0_inv': Q0_inv}
+            'z0_mean': z0_mean, 'A': A, 'A_blocks': None, 'A_factors': None,
+            'Q0_sqrt': Q0_sqrt, 'Q0': Q0, 'Q0_chol': Q0_chol,
+            'Q_blk_chols': None}
+
+        if self.block_dynamics:
+            param_dict.update(self._initialize_block_dynamics())
+        elif self.innovation_rank is None:
+            if sum(self.dim_latent) > 1:
+                Q = tf.matmul(Q_sqrt, Q_sqrt, transpose_b=True, name='Q') \
+                    + diag
+            else:
+                Q = tf.square(Q_sqrt, name='Q') + diag
+            Q_chol = tf.cholesky(Q, name='Q_chol')
+            param_dict.update({
+                'Q_sqrt': Q_sqrt, 'Q': Q, 'Q_chol': Q_chol, 'Q_diag': None,
+                'Q_factor': None, 'Q_inv_factor': None, 'Q_cap_chol': None})
+        else:
+            param_dict.update(self._initialize_low_rank_innovations())
 
         return param_dict
 
+    def initialize_prior_precisions(self, param_dict):
+        """
+        Dense inverses of the initial and innovation covariance matrices, for
+        inference networks that assemble the prior precision explicitly (see
+        `InferenceNetwork.requires_prior_precisions`); the generative model
+        itself only solves against the cholesky factors
+
+        Args:
+            param_dict (dict): output of `initialize_prior_vars`
+
+        Returns:
+            dict: 'Q0_inv' and 'Q_inv' (dim_latent x dim_latent tf.Tensors)
+
+        """
+
+        eye = tf.eye(sum(self.dim_latent), dtype=self.dtype)
+        Q0_inv = tf.cholesky_solve(param_dict['Q0_chol'], eye, name='Q0_inv')
+
+        if param_dict['Q_blk_chols'] is not None:
+            # inverse of blk_diag(Q_i) from the cholesky factor of each block
+            Q_inv = blk_diag([
+                tf.cholesky_solve(chol, tf.eye(
+                    int(chol.shape[0]), dtype=self.dtype))
+                for chol in param_dict['Q_blk_chols']])
+        elif param_dict['Q_diag'] is not None:
+            Q_inv = tf.matrix_diag(1.0 / param_dict['Q_diag'])
+        else:
+            Q_inv = tf.cholesky_solve(param_dict['Q_chol'], eye)
+
+        # woodbury identity; Q^-1 = B^-1 - W W^T for Q = B + V V^T
+        if param_dict['Q_inv_factor'] is not None:
+            Q_inv -= tf.matmul(
+                param_dict['Q_inv_factor'], param_dict['Q_inv_factor'],
+                transpose_b=True)
+
+        return {'Q0_inv': Q0_inv, 'Q_inv': tf.identity(Q_inv, name='Q_inv')}
+
+    def _initialize_low_rank_innovations(self):
+        """
+        Variables and derived quantities of the innovation covariance
+        Q = diag(q^2) + V V^T
+
+        Returns:
+            dict: 'Q_diag' (diagonal of Q that is not explained by V),
+                'Q_factor' (V), 'Q_cap_chol' (cholesky factor of the
+                capacitance matrix I + V^T diag(Q_diag)^-1 V) and
+                'Q_inv_factor' (W, with Q^-1 = diag(Q_diag)^-1 - W W^T), as
+                well as dense versions of 'Q', 'Q_chol' and 'Q_sqrt' for
+                code that does not use the structure
+
+        """
+
+        dim_latent = sum(self.dim_latent)
+        tr_norm_initializer = tf.initializers.truncated_normal(
+            mean=0.0, stddev=0.1, dtype=self.dtype)
+
+        if 'Q_diag_sqrt' in self.gen_params:
+            Q_diag_sqrt = tf.get_variable(
+                'Q_diag_sqrt',
+                initializer=self.gen_params['Q_diag_sqrt'],
+                dtype=self.dtype)
+        else:
+            Q_diag_sqrt = tf.get_variable(
+                'Q_diag_sqrt',
+                initializer=np.ones(
+                    dim_latent, dtype=self.dtype.as_numpy_dtype()),
+                dtype=self.dtype)
+
+        if 'Q_factor' in self.gen_params:
+            Q_factor = tf.get_variable(
+                'Q_factor',
+                initializer=self.gen_params['Q_factor'],
+                dtype=self.dtype)
+        else:
+            Q_factor = tf.get_variable(
+                'Q_factor',
+                shape=[dim_latent, self.innovation_rank],
+                initializer=tr_norm_initializer,
+                dtype=self.dtype)
+
+        Q_diag = tf.add(tf.square(Q_diag_sqrt), 1e-6, name='Q_diag')
+
+        # woodbury identity;
+        # Q^-1 = D^-1 - D^-1 V (I + V^T D^-1 V)^-1 V^T D^-1
+        Q_diag_inv_factor = Q_factor / tf.expand_dims(Q_diag, axis=1)
+        Q_cap_chol = tf.cholesky(
+            tf.eye(self.innovation_rank, dtype=self.dtype)
+            + tf.matmul(Q_factor, Q_diag_inv_factor, transpose_a=True),
+            name='Q_cap_chol')
+        Q_inv_factor = tf.transpose(tf.matrix_triangular_solve(
+            Q_cap_chol, tf.transpose(Q_diag_inv_factor), lower=True),
+            name='Q_inv_factor')
+
+        Q = tf.add(
+            tf.matrix_diag(Q_diag),
+            tf.matmul(Q_factor, Q_factor, transpose_b=True), name='Q')
+
+        return {
+            'Q_sqrt': tf.concat([tf.matrix_diag(Q_diag_sqrt), Q_factor],
+                                axis=1, name='Q_sqrt'),
+            'Q': Q, 'Q_chol': tf.cholesky(Q, name='Q_chol'),
+            'Q_diag': Q_diag, 'Q_factor': Q_factor,
+            'Q_inv_factor': Q_inv_factor, 'Q_cap_chol': Q_cap_chol}
+
+    def _initialize_block_dynamics(self):
+        """
+        Variables and derived quantities of the block-structured dynamics
+        A = blk_diag(A_i) + U V^T and Q = blk_diag(Q_i) + W W^T
+
+        Returns:
+            dict: 'A_blocks' (A_i), 'A_factors' ([U, V]), 'Q_blk_chols'
+                (cholesky factors of the Q_i), 'Q_factor' (W), and
+                'Q_cap_chol' and 'Q_inv_factor' (see
+                `_initialize_low_rank_innovations`, with blk_diag(Q_i) in
+                place of the diagonal); entries of the coupling terms are
+                `None` if `coupling_rank` is 0. Dense versions of 'A', 'Q',
+                'Q_chol' and 'Q_sqrt' are included for code that does not
+                use the structure
+
+        """
+
+        dim_latent = sum(self.dim_latent)
+        np_dtype = self.dtype.as_numpy_dtype()
+        tr_norm_initializer = tf.initializers.truncated_normal(
+            mean=0.0, stddev=0.1, dtype=self.dtype)
+        zeros_initializer = tf.initializers.zeros(dtype=self.dtype)
+
+        if 'A' in self.gen_params:
+            A_init = np.asarray(self.gen_params['A'], dtype=np_dtype)
+        else:
+            A_init = 0.95 * np.eye(dim_latent, dtype=np_dtype)
+        if 'Q_sqrt' in self.gen_params:
+            Q_sqrt_init = np.asarray(self.gen_params['Q_sqrt'], dtype=np_dtype)
+            Q_init = np.matmul(Q_sqrt_init, Q_sqrt_init.T)
+        else:
+            Q_init = np.eye(dim_latent, dtype=np_dtype)
+
+        # within-population blocks
+        A_blocks = []
+        Q_blk_chols = []
+        indx_start = 0
+        for pop, pop_dim_latent in enumerate(self.dim_latent):
+            indx_end = indx_start + pop_dim_latent
+            blk = slice(indx_start, indx_end)
+            A_blocks.append(tf.get_variable(
+                'A_%02i' % pop,
+                initializer=A_init[blk, blk],
+                dtype=self.dtype))
+            Q_sqrt_blk = tf.get_variable(
+                'Q_sqrt_%02i' % pop,
+                initializer=np.linalg.cholesky(Q_init[blk, blk]),
+                dtype=self.dtype)
+            Q_blk_chols.append(tf.cholesky(
+                tf.matmul(Q_sqrt_blk, Q_sqrt_blk, transpose_b=True)
+                + 1e-6 * tf.eye(pop_dim_latent, dtype=self.dtype)))
+            indx_start = indx_end
+
+        Q_sqrt = blk_diag(Q_blk_chols)
+        A = blk_diag(A_blocks)
+        Q = blk_diag([tf.matmul(chol, chol, transpose_b=True)
+                      for chol in Q_blk_chols])
+
+        # cross-population coupling
+        if self.coupling_rank > 0:
+            A_factors = [
+                tf.get_variable(
+                    'A_coupling_left',
+                    shape=[dim_latent, self.coupling_rank],
+                    initializer=tr_norm_initializer,
+                    dtype=self.dtype),
+                tf.get_variable(
+                    'A_coupling_right',
+                    shape=[dim_latent, self.coupling_rank],
+                    initializer=zeros_initializer,
+                    dtype=self.dtype)]
+            Q_factor = tf.get_variable(
+                'Q_factor',
+                shape=[dim_latent, self.coupling_rank],
+                initializer=tr_norm_initializer,
+                dtype=self.dtype)
+
+            # woodbury identity with blk_diag(Q_i) in place of the diagonal;
+            # blk_diag(Q_i)^-1 V from solves with the factor of each block
+            Q_blk_inv_factor = tf.concat([
+                tf.cholesky_solve(chol, factor) for chol, factor in zip(
+                    Q_blk_chols,
+                    tf.split(Q_factor, self.dim_latent, axis=0))],
+                axis=0)
+            Q_cap_chol = tf.cholesky(
+                tf.eye(self.coupling_rank, dtype=self.dtype)
+                + tf.matmul(Q_factor, Q_blk_inv_factor, transpose_a=True),
+                name='Q_cap_chol')
+            Q_inv_factor = tf.transpose(tf.matrix_triangular_solve(
+                Q_cap_chol, tf.transpose(Q_blk_inv_factor), lower=True),
+                name='Q_inv_factor')
+
+            A += tf.matmul(A_factors[0], A_factors[1], transpose_b=True)
+            Q += tf.matmul(Q_factor, Q_factor, transpose_b=True)
+            Q_sqrt = tf.concat([Q_sqrt, Q_factor], axis=1)
+        else:
+            A_factors = None
+            Q_factor = None
+            Q_cap_chol = None
+            Q_inv_factor = None
+
+        return {
+            'A': tf.identity(A, name='A'), 'A_blocks': A_blocks,
+            'A_factors': A_factors,
+            'Q_sqrt': tf.identity(Q_sqrt, name='Q_sqrt'),
+            'Q': tf.identity(Q, name='Q'),
+            'Q_chol': tf.cholesky(Q, name='Q_chol'),
+            'Q_diag': None, 'Q_blk_chols': Q_blk_chols,
+            'Q_factor': Q_factor, 'Q_inv_factor': Q_inv_factor,
+            'Q_cap_chol': Q_cap_chol}
+
+    def has_linear_readout(self):
+        """
+        `True` if each population's mapping from the latent states is a single
+        (generalized) linear layer and there are no linear predictors
+        """
+        return self.dim_predictors is None \
+            and all(len(network.params) == 1 for network in self.networks)
+
+    def is_linear_gaussian(self):
+        """
+        `True` if observations are a linear function of the latent states
+        (plus bias) corrupted by Gaussian noise, with no linear predictors
+        """
+        return self.noise_dist == 'gaussian' and self.has_linear_readout() \
+            and all(network.params[0]['activation'] is None
+                    for network in self.networks)
+
+    def has_analytic_likelihood(self):
+        """
+        `True` if the expected log likelihood under a Gaussian posterior over
+        the latent states has a closed form (linear-Gaussian observations,
+        or linear poisson readouts with an exponential link)
+        """
+        return self.is_linear_gaussian() or (
+            self.noise_dist == 'poisson' and self.has_linear_readout()
+            and self.poisson_link == 'exponential')
+
+    def initialize_readout_vars(self):
+        """
+        Initialize variables of a (generalized) linear observation model
+        before the rest of the generative model is built, for inference
+        networks that need them (e.g. KalmanSmoother, LaplaceLDS); must be
+        called within the same variable scope as `build_graph`
+
+        Returns:
+            dict:
+                'noise_dist' (str): 'gaussian' | 'poisson'
+                'C' (dim_latent x dim_obs tf.Tensor): emissions matrix, with
+                    the kernel of each population's linear mapping on its
+                    block of the latent space (E[y] = f(z C + d))
+                'd' (dim_obs tf.Tensor): biases
+                'R' (1 x dim_obs tf.Tensor): diagonal of observation
+                    covariance matrix; only for 'gaussian' noise
+                'R_inv' (1 x dim_obs tf.Tensor): diagonal of its inverse;
+                    only for 'gaussian' noise
+                'poisson_link' (str): 'softplus' | 'exponential'; only for
+                    'poisson' noise
+
+        Raises:
+            ValueError: if observation model is not a linear-Gaussian or
+                single-layer Poisson model without linear predictors
+
+        """
+
+        if not (self.is_linear_gaussian() or (
+                self.noise_dist == 'poisson' and self.has_linear_readout())):
+            raise ValueError(
+                'readout variables are only available for linear-Gaussian '
+                'or single-layer Poisson observation models without linear '
+                'predictors')
+
+        kernels = []
+        biases = []
+        indx_start = 0
+        for pop, pop_dim_latent in enumerate(self.dim_latent):
+            with tf.variable_scope(str('population_%02i' % pop)):
+                with tf.variable_scope('latent_space_mapping'):
+                    self.networks[pop].build_graph()
+                    layer = self.networks[pop].layers[0]
+                    # create layer variables
+                    layer.apply(
+                        tf.zeros([1, pop_dim_latent], dtype=self.dtype))
+                self._initialize_noise_dist_vars(pop)
+            # place kernel on rows of this population's latent states
+            indx_end = indx_start + pop_dim_latent
+            kernels.append(tf.pad(
+                layer.kernel,
+                [[indx_start, sum(self.dim_latent) - indx_end], [0, 0]]))
+            biases.append(layer.bias)
+            indx_start = indx_end
+
+        self.readout_vars_initialized = True
+
+        param_dict = {
+            'noise_dist': self.noise_dist,
+            'C': tf.concat(kernels, axis=1),
+            'd': tf.concat(biases, axis=0)}
+        if self.noise_dist == 'gaussian':
+            param_dict.update(self.get_noise_covariance())
+        else:
+            param_dict['poisson_link'] = self.poisson_link
+
+        return param_dict
+
+    def get_noise_covariance(self):
+        """
+        Diagonal observation covariance of all populations, as used by the
+        likelihood; inference networks that need the observation model use
+        this rather than their own definition
+
+        Returns:
+            dict:
+                'R' (1 x dim_obs tf.Tensor): diagonal of observation
+                    covariance matrix
+                'R_inv' (1 x dim_obs tf.Tensor): diagonal of its inverse
+
+        """
+        return {'R': tf.concat(self.R, axis=1),
+                'R_inv': tf.concat(self.R_inv, axis=1)}
+
     def _initialize_noise_dist_vars(self, pop):
 
         if self.noise_dist is 'gaussian':
@@ -342,8 +831,10 @@ class NetFLDS(GenerativeModel):
                     shape=[1, self.dim_obs[pop]],
                     initializer=tr_norm_initializer,
                     dtype=self.dtype))
-            self.R.append(tf.square(self.R_sqrt[pop], name='R'))
-            self.R_inv.append(tf.divide(1.0, self.R[pop] + 1e-6, name='R_inv'))
+            # small floor keeps the covariance invertible; it is part of the
+            # covariance used everywhere (likelihood, sampling, inference)
+            self.R.append(tf.add(tf.square(self.R_sqrt[pop]), 1e-6, name='R'))
+            self.R_inv.append(tf.divide(1.0, self.R[pop], name='R_inv'))
 
     def _sample_yz(self):
         """
@@ -365,34 +856,85 @@ class NetFLDS(GenerativeModel):
                    sum(self.dim_latent)],
             mean=0.0, stddev=1.0, dtype=self.dtype, name='latent_rand_samples')
 
-        # get random samples from latent space
-        def lds_update(outputs, inputs):
-            z_val = outputs
-            rand_z = inputs
-            z_val = tf.matmul(z_val, tf.transpose(self.A)) \
-                + tf.matmul(rand_z, tf.transpose(self.Q_sqrt))
-            return z_val
-
-        # calculate samples for first time point
+        # innovations; z_t = A z_{t-1} + u_t with u_0 = z_0
+        # (num_samples x num_time_pts x dim_latent)
         z0_samples = self.z0_mean \
             + tf.matmul(self.latent_rand_samples[:, 0, :],
                         tf.transpose(self.Q0_sqrt))
+        innovations = tf.concat(
+            [tf.expand_dims(z0_samples, axis=1),
+             self._sample_innovations(self.latent_rand_samples[:, 1:, :])],
+            axis=1)
+
+        # z_t = sum_{s <= t} A^{t-s} u_s, computed with a parallel prefix
+        # scan over time; after the step with stride 2^k each time point
+        # holds the sum over the previous 2^{k+1} innovations, so only
+        # log2(num_time_pts) sequential steps are required (powers of A are
+        # dense even if A itself is block-structured)
+        z_samples = innovations
+        A_pow = self.A
+        stride = 1
+        while stride < self.num_time_pts:
+            z_samples = tf.concat(
+                [z_samples[:, :stride, :],
+                 z_samples[:, stride:, :] + tf.tensordot(
+                     z_samples[:, :-stride, :], A_pow, axes=[[2], [1]])],
+                axis=1)
+            A_pow = tf.matmul(A_pow, A_pow)
+            stride *= 2
+
+        # num_samples x num_time_pts x dim_latent
+        self.z_samples_prior = z_samples
+
+    def _sample_innovations(self, rand_samples):
+        """
+        Map standard normal samples to samples from N(0, Q), using the
+        structure of Q
 
-        # scan over time points, not samples
-        rand_ph_shuff = tf.transpose(
-            self.latent_rand_samples[:, 1:, :], perm=[1, 0, 2])
-        z_samples = tf.scan(
-            fn=lds_update,
-            elems=rand_ph_shuff,
-            initializer=z0_samples)
+        Args:
+            rand_samples (num_samples x num_time_pts-1 x dim_latent tf.Tensor)
 
-        # concat across time (num_samples x num_time_pts x dim_latent)
-        self.z_samples_prior = tf.concat(
-            [tf.expand_dims(z0_samples, axis=1),
-             tf.transpose(z_samples, perm=[1, 0, 2])], axis=1)
+        Returns:
+            num_samples x num_time_pts-1 x dim_latent tf.Tensor
+
+        """
+
+        if self.Q_blk_chols is not None:
+            innovations = blk_diag_low_rank_apply(
+                self.Q_blk_chols, None, rand_samples)
+        elif self.Q_diag is not None:
+            innovations = tf.sqrt(self.Q_diag) * rand_samples
+        else:
+            return tf.tensordot(rand_samples, self.Q_sqrt, axes=[[2], [1]])
+
+        # low-rank part drawn separately
+        if self.Q_factor is not None:
+            factor_rand_samples = tf.random_normal(
+                shape=[self.num_samples_ph, self.num_time_pts - 1,
+                       int(self.Q_factor.shape[1])],
+                mean=0.0, stddev=1.0, dtype=self.dtype)
+            innovations += tf.tensordot(
+                factor_rand_samples, self.Q_factor, axes=[[2], [1]])
+
+        return innovations
 
     def _sample_y(self):
 
+        if self.grouped_readout:
+            # num_samples x num_time_pts x sum(dim_obs)
+            y_means = self._apply_grouped_readout(self.z_samples_prior)
+            if self.noise_dist is 'gaussian':
+                obs_rand_samples = tf.random_normal(
+                    shape=tf.shape(y_means), mean=0.0, stddev=1.0,
+                    dtype=self.dtype, name='obs_rand_samples')
+                y_samples = y_means + tf.multiply(
+                    obs_rand_samples, tf.sqrt(tf.concat(self.R, axis=1)))
+            elif self.noise_dist is 'poisson':
+                y_samples = tf.squeeze(tf.random_poisson(
+                    lam=y_means, shape=[1], dtype=self.dtype), axis=0)
+            self.y_samples_prior = tf.split(y_samples, self.dim_obs, axis=2)
+            return
+
         # expand dims to account for time and mc dims when applying mapping
         # now (1 x num_samples x num_time_pts x dim_latent)
         z_samples_ex = tf.expand_dims(self.z_samples_prior, axis=0)
@@ -430,14 +972,14 @@ class NetFLDS(GenerativeModel):
                     mean=0.0, stddev=1.0, dtype=self.dtype,
                     name=str('obs_rand_samples_%02i' % pop)))
                 self.y_samples_prior.append(y_means[pop] + tf.multiply(
-                    obs_rand_samples[pop], self.R_sqrt[pop]))
+                    obs_rand_samples[pop], tf.sqrt(self.R[pop])))
 
         elif self.noise_dist is 'poisson':
             for pop, pop_dim in enumerate(self.dim_obs):
                 self.y_samples_prior.append(tf.squeeze(tf.random_poisson(
                     lam=y_means[pop], shape=[1], dtype=self.dtype), axis=0))
 
-    def log_density(self, y, z):
+    def log_density(self, y, z, y_consts=None, y_sparse=None):
         """
         Evaluate log density for generative model, defined as
         p(y, z) = p(y | z) p(z)
@@ -449,6 +991,14 @@ class NetFLDS(GenerativeModel):
             y (batch_size x num_mc_samples x num_time_pts x dim_obs tf.Tensor)
             z (batch_size x num_mc_samples x num_time_pts x dim_latent
                 tf.Tensor)
+            y_consts (batch_size x num_pops tf.Tensor, optional): data-only
+                terms of the log likelihood of each trial and population
+                (sum of log(y!) for poisson observations); computed from `y`
+                if `None`
+            y_sparse (list of tf.SparseTensor objects, optional): same
+                observations as `y` (batch_size x num_time_pts x dim_obs for
+                each population); if supplied, the y * log(rate) term of a
+                poisson likelihood is evaluated only at non-zero counts
 
         Returns:
             float: log density over y and z, averaged over minibatch samples
@@ -458,7 +1008,12 @@ class NetFLDS(GenerativeModel):
 
         # likelihood
         with tf.variable_scope('likelihood'):
-            self.log_density_y = self._log_density_likelihood(y)
+            if self.grouped_readout:
+                self.log_density_y = self._log_density_likelihood_grouped(
+                    y, y_consts, y_sparse)
+            else:
+                self.log_density_y = self._log_density_likelihood(
+                    y, y_consts, y_sparse)
 
         # prior
         with tf.variable_scope('prior'):
@@ -466,7 +1021,43 @@ class NetFLDS(GenerativeModel):
 
         return self.log_density_y + self.log_density_z
 
-    def _log_density_likelihood(self, y):
+    def log_density_chunked(self, y, z, chunk_size, y_consts=None):
+        """
+        Evaluate log density for generative model as in `log_density`, but
+        with the likelihood accumulated over chunks of monte carlo samples in
+        a graph loop, so that predicted observations are only held in memory
+        for one chunk at a time. Gradients of each chunk are accumulated in
+        the same loop and attached to the returned value, which does not
+        backpropagate through the loop itself.
+
+        Args:
+            y (list): batch_size x num_time_pts x dim_obs tf.Tensor for each
+                population
+            z (batch_size x num_mc_samples x num_time_pts x dim_latent
+                tf.Tensor); `num_mc_samples` must be known when building the
+                graph
+            chunk_size (int): number of monte carlo samples per chunk
+            y_consts (batch_size x num_pops tf.Tensor, optional): see
+                `log_density`
+
+        Returns:
+            float: log density over y and z, averaged over minibatch samples
+                and monte carlo samples
+
+        """
+
+        # likelihood
+        with tf.variable_scope('likelihood'):
+            self.log_density_y = self._log_density_likelihood_chunked(
+                y, z, chunk_size, y_consts)
+
+        # prior
+        with tf.variable_scope('prior'):
+            self.log_density_z = self._log_density_prior(z)
+
+        return self.log_density_y + self.log_density_z
+
+    def _log_density_likelihood(self, y, y_consts=None, y_sparse=None):
 
         log_density_y = []
 
@@ -490,21 +1081,45 @@ class NetFLDS(GenerativeModel):
                     log_density_y.append(-0.5 * (test_like
                          + self.num_time_pts * tf.reduce_sum(
                                 tf.log(self.R[pop]))
-                         + self.num_time_pts * pop_dim * tf.log(2.0 * np.pi)))
+                         + self.num_time_pts * pop_dim * np.log(2.0 * np.pi)))
 
                 elif self.noise_dist is 'poisson':
-                    # expand observation dims over mc samples
-                    y_obs = tf.expand_dims(y[pop], axis=1)
-
-                    # average over batch and mc sample dimensions
-                    log_density_ya = tf.reduce_mean(
-                        tf.multiply(y_obs[pop], tf.log(1e-3 + self.y_pred[pop]))
-                        - self.y_pred[pop]
-                        - tf.lgamma(1 + y_obs[pop]),
-                        axis=[0, 1])
+                    if y_sparse is None:
+                        # expand observation dims over mc samples
+                        y_obs = tf.expand_dims(y[pop], axis=1)
+
+                        # average over batch and mc sample dimensions
+                        log_density_ya = tf.reduce_mean(
+                            tf.multiply(y_obs, tf.log(1e-3 + self.y_pred[pop]))
+                            - self.y_pred[pop],
+                            axis=[0, 1])
+                    else:
+                        # rates at non-zero counts only
+                        # (num_nonzero x num_mc_samples)
+                        rates_nz = self._gather_mc_samples(
+                            self.y_pred[pop], y_sparse[pop].indices)
+
+                        # average over batch and mc sample dimensions
+                        num_samples = tf.cast(
+                            tf.shape(self.y_pred[pop])[0]
+                            * tf.shape(self.y_pred[pop])[1], self.dtype)
+                        log_density_ya = tf.reduce_sum(
+                            tf.expand_dims(y_sparse[pop].values, axis=1)
+                            * tf.log(1e-3 + rates_nz)) / num_samples \
+                            - tf.reduce_sum(tf.reduce_mean(
+                                self.y_pred[pop], axis=[0, 1]))
+
+                    # log(y!) only depends on the data; sum over time and
+                    # observation dimensions, average over batch dimension
+                    if y_consts is None:
+                        log_factorials = tf.reduce_sum(
+                            tf.lgamma(1.0 + y[pop]), axis=[1, 2])
+                    else:
+                        log_factorials = y_consts[:, pop]
 
                     # sum over time and observation dimensions
-                    log_density_y.append(tf.reduce_sum(log_density_ya))
+                    log_density_y.append(tf.reduce_sum(log_density_ya)
+                                         - tf.reduce_mean(log_factorials))
                     tf.summary.scalar('log_joint_like', log_density_y[-1])
 
                 else:
@@ -512,33 +1127,469 @@ class NetFLDS(GenerativeModel):
 
         return tf.add_n(log_density_y, name='log_joint_like_total')
 
+    def _log_density_likelihood_grouped(
+            self, y, y_consts=None, y_sparse=None):
+        """
+        Log likelihood of all populations using `y_pred_grouped`; the sum over
+        observation dimensions of each population is a segment reduction
+        """
+
+        num_pops = len(self.dim_obs)
+        # batch_size x num_time_pts x sum(dim_obs)
+        y = tf.concat(y, axis=2)
+
+        if self.noise_dist is 'gaussian':
+            R = tf.concat(self.R, axis=1)
+            R_inv = tf.concat(self.R_inv, axis=1)
+
+            # average over batch and mc sample dimensions, sum over time
+            res_y = tf.expand_dims(y, axis=1) - self.y_pred_grouped
+            res_y_R_inv_res_y = tf.reduce_sum(tf.reduce_mean(
+                tf.multiply(tf.square(res_y), R_inv), axis=[0, 1]), axis=0)
+
+            log_density_y = -0.5 * tf.unsorted_segment_sum(
+                res_y_R_inv_res_y
+                + self.num_time_pts * tf.log(R[0])
+                + self.num_time_pts * np.log(2.0 * np.pi),
+                self.obs_segment_ids, num_pops)
+
+        elif self.noise_dist is 'poisson':
+            batch_size = tf.cast(tf.shape(y)[0], self.dtype)
+
+            # -rate term; average over batch and mc sample dimensions, sum
+            # over time
+            log_density_y = -tf.unsorted_segment_sum(tf.reduce_sum(
+                tf.reduce_mean(self.y_pred_grouped, axis=[0, 1]), axis=0),
+                self.obs_segment_ids, num_pops)
+
+            # y * log(rate) term
+            if y_sparse is None:
+                log_density_y += tf.unsorted_segment_sum(tf.reduce_sum(
+                    tf.reduce_mean(tf.multiply(
+                        tf.expand_dims(y, axis=1),
+                        tf.log(1e-3 + self.y_pred_grouped)), axis=[0, 1]),
+                    axis=0), self.obs_segment_ids, num_pops)
+            else:
+                # shift indices of each population to full observation space
+                y_sparse = tf.sparse_concat(axis=2, sp_inputs=y_sparse)
+                rates_nz = self._gather_mc_samples(
+                    self.y_pred_grouped, y_sparse.indices)
+                log_density_y += tf.unsorted_segment_sum(
+                    y_sparse.values * tf.reduce_mean(
+                        tf.log(1e-3 + rates_nz), axis=1),
+                    tf.gather(self.obs_segment_ids, y_sparse.indices[:, 2]),
+                    num_pops) / batch_size
+
+            # log(y!) terms; average over batch dimension
+            if y_consts is None:
+                log_density_y -= tf.unsorted_segment_sum(tf.reduce_sum(
+                    tf.lgamma(1.0 + y), axis=[0, 1]),
+                    self.obs_segment_ids, num_pops) / batch_size
+            else:
+                log_density_y -= tf.reduce_mean(y_consts, axis=0)
+
+        else:
+            raise ValueError
+
+        for pop in range(num_pops):
+            tf.summary.scalar('log_joint_like_%02i' % pop, log_density_y[pop])
+
+        return tf.reduce_sum(log_density_y, name='log_joint_like_total')
+
+    def _log_density_likelihood_chunked(
+            self, y, z, chunk_size, y_consts=None):
+
+        num_mc_samples = z.shape.as_list()[1]
+        num_chunks = -(-num_mc_samples // chunk_size)
+        num_pops = len(self.dim_obs)
+
+        # readout groups; a single group of all populations for grouped
+        # readouts
+        if self.grouped_readout:
+            groups = [{
+                'layers': self.grouped_layers,
+                'latent_indxs': [0, sum(self.dim_latent)],
+                'y': tf.concat(y, axis=2),
+                'lin_preds': None}]
+        else:
+            groups = []
+            for pop, network in enumerate(self.networks):
+                if self.dim_predictors is not None:
+                    lin_preds = tf.add_n(self.y_pred_lp[pop])
+                else:
+                    lin_preds = None
+                groups.append({
+                    'layers': [{'kernel': layer.kernel, 'bias': layer.bias,
+                                'activation': layer.activation}
+                               for layer in network.layers],
+                    'latent_indxs': [self.latent_indxs[pop][0],
+                                     self.latent_indxs[pop][-1]],
+                    'y': y[pop],
+                    'lin_preds': lin_preds})
+        if self.noise_dist is 'gaussian':
+            if self.grouped_readout:
+                groups[0]['R_inv'] = tf.concat(self.R_inv, axis=1)
+            else:
+                for pop, group in enumerate(groups):
+                    group['R_inv'] = self.R_inv[pop]
+
+        # differentiable inputs of the sample-dependent terms; these are
+        # passed through the loop so that gradients can be taken inside it
+        inputs = [z]
+        for group in groups:
+            for layer in group['layers']:
+                inputs += [layer['kernel'], layer['bias']]
+            if group['lin_preds'] is not None:
+                inputs.append(group['lin_preds'])
+            if self.noise_dist is 'gaussian':
+                inputs.append(group['R_inv'])
+        inputs = [tf.convert_to_tensor(tensor) for tensor in inputs]
+
+        batch_size = tf.cast(tf.shape(z)[0], self.dtype)
+
+        def chunk_log_density(indx, loop_inputs):
+            """Sample-dependent terms of one chunk for each group"""
+            z_chunk = loop_inputs[0][:, indx * chunk_size:
+                                     (indx + 1) * chunk_size]
+            loop_inputs = loop_inputs[1:]
+            log_density_chunk = []
+            for group in groups:
+                # rebuild readout from loop copies of its inputs
+                y_pred = z_chunk[:, :, :, group['latent_indxs'][0]:
+                                 group['latent_indxs'][1]]
+                for layer in group['layers']:
+                    y_pred = tf.tensordot(
+                        y_pred, loop_inputs[0], axes=[[3], [0]]) \
+                        + loop_inputs[1]
+                    if layer['activation'] is not None:
+                        y_pred = layer['activation'](y_pred)
+                    loop_inputs = loop_inputs[2:]
+                if group['lin_preds'] is not None:
+                    y_pred += loop_inputs[0]
+                    loop_inputs = loop_inputs[1:]
+                y_obs = tf.expand_dims(group['y'], axis=1)
+                if self.noise_dist is 'gaussian':
+                    log_density_y = -0.5 * tf.reduce_sum(
+                        tf.square(y_obs - y_pred) * loop_inputs[0],
+                        axis=[0, 1, 2])
+                    loop_inputs = loop_inputs[1:]
+                else:
+                    log_density_y = tf.reduce_sum(
+                        y_obs * tf.log(1e-3 + y_pred) - y_pred,
+                        axis=[0, 1, 2])
+                # normalize by total number of samples, not chunk size
+                log_density_chunk.append(
+                    log_density_y / (batch_size * num_mc_samples))
+            return log_density_chunk
+
+        def body(indx, log_density_y, grads, loop_inputs):
+            log_density_chunk = chunk_log_density(indx, loop_inputs)
+            # per-population terms
+            if self.grouped_readout:
+                log_density_chunk = tf.unsorted_segment_sum(
+                    log_density_chunk[0], self.obs_segment_ids, num_pops)
+            else:
+                log_density_chunk = tf.stack(
+                    [tf.reduce_sum(log_density_pop)
+                     for log_density_pop in log_density_chunk])
+            grads_chunk = tf.gradients(
+                tf.reduce_sum(log_density_chunk), loop_inputs)
+            grads = [grad + grad_chunk
+                     for grad, grad_chunk in zip(grads, grads_chunk)]
+            return indx + 1, log_density_y + log_density_chunk, grads, \
+                loop_inputs
+
+        _, log_density_y, grads, _ = tf.while_loop(
+            lambda indx, *args: indx < num_chunks, body,
+            [tf.constant(0), tf.zeros([num_pops], dtype=self.dtype),
+             [tf.zeros_like(tensor) for tensor in inputs], inputs],
+            back_prop=False)
+
+        log_density_y = tf.stop_gradient(log_density_y)
+
+        # data-only terms
+        if self.noise_dist is 'gaussian':
+            log_density_y -= 0.5 * tf.stack([
+                self.num_time_pts * tf.reduce_sum(tf.log(self.R[pop]))
+                + self.num_time_pts * pop_dim * np.log(2.0 * np.pi)
+                for pop, pop_dim in enumerate(self.dim_obs)])
+        elif self.noise_dist is 'poisson':
+            if y_consts is None:
+                y_consts = tf.stack(
+                    [tf.reduce_sum(tf.lgamma(1.0 + y_pop), axis=[1, 2])
+                     for y_pop in y], axis=1)
+            log_density_y -= tf.reduce_mean(y_consts, axis=0)
+        else:
+            raise ValueError
+
+        for pop in range(num_pops):
+            tf.summary.scalar('log_joint_like_%02i' % pop, log_density_y[pop])
+
+        # surrogate term with zero value whose gradients are the accumulated
+        # gradients of the chunks
+        surrogate = tf.add_n([
+            tf.reduce_sum(tf.stop_gradient(grad) * tensor)
+            for grad, tensor in zip(grads, inputs)])
+
+        return tf.add(
+            tf.reduce_sum(log_density_y),
+            surrogate - tf.stop_gradient(surrogate),
+            name='log_joint_like_total')
+
+    @staticmethod
+    def _gather_mc_samples(values, indices):
+        """
+        Gather entries of all mc samples at sparse coordinates
+
+        Args:
+            values (batch_size x num_mc_samples x num_time_pts x dim_obs
+                tf.Tensor)
+            indices (num_entries x 3 tf.Tensor): (trial, time, observation)
+                coordinates
+
+        Returns:
+            num_entries x num_mc_samples tf.Tensor
+
+        """
+
+        num_mc_samples = tf.shape(values)[1]
+        mc_indices = tf.tile(
+            tf.range(tf.cast(num_mc_samples, tf.int64))[None, :, None],
+            [tf.shape(indices)[0], 1, 1])
+        indices = tf.tile(indices[:, None, :], [1, num_mc_samples, 1])
+
+        return tf.gather_nd(
+            values,
+            tf.concat([indices[:, :, :1], mc_indices, indices[:, :, 1:]],
+                      axis=2))
+
     def _log_density_prior(self, z):
         self.res_z0 = res_z0 = z[:, :, 0, :] - self.z0_mean
-        self.res_z = res_z = z[:, :, 1:, :] - tf.tensordot(
-            z[:, :, :-1, :], tf.transpose(self.A), axes=[[3], [0]])
-
-        # average over batch and mc sample dimensions
-        res_z_Q_inv_res_z = tf.reduce_mean(tf.multiply(
-            tf.tensordot(res_z, self.Q_inv, axes=[[3], [0]]), res_z),
-            axis=[0, 1])
-        res_z0_Q0_inv_res_z0 = tf.reduce_mean(tf.multiply(
-            tf.tensordot(res_z0, self.Q0_inv, axes=[[2], [0]]), res_z0),
-            axis=[0, 1])
+        if self.A_blocks is None:
+            self.res_z = res_z = z[:, :, 1:, :] - tf.tensordot(
+                z[:, :, :-1, :], tf.transpose(self.A), axes=[[3], [0]])
+        else:
+            self.res_z = res_z = z[:, :, 1:, :] - blk_diag_low_rank_apply(
+                self.A_blocks, self.A_factors, z[:, :, :-1, :])
+
+        # mahalanobis terms from triangular solves with the cholesky factors,
+        # ||L^-1 r||^2 = r^T Q^-1 r; average over batch and mc sample
+        # dimensions
+        dim_latent = sum(self.dim_latent)
+        L0_inv_res_z0 = tf.matrix_triangular_solve(
+            self.Q0_chol, tf.transpose(tf.reshape(res_z0, [-1, dim_latent])),
+            lower=True)
+        num_samples = tf.cast(
+            tf.shape(res_z)[0] * tf.shape(res_z)[1], self.dtype)
 
         # sum over time and latent dimensions
-        test_prior = tf.reduce_sum(res_z_Q_inv_res_z)
-        test_prior0 = tf.reduce_sum(res_z0_Q0_inv_res_z0)
+        test_prior = self._innovation_mahalanobis(
+            tf.reshape(res_z, [-1, dim_latent])) / num_samples
+        test_prior0 = tf.reduce_sum(tf.square(L0_inv_res_z0)) / num_samples
         tf.summary.scalar('log_joint_prior', -0.5 * test_prior)
         tf.summary.scalar('log_joint_prior0', -0.5 * test_prior0)
 
         # total term for prior
-        log_density_z = -0.5 * (test_prior + test_prior0
-            + (self.num_time_pts - 1) * tf.log(tf.matrix_determinant(self.Q))
-            + tf.log(tf.matrix_determinant(self.Q0))
-            + self.num_time_pts * sum(self.dim_latent) * tf.log(2.0 * np.pi))
+        log_density_z = -0.5 * (
+            test_prior + test_prior0 + self._prior_normalizer())
 
         return log_density_z
 
+    def _prior_normalizer(self):
+        """Log-determinant and 2 pi terms of the prior over all time points"""
+
+        # log-determinants from diagonals of cholesky factors
+        ln_det_Q0 = 2.0 * tf.reduce_sum(
+            tf.log(tf.matrix_diag_part(self.Q0_chol)))
+
+        return (self.num_time_pts - 1) * self._innovation_ln_det() \
+            + ln_det_Q0 \
+            + self.num_time_pts * sum(self.dim_latent) * np.log(2.0 * np.pi)
+
+    def _innovation_mahalanobis(self, res_z):
+        """
+        Sum of r^T Q^-1 r over the rows r of `res_z` (num_residuals x
+        dim_latent tf.Tensor), using the structure of Q
+        """
+
+        if self.Q_blk_chols is not None:
+            # triangular solves with the cholesky factor of each block
+            mahalanobis = 0.0
+            indx_start = 0
+            for chol in self.Q_blk_chols:
+                indx_end = indx_start + int(chol.shape[0])
+                mahalanobis += tf.reduce_sum(tf.square(
+                    tf.matrix_triangular_solve(
+                        chol, tf.transpose(res_z[:, indx_start:indx_end]),
+                        lower=True)))
+                indx_start = indx_end
+        elif self.Q_diag is not None:
+            mahalanobis = tf.reduce_sum(tf.square(res_z) / self.Q_diag)
+        else:
+            # ||L^-1 r||^2 = r^T Q^-1 r
+            return tf.reduce_sum(tf.square(tf.matrix_triangular_solve(
+                self.Q_chol, tf.transpose(res_z), lower=True)))
+
+        # woodbury identity; r^T Q^-1 r = r^T B^-1 r - ||W^T r||^2 for
+        # Q = B + V V^T
+        if self.Q_inv_factor is not None:
+            mahalanobis -= tf.reduce_sum(
+                tf.square(tf.matmul(res_z, self.Q_inv_factor)))
+
+        return mahalanobis
+
+    def _innovation_ln_det(self):
+        """Log-determinant of Q, using its structure"""
+
+        if self.Q_blk_chols is not None:
+            ln_det = 2.0 * tf.add_n([
+                tf.reduce_sum(tf.log(tf.matrix_diag_part(chol)))
+                for chol in self.Q_blk_chols])
+        elif self.Q_diag is not None:
+            ln_det = tf.reduce_sum(tf.log(self.Q_diag))
+        else:
+            return 2.0 * tf.reduce_sum(
+                tf.log(tf.matrix_diag_part(self.Q_chol)))
+
+        # matrix determinant lemma
+        if self.Q_cap_chol is not None:
+            ln_det += 2.0 * tf.reduce_sum(
+                tf.log(tf.matrix_diag_part(self.Q_cap_chol)))
+
+        return ln_det
+
+    def expected_log_density(
+            self, y, z_means, z_covs, z_covs_lag, y_consts=None):
+        """
+        Evaluate the expectation of the log density of the generative model
+        in closed form under a Gaussian posterior over the latent states that
+        is Markov in time; requires `has_analytic_likelihood()`
+
+        Args:
+            y (list): batch_size x num_time_pts x dim_obs tf.Tensor for each
+                population
+            z_means (batch_size x num_time_pts x dim_latent tf.Tensor)
+            z_covs (batch_size x num_time_pts x dim_latent x dim_latent
+                tf.Tensor): marginal posterior covariances
+            z_covs_lag (batch_size x num_time_pts - 1 x dim_latent x
+                dim_latent tf.Tensor): posterior cross-covariances
+                cov(z_{t+1}, z_t)
+            y_consts (batch_size x num_pops tf.Tensor, optional): see
+                `log_density`
+
+        Returns:
+            float: expected log density over y and z, averaged over minibatch
+                samples
+
+        """
+
+        # likelihood
+        with tf.variable_scope('likelihood'):
+            self.log_density_y = self._expected_log_density_likelihood(
+                y, z_means, z_covs, y_consts)
+
+        # prior
+        with tf.variable_scope('prior'):
+            self.log_density_z = self._expected_log_density_prior(
+                z_means, z_covs, z_covs_lag)
+
+        return self.log_density_y + self.log_density_z
+
+    def _expected_log_density_likelihood(
+            self, y, z_means, z_covs, y_consts=None):
+
+        log_density_y = []
+
+        for pop, pop_dim in enumerate(self.dim_obs):
+            with tf.variable_scope('population_%02i' % pop):
+                indx_start = self.latent_indxs[pop][0]
+                indx_end = self.latent_indxs[pop][-1]
+                kernel = self.networks[pop].layers[0].kernel
+                bias = self.networks[pop].layers[0].bias
+
+                # mean and variance of linear predictor, z C + d
+                eta_mean = tf.tensordot(
+                    z_means[:, :, indx_start:indx_end], kernel,
+                    axes=[[2], [0]]) + bias
+                eta_var = tf.reduce_sum(tf.multiply(tf.tensordot(
+                    z_covs[:, :, indx_start:indx_end, indx_start:indx_end],
+                    kernel, axes=[[3], [0]]), kernel), axis=2)
+
+                if self.noise_dist is 'gaussian':
+                    # E[(y - z C - d)^2] = (y - E[z] C - d)^2 + var(z C)
+                    # average over batch dimension
+                    res_y_R_inv_res_y = tf.reduce_mean(tf.multiply(
+                        tf.square(y[pop] - eta_mean) + eta_var,
+                        self.R_inv[pop]), axis=0)
+
+                    # sum over time and observation dimensions
+                    test_like = tf.reduce_sum(res_y_R_inv_res_y)
+                    tf.summary.scalar('log_joint_like', -0.5 * test_like)
+
+                    # total term for likelihood
+                    log_density_y.append(-0.5 * (test_like
+                         + self.num_time_pts * tf.reduce_sum(
+                                tf.log(self.R[pop]))
+                         + self.num_time_pts * pop_dim * np.log(2.0 * np.pi)))
+
+                elif self.noise_dist is 'poisson':
+                    # E[y log(rate) - rate] for rate = exp(z C + d), using the
+                    # log-normal mean E[rate] = exp(E[z] C + d + var(z C) / 2)
+                    # (without the 1e-3 offset of the sampled likelihood);
+                    # average over batch dimension
+                    log_density_ya = tf.reduce_mean(
+                        tf.multiply(y[pop], eta_mean)
+                        - tf.exp(eta_mean + 0.5 * eta_var),
+                        axis=0)
+
+                    # log(y!) terms; see `_log_density_likelihood`
+                    if y_consts is None:
+                        log_factorials = tf.reduce_sum(
+                            tf.lgamma(1.0 + y[pop]), axis=[1, 2])
+                    else:
+                        log_factorials = y_consts[:, pop]
+
+                    # sum over time and observation dimensions
+                    log_density_y.append(tf.reduce_sum(log_density_ya)
+                                         - tf.reduce_mean(log_factorials))
+                    tf.summary.scalar('log_joint_like', log_density_y[-1])
+
+                else:
+                    raise ValueError
+
+        return tf.add_n(log_density_y, name='log_joint_like_total')
+
+    def _expected_log_density_prior(self, z_means, z_covs, z_covs_lag):
+
+        # E[r r^T] for r_0 = z_0 - z0_mean and r_t = z_t - A z_{t-1}
+        res_z0 = z_means[:, 0, :] - self.z0_mean
+        res_z = z_means[:, 1:, :] - tf.tensordot(
+            z_means[:, :-1, :], self.A, axes=[[2], [1]])
+        # cov(z_t) + A cov(z_{t-1}) A^T - cov(z_t, z_{t-1}) A^T - transpose
+        A_cov_lag = tf.tensordot(z_covs_lag, self.A, axes=[[3], [1]])
+        cov_res_z = z_covs[:, 1:] \
+            + tf.transpose(tf.tensordot(
+                tf.tensordot(z_covs[:, :-1], self.A, axes=[[3], [1]]),
+                self.A, axes=[[2], [1]]), perm=[0, 1, 3, 2]) \
+            - A_cov_lag - tf.transpose(A_cov_lag, perm=[0, 1, 3, 2])
+
+        # E[r^T Q^-1 r] = E[r]^T Q^-1 E[r] + tr(Q^-1 cov(r)); average over
+        # batch dimension, sum over time. The trace is linear in cov(r), so
+        # only the summed covariance is solved against the cholesky factor
+        batch_size = tf.cast(tf.shape(z_means)[0], self.dtype)
+        test_prior = self._innovation_mahalanobis(
+            tf.reshape(res_z, [-1, sum(self.dim_latent)])) / batch_size \
+            + tf.trace(tf.cholesky_solve(self.Q_chol, tf.reduce_sum(
+                tf.reduce_mean(cov_res_z, axis=0), axis=0)))
+        test_prior0 = tf.reduce_sum(tf.square(tf.matrix_triangular_solve(
+            self.Q0_chol, tf.transpose(res_z0), lower=True))) / batch_size \
+            + tf.trace(tf.cholesky_solve(
+                self.Q0_chol, tf.reduce_mean(z_covs[:, 0], axis=0)))
+        tf.summary.scalar('log_joint_prior', -0.5 * test_prior)
+        tf.summary.scalar('log_joint_prior0', -0.5 * test_prior0)
+
+        return -0.5 * (test_prior + test_prior0 + self._prior_normalizer())
+
     def sample(self, sess, num_samples=1, seed=None, linear_predictors=None):
         """
         Generate samples from the model
@@ -578,11 +1629,11 @@ class NetFLDS(GenerativeModel):
         """Get parameters of generative model"""
 
         if self.noise_dist is 'gaussian':
-            A, R_sqrt, z0_mean, Q, Q0 = sess.run(
-                [self.A, self.R_sqrt, self.z0_mean, self.Q, self.Q0])
+            A, R, z0_mean, Q, Q0 = sess.run(
+                [self.A, self.R, self.z0_mean, self.Q, self.Q0])
 
             param_dict = {
-                'A': A, 'R': np.square(R_sqrt), 'z0_mean': z0_mean,
+                'A': A, 'R': np.asarray(R), 'z0_mean': z0_mean,
                 'Q': Q, 'Q0': Q0}
 
         elif self.noise_dist is 'poisson':
@@ -626,7 +1677,9 @@ class NetLDS(NetFLDS):
     def __init__(
             self, dim_obs=None, dim_latent=None, linear_predictors=None,
             num_time_pts=None, gen_params=None, noise_dist='gaussian',
-            post_z_samples=None, **kwargs):
+            post_z_samples=None, grouped_readout=False,
+            poisson_link='softplus', innovation_rank=None,
+            block_dynamics=False, coupling_rank=0, **kwargs):
         """
         Args:
             dim_obs (list): observation dimension for each population
@@ -642,9 +1695,19 @@ class NetLDS(NetFLDS):
             gen_params (dict): dictionary of generative params for initializing
                 model
             noise_dist (str): 'gaussian' | 'poisson'
+            poisson_link (str): 'softplus' | 'exponential'; nonlinearity
+                mapping the output of the final layer to poisson rates
             post_z_samples (batch_size x num_mc_samples x num_time_pts x
                 dim_latent tf.Tensor): samples from the (appx) posterior of the
                 latent states
+            grouped_readout (bool): `True` to apply the readouts of all
+                populations as a single block-diagonal matmul; see NetFLDS
+            innovation_rank (int, optional): rank of the low-rank part of a
+                diagonal plus low-rank innovation covariance; see NetFLDS
+            block_dynamics (bool): `True` to constrain A and Q to
+                within-population blocks plus low-rank cross-population
+                coupling; see NetFLDS
+            coupling_rank (int): rank of the cross-population coupling
 
         """
 
@@ -683,7 +1746,9 @@ class NetLDS(NetFLDS):
             dim_obs=dim_obs, dim_latent=dim_latent, nn_params=nn_params,
             linear_predictors=linear_predictors, noise_dist=noise_dist,
             post_z_samples=post_z_samples, num_time_pts=num_time_pts,
-            gen_params=gen_params)
+            gen_params=gen_params, grouped_readout=grouped_readout,
+            poisson_link=poisson_link, innovation_rank=innovation_rank,
+            block_dynamics=block_dynamics, coupling_rank=coupling_rank)
 
     def get_params(self, sess):
         """Get parameters of generative model"""
@@ -710,7 +1775,8 @@ class FLDS(NetFLDS):
     def __init__(
             self, dim_obs=None, dim_latent=None, dim_predictors=None,
             num_time_pts=None, gen_params=None, noise_dist='gaussian',
-            nn_params=None, post_z_samples=None, **kwargs):
+            nn_params=None, post_z_samples=None, poisson_link='softplus',
+            innovation_rank=None, **kwargs):
         """
         Args:
             dim_obs (int): observation dimension
@@ -721,12 +1787,16 @@ class FLDS(NetFLDS):
             gen_params (dict): dictionary of generative params for initializing
                 model
             noise_dist (str): 'gaussian' | 'poisson'
+            poisson_link (str): 'softplus' | 'exponential'; nonlinearity
+                mapping the output of the final layer to poisson rates
             nn_params (list): dictionaries for building each layer of the
                 mapping from the latent space to observations; the same
                 network architecture is used for each population
             post_z_samples (batch_size x num_mc_samples x num_time_pts x
                 dim_latent tf.Tensor): samples from the (appx) posterior of the
                 latent states
+            innovation_rank (int, optional): rank of the low-rank part of a
+                diagonal plus low-rank innovation covariance; see NetFLDS
 
         """
 
@@ -744,7 +1814,8 @@ class FLDS(NetFLDS):
             dim_obs=[dim_obs], dim_latent=[dim_latent],
             linear_predictors=linear_predictors,
             post_z_samples=post_z_samples, num_time_pts=num_time_pts,
-            gen_params=gen_params, nn_params=nn_params, noise_dist=noise_dist)
+            gen_params=gen_params, nn_params=nn_params, noise_dist=noise_dist,
+            poisson_link=poisson_link, innovation_rank=innovation_rank)
 
     def sample(self, sess, num_samples=1, seed=None, linear_predictors=None):
         y, z = super().sample(sess, num_samples, seed, linear_predictors)
@@ -761,7 +1832,8 @@ class LDS(NetFLDS):
     def __init__(
             self, dim_obs=None, dim_latent=None, dim_predictors=None,
             num_time_pts=None, gen_params=None, noise_dist='gaussian',
-            post_z_samples=None, **kwargs):
+            post_z_samples=None, poisson_link='softplus',
+            innovation_rank=None, **kwargs):
         """
         Args:
             dim_obs (int): observation dimension
@@ -772,9 +1844,13 @@ class LDS(NetFLDS):
             gen_params (dict): dictionary of generative params for initializing
                 model
             noise_dist (str): 'gaussian' | 'poisson'
+            poisson_link (str): 'softplus' | 'exponential'; nonlinearity
+                mapping the output of the final layer to poisson rates
             post_z_samples (batch_size x num_mc_samples x num_time_pts x
                 dim_latent tf.Tensor): samples from the (appx) posterior of the
                 latent states
+            innovation_rank (int, optional): rank of the low-rank part of a
+                diagonal plus low-rank innovation covariance; see NetFLDS
 
         """
 
@@ -818,7 +1894,8 @@ class LDS(NetFLDS):
             dim_obs=[dim_obs], dim_latent=[dim_latent],
             linear_predictors=linear_predictors,
             post_z_samples=post_z_samples, num_time_pts=num_time_pts,
-            gen_params=gen_params, nn_params=nn_params, noise_dist=noise_dist)
+            gen_params=gen_params, nn_params=nn_params, noise_dist=noise_dist,
+            poisson_link=poisson_link, innovation_rank=innovation_rank)
 
     def sample(self, sess, num_samples=1, seed=None, linear_predictors=None):
         y, z = super().sample(sess, num_samples, seed, linear_predictors)
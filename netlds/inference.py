@@ -3,8 +3,12 @@
 import numpy as np
 import tensorflow as tf
 from netlds.network import Network
-from netlds.chol_utils import blk_tridiag_chol, blk_chol_inv, \
-    blk_chol_inv_multi
+from netlds.chol_utils import blk_tridiag_chol_batch, \
+    blk_tridiag_chol_static, blk_tridiag_expand_static, blk_chol_inv_batch, \
+    blk_chol_inv_multi_batch, blk_tridiag_chol_parallel, \
+    blk_chol_inv_parallel, blk_chol_inv_multi_parallel, \
+    blk_chol_selective_inv_batch, blk_tridiag_chol_steady_state, \
+    blk_diag_low_rank_apply
 
 
 class InferenceNetwork(object):
@@ -13,8 +17,20 @@ class InferenceNetwork(object):
     # use same data type throughout graph construction
     dtype = tf.float32
 
+    # if `True` the posterior is computed directly from the parameters of the
+    # generative model (no inference network is trained) and the model is fit
+    # by maximizing the (exact or approximate) log marginal likelihood
+    # returned by `evidence` rather than the ELBO
+    fit_evidence = False
+
+    # if `True` the dense inverses 'Q0_inv' and 'Q_inv' of the prior
+    # covariances must be included in the `param_dict` passed to
+    # `build_graph` (see `NetFLDS.initialize_prior_precisions`)
+    requires_prior_precisions = False
+
     def __init__(
-            self, dim_input=None, dim_latent=None, num_mc_samples=1):
+            self, dim_input=None, dim_latent=None, num_mc_samples=1,
+            sample_type='iid'):
         """
         Set base class attributes
 
@@ -23,6 +39,21 @@ class InferenceNetwork(object):
                 neural network to provide data-point specific distributional
                 parameters of the approximate posterior
             dim_latent (int): dimension of latent state
+            num_mc_samples (int): number of samples drawn from the approximate
+                posterior
+            sample_type (str): standard normal base samples that are mapped
+                to posterior samples
+                'iid': independent draws
+                'antithetic': pairs of draws with opposite signs
+                'sobol': randomly shifted Sobol sequence over the latent
+                    dimensions (randomized quasi-Monte Carlo), with an
+                    independent shift for each batch element and time point;
+                    requires a tensorflow version that provides
+                    `tf.math.sobol_sample`
+
+        Raises:
+            ValueError: for incorrect `sample_type` values, or for 'sobol'
+                if the installed tensorflow version does not support it
 
         """
 
@@ -30,6 +61,16 @@ class InferenceNetwork(object):
         self.dim_input = dim_input
         self.dim_latent = dim_latent
         self.num_mc_samples = num_mc_samples
+        if sample_type not in ['iid', 'antithetic', 'sobol']:
+            raise ValueError(
+                '"%s" is not a valid string for specifying the sample type' %
+                sample_type)
+        if sample_type == 'sobol' and not hasattr(
+                getattr(tf, 'math', None), 'sobol_sample'):
+            raise ValueError(
+                '"sobol" sampling requires tf.math.sobol_sample, which is not '
+                'available in tensorflow %s' % tf.__version__)
+        self.sample_type = sample_type
 
     def build_graph(self, *args, **kwargs):
         """Build tensorflow computation graph for inference network"""
@@ -43,6 +84,101 @@ class InferenceNetwork(object):
         """Draw samples from approximate posterior"""
         raise NotImplementedError
 
+    def evidence(self):
+        """Log marginal likelihood of observations (if `fit_evidence`)"""
+        raise NotImplementedError
+
+    def _base_samples(self, shape, mc_axis, name='samples_z'):
+        """
+        Standard normal base samples drawn according to `sample_type`
+
+        Args:
+            shape (list): shape of samples; first element is the (possibly
+                dynamic) batch size, all others must be ints
+            mc_axis (int): axis of `shape` indexing monte carlo samples
+            name (str)
+
+        Returns:
+            tf.Tensor of shape `shape`
+
+        """
+
+        if self.sample_type == 'iid':
+            return tf.random_normal(
+                shape=shape, mean=0.0, stddev=1.0, dtype=self.dtype,
+                name=name)
+
+        # draw samples as batch_size x num_mc_samples x other dims, then move
+        # the mc sample axis into place
+        num_samples = shape[mc_axis]
+        other_dims = [dim for axis, dim in enumerate(shape)
+                      if axis not in [0, mc_axis]]
+
+        if self.sample_type == 'antithetic':
+            samples = tf.random_normal(
+                shape=[shape[0], (num_samples + 1) // 2] + other_dims,
+                mean=0.0, stddev=1.0, dtype=self.dtype)
+            samples = tf.concat([samples, -samples], axis=1)[:, :num_samples]
+        else:
+            # one point of the sequence (over the last dimension only) per mc
+            # sample, shifted modulo 1 (Cranley-Patterson rotation) with an
+            # independent shift for each batch element and each index of the
+            # remaining dimensions (e.g. time points), which decorrelates
+            # them while keeping the sequence dimension small
+            dim = other_dims[-1]
+            if dim > 21200:
+                raise ValueError(
+                    'Sobol sampling supports at most 21200 dimensions; '
+                    'got %i' % dim)
+            num_shifts = int(np.prod(other_dims[:-1]))
+            points = tf.math.sobol_sample(dim, num_samples, dtype=self.dtype)
+            shifts = tf.random_uniform(
+                shape=[shape[0], 1, num_shifts, dim], dtype=self.dtype)
+            uniforms = tf.mod(points[None, :, None, :] + shifts, 1.0)
+            eps = np.finfo(self.dtype.as_numpy_dtype).eps
+            samples = tf.math.ndtri(
+                tf.clip_by_value(uniforms, eps, 1.0 - eps))
+            samples = tf.reshape(
+                samples, tf.concat([[-1, num_samples], other_dims], axis=0))
+
+        perm = list(range(2, len(shape)))
+        perm.insert(mc_axis - 1, 1)
+        return tf.transpose(samples, perm=[0] + perm, name=name)
+
+    @staticmethod
+    def _split_low_rank(outputs, num_time_pts, dim_latent, rank):
+        """
+        Split inference network outputs into the diagonal and low-rank factor
+        of diagonal plus low-rank blocks
+
+        Args:
+            outputs (batch_size x num_time_pts x (dim_latent * (rank + 1))
+                tf.Tensor)
+            num_time_pts (int)
+            dim_latent (int)
+            rank (int)
+
+        Returns:
+            batch_size x num_time_pts x dim_latent tf.Tensor: diagonal
+            batch_size x num_time_pts x dim_latent x rank tf.Tensor: factor
+
+        """
+
+        diag, factor = tf.split(
+            outputs, [dim_latent, dim_latent * rank], axis=2)
+        factor = tf.reshape(factor, [-1, num_time_pts, dim_latent, rank])
+
+        return diag, factor
+
+    def _entropy_from_ln_det(self, ln_det):
+        """
+        Entropy of a Gaussian over all time points given the log-determinant
+        of its (dim_latent * num_time_pts) x (dim_latent * num_time_pts)
+        covariance matrix
+        """
+        return ln_det / 2.0 + self.dim_latent * self.num_time_pts / 2.0 * (
+                1.0 + np.log(2.0 * np.pi))
+
 
 class SmoothingLDS(InferenceNetwork):
     """
@@ -50,16 +186,79 @@ class SmoothingLDS(InferenceNetwork):
     structure mirroring that from a linear dynamical system
     """
 
+    # prior precision blocks are assembled explicitly
+    requires_prior_precisions = True
+
     def __init__(
             self, dim_input=None, dim_latent=None, num_mc_samples=1,
-            num_time_pts=None, nn_params=None):
+            num_time_pts=None, nn_params=None, use_inverse=False,
+            solver='sequential', steady_state_tol=None, sample_type='iid',
+            param_rank=None):
+        """
+        Args:
+            dim_input (int): dimension of inputs to the inference network
+            dim_latent (int): dimension of latent state
+            num_mc_samples (int): number of samples drawn from the approximate
+                posterior
+            num_time_pts (int): number of time points per observation of the
+                dynamical sequence
+            nn_params (list): dictionaries for building each layer of the
+                inference network
+            use_inverse (bool): use explicit matrix inverses rather than
+                triangular solves in the block Cholesky routines (slower and
+                less stable; kept for comparison); only used by the
+                'sequential' solver
+            solver (str): algorithm for block-tridiagonal Cholesky
+                decompositions and solves
+                'sequential': scan over time points
+                'parallel': parallel prefix scan over time points; requires
+                    O(log T) rather than O(T) sequential steps, which is
+                    faster for long sequences
+            steady_state_tol (float, optional): if not `None`, stop the
+                Cholesky recursion once the factor blocks and the remaining
+                precision blocks change less than this tolerance, and reuse
+                the last blocks for the remaining time points; the recursion
+                runs to the end when the data-dependent precisions are not
+                stationary. The number of computed blocks is available as the
+                `chol_num_steps` attribute. Only used by the 'sequential'
+                solver
+            sample_type (str): 'iid' | 'antithetic' | 'sobol'; see
+                InferenceNetwork
+            param_rank (int, optional): if not `None`, each data-dependent
+                precision block is parameterized as diagonal plus low-rank,
+                diag(d^2) + U U^T with U of size dim_latent x `param_rank`,
+                so that the inference network outputs dim_latent *
+                (param_rank + 1) rather than dim_latent^2 values per time
+                point. This only reduces the number of network outputs and
+                parameters; the blocks are formed densely, so the
+                block-tridiagonal Cholesky decomposition and solves cost the
+                same as without it
+
+        Raises:
+            ValueError: for incorrect `solver` values
+            ValueError: if `steady_state_tol` is used with the 'parallel'
+                solver
+
+        """
 
         super().__init__(
             dim_input=dim_input, dim_latent=dim_latent,
-            num_mc_samples=num_mc_samples)
+            num_mc_samples=num_mc_samples, sample_type=sample_type)
 
         self.num_time_pts = num_time_pts
         self.nn_params = nn_params
+        self.use_inverse = use_inverse
+        if solver not in ['sequential', 'parallel']:
+            raise ValueError(
+                '"%s" is not a valid string for specifying the solver' %
+                solver)
+        self.solver = solver
+        if steady_state_tol is not None and solver == 'parallel':
+            raise ValueError(
+                'steady_state_tol is only available for the sequential solver')
+        self.steady_state_tol = steady_state_tol
+        self.chol_num_steps = None
+        self.param_rank = param_rank
 
         # initialize networks
 
@@ -89,8 +288,13 @@ class SmoothingLDS(InferenceNetwork):
             output_dim=self.dim_latent, nn_params=layer_z_mean_params)
 
         # inference network -> stddevs
+        if self.param_rank is None:
+            num_units = self.dim_latent * self.dim_latent
+        else:
+            # diagonal and low-rank factor of each block
+            num_units = self.dim_latent * (self.param_rank + 1)
         layer_z_var_params = [{
-            'units': self.dim_latent * self.dim_latent,
+            'units': num_units,
             'activation': 'identity',
             'kernel_initializer': 'trunc_normal',
             'kernel_regularizer': None,
@@ -98,8 +302,7 @@ class SmoothingLDS(InferenceNetwork):
             'bias_regularizer': None,
             'name': 'z_stddev'}]
         self.layer_z_vars = Network(
-            output_dim=self.dim_latent * self.dim_latent,
-            nn_params=layer_z_var_params)
+            output_dim=num_units, nn_params=layer_z_var_params)
 
     def build_graph(self, inputs, param_dict):
         """Build tensorflow computation graph for inference network"""
@@ -113,6 +316,8 @@ class SmoothingLDS(InferenceNetwork):
         self.Q = param_dict['Q']
         self.Q0_inv = param_dict['Q0_inv']
         self.Q_inv = param_dict['Q_inv']
+        self.A_blocks = param_dict['A_blocks']
+        self.A_factors = param_dict['A_factors']
         self.input = inputs
 
         with tf.variable_scope('inference_mlp'):
@@ -127,6 +332,9 @@ class SmoothingLDS(InferenceNetwork):
         with tf.variable_scope('posterior_samples'):
             self._build_posterior_samples()
 
+        with tf.variable_scope('posterior_covariances'):
+            self._build_posterior_covariances()
+
     def _build_inference_mlp(self):
 
         self.network.build_graph()
@@ -141,18 +349,44 @@ class SmoothingLDS(InferenceNetwork):
 
         # get sqrt of inverse of data-dependent covariances
         r_psi_sqrt = self.layer_z_vars.apply_network(self.hidden_act)
-        self.r_psi_sqrt = tf.reshape(
-            r_psi_sqrt,
-            [-1, self.num_time_pts, self.dim_latent, self.dim_latent])
+        if self.param_rank is None:
+            self.r_psi_sqrt = tf.reshape(
+                r_psi_sqrt,
+                [-1, self.num_time_pts, self.dim_latent, self.dim_latent])
+        else:
+            self.r_psi_diag, self.r_psi_factor = self._split_low_rank(
+                r_psi_sqrt, self.num_time_pts, self.dim_latent,
+                self.param_rank)
 
     def _build_precision_matrix(self):
         # get inverse of data-dependent covariances
-        self.c_psi_inv = tf.matmul(
-            self.r_psi_sqrt,
-            tf.transpose(self.r_psi_sqrt, perm=[0, 1, 3, 2]),
-            name='precision_diag_data_dep')
-
-        if self.dim_latent > 1:
+        if self.param_rank is None:
+            self.c_psi_inv = tf.matmul(
+                self.r_psi_sqrt,
+                tf.transpose(self.r_psi_sqrt, perm=[0, 1, 3, 2]),
+                name='precision_diag_data_dep')
+        else:
+            # dense blocks from the diagonal and low-rank parameters
+            self.c_psi_inv = tf.add(
+                tf.matrix_diag(tf.square(self.r_psi_diag)),
+                tf.matmul(self.r_psi_factor, self.r_psi_factor,
+                          transpose_b=True),
+                name='precision_diag_data_dep')
+
+        if self.A_blocks is not None:
+            # products with A from its per-population blocks; with
+            # f(X) = X A^T and symmetric X, A X = f(X)^T
+            AQ0_inv = tf.transpose(blk_diag_low_rank_apply(
+                self.A_blocks, self.A_factors, self.Q0_inv))
+            AQ_inv = tf.transpose(blk_diag_low_rank_apply(
+                self.A_blocks, self.A_factors, self.Q_inv))
+            self.AQ0_invA_Q_inv = blk_diag_low_rank_apply(
+                self.A_blocks, self.A_factors, AQ0_inv) + self.Q_inv
+            self.AQ_invA_Q_inv = blk_diag_low_rank_apply(
+                self.A_blocks, self.A_factors, AQ_inv) + self.Q_inv
+            self.AQ0_inv = -AQ0_inv
+            self.AQ_inv = -AQ_inv
+        elif self.dim_latent > 1:
             self.AQ0_invA_Q_inv = tf.matmul(
                 tf.matmul(self.A, self.Q0_inv), self.A, transpose_b=True) \
                 + self.Q_inv
@@ -169,23 +403,18 @@ class SmoothingLDS(InferenceNetwork):
             self.AQ0_inv = tf.multiply(-self.A, self.Q0_inv)
             self.AQ_inv = tf.multiply(-self.A, self.Q_inv)
 
-        # put together components of precision matrix Sinv in tensor of
-        # shape [batch_size, num_time_pts, dim_latent, dim_latent]
-        Sinv_diag = tf.tile(
-            tf.expand_dims(self.AQ_invA_Q_inv, 0),
-            [self.num_time_pts - 2, 1, 1])
-        Sinv_diag = tf.concat(
-            [tf.expand_dims(self.Q0_inv, 0),
-             tf.expand_dims(self.AQ0_invA_Q_inv, 0),
-             Sinv_diag], axis=0, name='precision_diag_static')
-        self.Sinv_diag = tf.add(Sinv_diag, self.c_psi_inv,
-                                name='precision_diag')
-
-        Sinv_ldiag = tf.tile(
-            tf.expand_dims(self.AQ_inv, 0),
-            [self.num_time_pts - 2, 1, 1], name='precision_lower_diag')
-        Sinv_ldiag0 = tf.concat(
-            [tf.expand_dims(self.AQ0_inv, 0), Sinv_ldiag], axis=0)
+        # put together the static components of the precision matrix Sinv;
+        # the tth diagonal block is
+        #   c_psi_inv[:, t] + Sinv_diag_static[min(t, 2)]
+        # and the tth (lower) off-diagonal block is
+        #   Sinv_ldiag_static[min(t, 1)]
+        # so that the blocks never need to be tiled over time
+        self.Sinv_diag_static = tf.stack(
+            [self.Q0_inv, self.AQ0_invA_Q_inv, self.AQ_invA_Q_inv], axis=0,
+            name='precision_diag_static')
+        self.Sinv_ldiag_static = tf.stack(
+            [self.AQ0_inv, self.AQ_inv], axis=0,
+            name='precision_lower_diag_static')
 
         # we now have Sinv (represented as diagonal and off-diagonal
         # blocks); to sample from the posterior we need the square root
@@ -194,75 +423,52 @@ class SmoothingLDS(InferenceNetwork):
         # Cholesky decomposition of Sinv, then calculate the inverse using
         # that decomposition
 
-        # get cholesky decomposition for each element in batch
-        def scan_chol(_, inputs):
-            """inputs refer to diagonal blocks, outputs the L/U matrices"""
-            chol_decomp_Sinv = blk_tridiag_chol(inputs, Sinv_ldiag0)
-            return chol_decomp_Sinv
-
-        self.chol_decomp_Sinv = tf.scan(
-            fn=scan_chol, elems=self.Sinv_diag,
-            initializer=[Sinv_diag, Sinv_ldiag0],  # throwaway to get scan
-            name='precision_chol_decomp')  # to behave
+        # get cholesky decomposition for all elements in batch at once
+        self.chol_decomp_Sinv = self._blk_tridiag_chol(
+            self.c_psi_inv, self.Sinv_diag_static, self.Sinv_ldiag_static)
 
     def _build_posterior_mean(self):
 
-        ia = tf.reduce_sum(
-            tf.multiply(self.c_psi_inv,
-                        tf.expand_dims(self.m_psi, axis=2)),
-            axis=3)
-
-        # ia now S x T x dim_latent
-
-        # get posterior means for each element in batch
-        def scan_chol_inv(_, inputs):
-            """inputs refer to L/U matrices, outputs to means"""
-            [chol_decomp_Sinv_0, chol_decomp_Sinv_1, ia] = inputs
-            # mult by R
-            ib = blk_chol_inv(
-                chol_decomp_Sinv_0, chol_decomp_Sinv_1, ia,
-                lower=True, transpose=False)
-            post_z_means = blk_chol_inv(
-                chol_decomp_Sinv_0, chol_decomp_Sinv_1, ib,
-                lower=False, transpose=True)
-
-            return post_z_means
-
-        self.post_z_means = tf.scan(
-            fn=scan_chol_inv,
-            elems=[self.chol_decomp_Sinv[0], self.chol_decomp_Sinv[1], ia],
-            initializer=ia[0])  # throwaway to get scan to behave
+        if self.param_rank is None:
+            ia = tf.reduce_sum(
+                tf.multiply(self.c_psi_inv,
+                            tf.expand_dims(self.m_psi, axis=2)),
+                axis=3)
+        else:
+            # multiply by diagonal and low-rank parts separately
+            ia = tf.square(self.r_psi_diag) * self.m_psi + tf.squeeze(
+                tf.matmul(self.r_psi_factor, tf.matmul(
+                    self.r_psi_factor, tf.expand_dims(self.m_psi, axis=3),
+                    transpose_a=True)), axis=3)
+
+        # ia now B x T x dim_latent
+
+        # mult by R
+        ib = self._blk_chol_inv(
+            self.chol_decomp_Sinv[0], self.chol_decomp_Sinv[1], ia,
+            lower=True, transpose=False)
+        self.post_z_means = self._blk_chol_inv(
+            self.chol_decomp_Sinv[0], self.chol_decomp_Sinv[1], ib,
+            lower=False, transpose=True)
 
     def _build_posterior_samples(self):
 
-        self.samples_z = tf.random_normal(
-            shape=[tf.shape(self.input)[0],
-                   self.num_time_pts, self.dim_latent, self.num_mc_samples],
-            mean=0.0, stddev=1.0, dtype=self.dtype, name='samples_z')
-
-        # get posterior sample(s) for each element in batch
-        def scan_chol_half_inv(_, inputs):
-            """
-            inputs refer to L/U matrices and N(0, 1) samples, outputs to
-            N(\mu, \sigma^2) samples
-            """
-            [chol_decomp_Sinv_0, chol_decomp_Sinv_1, samples] = inputs
-            rands = blk_chol_inv_multi(
-                chol_decomp_Sinv_0, chol_decomp_Sinv_1, samples,
-                lower=False, transpose=True)
-
-            return rands
+        self.samples_z = self._base_samples(
+            [tf.shape(self.input)[0],
+             self.num_time_pts, self.dim_latent, self.num_mc_samples],
+            mc_axis=3)
 
+        # get posterior sample(s) for all elements in batch at once; inputs
+        # refer to L/U matrices and N(0, 1) samples, outputs to
+        # N(0, \sigma^2) samples
         # note:
         #   B - batch_size; T - num_time_pts; D - dim_latent; S - mc samples
         #   self.chol_decomp_Sinv[0]: B x T x D x D
         #   self.chol_decomp_Sinv[1]: B x (T-1) x D x D
         #   self.samples_z: B x T x D x S
-        rands = tf.scan(
-            fn=scan_chol_half_inv,
-            elems=[self.chol_decomp_Sinv[0], self.chol_decomp_Sinv[1],
-                   self.samples_z],
-            initializer=self.samples_z[0])  # throwaway for scan to behave
+        rands = self._blk_chol_inv_multi(
+            self.chol_decomp_Sinv[0], self.chol_decomp_Sinv[1],
+            self.samples_z, lower=False, transpose=True)
 
         # rands is currently
         # batch_size x num_time_pts x dim_latent x num_mc_samples
@@ -274,6 +480,51 @@ class SmoothingLDS(InferenceNetwork):
         # tf addition op will broadcast extra 'num_mc_samples' dims
         self.post_z_samples = tf.expand_dims(self.post_z_means, axis=1) + rands
 
+    def _build_posterior_covariances(self):
+
+        # marginal covariances of each time point and cross-covariances of
+        # adjacent time points from the diagonal and 1st (lower) off-diagonal
+        # blocks of the inverse of Sinv:
+        #   self.post_z_covs: B x T x D x D
+        #   self.post_z_covs_lag: B x (T-1) x D x D; cov(z_{t+1}, z_t)
+        self.post_z_covs, self.post_z_covs_lag = blk_chol_selective_inv_batch(
+            self.chol_decomp_Sinv[0], self.chol_decomp_Sinv[1],
+            parallel=self.solver == 'parallel')
+
+    def _blk_tridiag_chol(self, D, D_static, B_static):
+        """Block-tridiagonal Cholesky decomposition using selected solver"""
+        if self.solver == 'sequential' and self.steady_state_tol is None:
+            return blk_tridiag_chol_static(
+                D, D_static, B_static, use_inverse=self.use_inverse)
+        # other solvers need the full set of blocks
+        D, B = blk_tridiag_expand_static(D, D_static, B_static)
+        if self.solver == 'parallel':
+            return blk_tridiag_chol_parallel(D, B)
+        else:
+            chol_blocks, self.chol_num_steps = blk_tridiag_chol_steady_state(
+                D, B, tol=self.steady_state_tol, use_inverse=self.use_inverse)
+            return chol_blocks
+
+    def _blk_chol_inv(self, D, B, b, lower=True, transpose=False):
+        """Block-bidiagonal solve using selected solver"""
+        if self.solver == 'parallel':
+            return blk_chol_inv_parallel(
+                D, B, b, lower=lower, transpose=transpose)
+        else:
+            return blk_chol_inv_batch(
+                D, B, b, lower=lower, transpose=transpose,
+                use_inverse=self.use_inverse)
+
+    def _blk_chol_inv_multi(self, D, B, y, lower=True, transpose=False):
+        """Block-bidiagonal solve with multiple RHS using selected solver"""
+        if self.solver == 'parallel':
+            return blk_chol_inv_multi_parallel(
+                D, B, y, lower=lower, transpose=transpose)
+        else:
+            return blk_chol_inv_multi_batch(
+                D, B, y, lower=lower, transpose=transpose,
+                use_inverse=self.use_inverse)
+
     def entropy(self):
         """Entropy of approximate posterior"""
 
@@ -286,10 +537,7 @@ class SmoothingLDS(InferenceNetwork):
         ln_det = -2.0 * tf.reduce_sum(
             tf.reduce_mean(tf.log(diags), axis=0))
 
-        entropy = ln_det / 2.0 + self.dim_latent * self.num_time_pts / 2.0 * (
-                    1.0 + np.log(2.0 * np.pi))
-
-        return entropy
+        return self._entropy_from_ln_det(ln_det)
 
     def sample(self, sess, observations, seed=None):
         """
@@ -330,6 +578,28 @@ class SmoothingLDS(InferenceNetwork):
 
         return sess.run(self.post_z_means, feed_dict=feed_dict)
 
+    def get_posterior_covariances(self, sess, input_data):
+        """
+        Get posterior marginal covariances and lag-one cross-covariances
+        conditioned on inference network input
+
+        Args:
+            sess (tf.Session object)
+            input_data (batch_size x num_time_pts x dim_input numpy array)
+
+        Returns:
+            batch_size x num_time_pts x dim_latent x dim_latent numpy array:
+                cov(z_t, z_t)
+            batch_size x num_time_pts-1 x dim_latent x dim_latent numpy array:
+                cov(z_{t+1}, z_t)
+
+        """
+
+        feed_dict = {self.input: input_data}
+
+        return sess.run(
+            [self.post_z_covs, self.post_z_covs_lag], feed_dict=feed_dict)
+
 
 class MeanFieldGaussian(InferenceNetwork):
     """
@@ -347,11 +617,11 @@ class MeanFieldGaussian(InferenceNetwork):
 
     def __init__(
             self, dim_input=None, dim_latent=None, num_mc_samples=1,
-            num_time_pts=None, nn_params=None):
+            num_time_pts=None, nn_params=None, sample_type='iid'):
 
         super().__init__(
             dim_input=dim_input, dim_latent=dim_latent,
-            num_mc_samples=num_mc_samples)
+            num_mc_samples=num_mc_samples, sample_type=sample_type)
 
         self.num_time_pts = num_time_pts
         self.nn_params = nn_params
@@ -424,10 +694,10 @@ class MeanFieldGaussian(InferenceNetwork):
 
     def _build_posterior_samples(self):
 
-        self.samples_z = tf.random_normal(
-            shape=[tf.shape(self.input)[0],
-                   self.num_mc_samples, self.num_time_pts, self.dim_latent],
-            mean=0.0, stddev=1.0, dtype=self.dtype, name='samples_z')
+        self.samples_z = self._base_samples(
+            [tf.shape(self.input)[0],
+             self.num_mc_samples, self.num_time_pts, self.dim_latent],
+            mc_axis=1)
 
         # keep log-vars in reasonable range
         #temp0 = 5.0 * tf.tanh(self.post_z_log_vars / 5.0)
@@ -442,10 +712,7 @@ class MeanFieldGaussian(InferenceNetwork):
 
         ln_det = tf.reduce_sum(tf.reduce_mean(self.post_z_log_vars, axis=0))
 
-        entropy = ln_det / 2.0 + self.dim_latent * self.num_time_pts / 2.0 * (
-                    1.0 + np.log(2.0 * np.pi))
-
-        return entropy
+        return self._entropy_from_ln_det(ln_det)
 
     def sample(self, sess, observations, seed=None):
         """
@@ -484,19 +751,21 @@ class MeanFieldGaussianTemporal(InferenceNetwork):
     x ~ \prod_{t=1}^T N( mu_t(y_t), sigma_t(y_t) )
 
     Each covariance sigma_t is a full [dim_latent x dim_latent] covariance
-    matrix.
+    matrix, or optionally diagonal plus low-rank (`block_rank`)
     """
 
     def __init__(
             self, dim_input=None, dim_latent=None, num_mc_samples=1,
-            num_time_pts=None, nn_params=None):
+            num_time_pts=None, nn_params=None, sample_type='iid',
+            block_rank=None):
 
         super().__init__(
             dim_input=dim_input, dim_latent=dim_latent,
-            num_mc_samples=num_mc_samples)
+            num_mc_samples=num_mc_samples, sample_type=sample_type)
 
         self.num_time_pts = num_time_pts
         self.nn_params = nn_params
+        self.block_rank = block_rank
 
         # initialize networks
 
@@ -526,8 +795,13 @@ class MeanFieldGaussianTemporal(InferenceNetwork):
             output_dim=self.dim_latent, nn_params=layer_z_mean_params)
 
         # inference network -> log vars
+        if self.block_rank is None:
+            num_units = self.dim_latent * self.dim_latent
+        else:
+            # diagonal and low-rank factor of each block
+            num_units = self.dim_latent * (self.block_rank + 1)
         layer_z_var_params = [{
-            'units': self.dim_latent * self.dim_latent,
+            'units': num_units,
             'activation': 'identity',
             'kernel_initializer': 'trunc_normal',
             'kernel_regularizer': None,
@@ -535,8 +809,7 @@ class MeanFieldGaussianTemporal(InferenceNetwork):
             'bias_regularizer': None,
             'name': 'z_stddev'}]
         self.layer_z_vars = Network(
-            output_dim=self.dim_latent * self.dim_latent,
-            nn_params=layer_z_var_params)
+            output_dim=num_units, nn_params=layer_z_var_params)
 
     def build_graph(self, *args):
         """Build tensorflow computation graph for inference network"""
@@ -563,42 +836,37 @@ class MeanFieldGaussianTemporal(InferenceNetwork):
 
         # get sqrt of inverse of data-dependent covariances
         r_psi_sqrt = self.layer_z_vars.apply_network(self.hidden_act)
-        self.r_psi_sqrt = tf.reshape(
-            r_psi_sqrt,
-            [-1, self.num_time_pts, self.dim_latent, self.dim_latent])
+        if self.block_rank is None:
+            self.r_psi_sqrt = tf.reshape(
+                r_psi_sqrt,
+                [-1, self.num_time_pts, self.dim_latent, self.dim_latent])
+        else:
+            self.r_psi_diag, self.r_psi_factor = self._split_low_rank(
+                r_psi_sqrt, self.num_time_pts, self.dim_latent,
+                self.block_rank)
 
     def _build_posterior_samples(self):
 
-        self.samples_z = tf.random_normal(
-            shape=[tf.shape(self.input)[0],
-                   self.num_time_pts, self.dim_latent, self.num_mc_samples],
-            mean=0.0, stddev=1.0, dtype=self.dtype, name='samples_z')
-
-        def sample_batch(outputs, inputs):
-            # samples: num_time_pts x dim_latent x num_mc_samples
-            # cov_chol: num_time_pts x dim_latent x dim_latent
-            z_samples, cov_chol = inputs
-            # scan over time dimension
-            samples = tf.scan(
-                fn=sample_time,
-                elems=[z_samples, cov_chol],
-                initializer=z_samples[0])  # throwaway for scan to behave
-            return samples
-
-        def sample_time(outputs, inputs):
-            # samples: dim_latent x num_mc_samples
-            # cov_chol: dim_latent x dim_latent
-            z_samples, cov_chol = inputs
-            # scan over time dimension
-            samples = tf.matmul(cov_chol, z_samples)
-            return samples
-
-        # scan over batch dimension
+        if self.block_rank is None:
+            dim_samples = self.dim_latent
+        else:
+            # separate samples for diagonal and low-rank parts
+            dim_samples = self.dim_latent + self.block_rank
+        self.samples_z = self._base_samples(
+            [tf.shape(self.input)[0],
+             self.num_time_pts, dim_samples, self.num_mc_samples],
+            mc_axis=3)
+
+        # multiply each (trial, time) sample by its covariance factor in a
+        # single batched matmul
         # returns num_batches x num_time_pts x dim_latent x num_mc_samples
-        rands_shuff = tf.scan(
-            fn=sample_batch,
-            elems=[self.samples_z, self.r_psi_sqrt],
-            initializer=self.samples_z[0])  # throwaway for scan to behave
+        if self.block_rank is None:
+            rands_shuff = tf.matmul(self.r_psi_sqrt, self.samples_z)
+        else:
+            rands_shuff = tf.expand_dims(self.r_psi_diag, axis=3) \
+                * self.samples_z[:, :, :self.dim_latent] \
+                + tf.matmul(self.r_psi_factor,
+                            self.samples_z[:, :, self.dim_latent:])
 
         rands = tf.transpose(rands_shuff, perm=[0, 3, 1, 2])
 
@@ -607,37 +875,32 @@ class MeanFieldGaussianTemporal(InferenceNetwork):
     def entropy(self):
         """Entropy of approximate posterior"""
 
-        # determinant of the covariance is the square of the determinant of the
-        # cholesky factor; determinant of the cholesky factor is the product of
-        # the diagonal elements of the block-diagonal
-        def det_loop_batch(outputs, inputs):
-            # inputs: num_time_dims x dim_latent x dim_latent
-            # now scan over over time
-            out = tf.scan(
-                fn=det_loop_time, elems=inputs, initializer=0.0)
-            return out
-
-        def det_loop_time(outputs, inputs):
-            # inputs is dim_latent x dim_latent matrix
-            return tf.matrix_determinant(tf.matmul(
-                inputs, inputs, transpose_b=True)
-                + 1e-6 * np.eye(self.dim_latent))
-
-        # for each batch, scan over time, calculating det of time blocks; det
-        # of full matrix is product of determinants over blocks
-        self.dets = dets = tf.scan(
-            fn=det_loop_batch, elems=self.r_psi_sqrt,
-            initializer=self.r_psi_sqrt[0, :, 0, 0], infer_shape=False)
-        # shape of initializer must match shape of returned element; in this
-        # case a single scalar (the determinant) for each time point
+        # log-determinant of each (trial, time) covariance block from the
+        # diagonal of its cholesky factor, computed for all blocks at once;
+        # this avoids under/overflow of the determinant itself
+        if self.block_rank is None:
+            covs = tf.matmul(
+                self.r_psi_sqrt, self.r_psi_sqrt, transpose_b=True) \
+                + 1e-6 * tf.eye(self.dim_latent, dtype=self.dtype)
+            self.ln_dets = 2.0 * tf.reduce_sum(
+                tf.log(tf.matrix_diag_part(tf.cholesky(covs))), axis=-1)
+        else:
+            # matrix determinant lemma; only requires the cholesky factor of
+            # a block_rank x block_rank capacitance matrix
+            covs_diag = tf.square(self.r_psi_diag) + 1e-6
+            capacitance = tf.eye(self.block_rank, dtype=self.dtype) \
+                + tf.matmul(
+                    self.r_psi_factor,
+                    self.r_psi_factor / tf.expand_dims(covs_diag, axis=3),
+                    transpose_a=True)
+            self.ln_dets = tf.reduce_sum(tf.log(covs_diag), axis=-1) \
+                + 2.0 * tf.reduce_sum(tf.log(tf.matrix_diag_part(
+                    tf.cholesky(capacitance))), axis=-1)
 
         # mean over batch dimension, sum over time dimension
-        ln_det = tf.reduce_sum(tf.reduce_mean(tf.log(dets), axis=0))
+        ln_det = tf.reduce_sum(tf.reduce_mean(self.ln_dets, axis=0))
 
-        entropy = ln_det / 2.0 + self.dim_latent * self.num_time_pts / 2.0 * (
-                    1.0 + np.log(2.0 * np.pi))
-
-        return entropy
+        return self._entropy_from_ln_det(ln_det)
 
     def sample(self, sess, observations, seed=None):
         """
@@ -666,3 +929,752 @@ class MeanFieldGaussianTemporal(InferenceNetwork):
         feed_dict = {self.input: input_data}
 
         return sess.run(self.post_z_means, feed_dict=feed_dict)
+
+
+class KalmanSmoother(InferenceNetwork):
+    """
+    Exact posterior of a linear-Gaussian dynamical system
+
+    z_0 ~ N(z0_mean, Q0)
+    z_t ~ N(A z_{t-1}, Q)
+    y_t ~ N(C z_t + d, R)
+
+    computed with a Kalman filter and Rauch-Tung-Striebel smoother using the
+    current parameters of the generative model (no inference network is
+    trained). Since the observation model has no missing data, the filtered
+    and smoothed covariances do not depend on the observations and are
+    computed once for all trials; only the means are computed for each trial.
+    The filter is run in information form so that only dim_latent x
+    dim_latent matrices are inverted, and the marginal log-likelihood of the
+    observations is evaluated with the matrix determinant lemma and the
+    Woodbury identity.
+
+    The input to this network is the observations themselves; the emissions
+    parameters C, d, R and R_inv must be supplied in the `param_dict` passed to
+    `build_graph` (see `NetFLDS.initialize_readout_vars`).
+    """
+
+    # posterior and marginal likelihood are exact
+    fit_evidence = True
+    requires_prior_precisions = True
+
+    def __init__(
+            self, dim_input=None, dim_latent=None, num_mc_samples=1,
+            num_time_pts=None, sample_type='iid'):
+        """
+        Args:
+            dim_input (int): dimension of observations
+            dim_latent (int): dimension of latent state
+            num_mc_samples (int): number of samples drawn from the posterior
+            num_time_pts (int): number of time points per observation of the
+                dynamical sequence
+            sample_type (str): 'iid' | 'antithetic' | 'sobol'; see
+                InferenceNetwork
+
+        """
+
+        super().__init__(
+            dim_input=dim_input, dim_latent=dim_latent,
+            num_mc_samples=num_mc_samples, sample_type=sample_type)
+
+        self.num_time_pts = num_time_pts
+
+    def build_graph(self, inputs, param_dict):
+        """
+        Build tensorflow computation graph for Kalman smoother
+
+        Raises:
+            ValueError: if observation model is not linear-Gaussian
+
+        """
+
+        if param_dict['noise_dist'] != 'gaussian':
+            raise ValueError(
+                'KalmanSmoother requires a linear-Gaussian observation model')
+
+        # set prior variables generated elsewhere
+        self.z0_mean = param_dict['z0_mean']
+        self.A = param_dict['A']
+        self.Q0_sqrt = param_dict['Q0_sqrt']
+        self.Q_sqrt = param_dict['Q_sqrt']
+        self.Q0 = param_dict['Q0']
+        self.Q = param_dict['Q']
+        self.Q0_inv = param_dict['Q0_inv']
+        self.Q_inv = param_dict['Q_inv']
+        # set emissions variables generated elsewhere
+        self.C = param_dict['C']
+        self.d = param_dict['d']
+        self.R = param_dict['R']
+        self.R_inv = param_dict['R_inv']
+        self.input = inputs
+
+        with tf.variable_scope('kalman_filter'):
+            self._build_filter_covariances()
+            self._build_filter_means()
+
+        with tf.variable_scope('rts_smoother'):
+            self._build_smoother_covariances()
+            self._build_smoother_means()
+
+        with tf.variable_scope('posterior_samples'):
+            self._build_posterior_samples()
+
+        with tf.variable_scope('marginal_likelihood'):
+            self._build_marginal_likelihood()
+
+    def _spd_inverse(self, M):
+        """Inverse of a symmetric positive definite matrix"""
+        return tf.cholesky_solve(
+            tf.cholesky(M), tf.eye(self.dim_latent, dtype=self.dtype))
+
+    def _build_filter_covariances(self):
+
+        # observation precision projected into the latent space, C^T R^-1 C;
+        # C is stored as the kernel of the linear readout (y = z C + d)
+        self.CR_invC = tf.matmul(self.C * self.R_inv, self.C, transpose_b=True)
+
+        def filter_update(outputs, inputs):
+            P_filt = outputs[2]
+            # predict
+            P_pred = tf.matmul(tf.matmul(self.A, P_filt), self.A,
+                               transpose_b=True) + self.Q
+            # update (information form)
+            P_pred_inv = self._spd_inverse(P_pred)
+            P_filt = self._spd_inverse(P_pred_inv + self.CR_invC)
+            return [P_pred, P_pred_inv, P_filt]
+
+        P_filt0 = self._spd_inverse(self.Q0_inv + self.CR_invC)
+
+        # scan over time dimension; covariances are shared by all trials
+        P_pred, P_pred_inv, P_filt = tf.scan(
+            fn=filter_update,
+            elems=tf.range(self.num_time_pts - 1),
+            initializer=[self.Q0, self.Q0_inv, P_filt0])
+
+        # T x dim_latent x dim_latent
+        self.P_pred = tf.concat(
+            [tf.expand_dims(self.Q0, axis=0), P_pred], axis=0)
+        self.P_pred_inv = tf.concat(
+            [tf.expand_dims(self.Q0_inv, axis=0), P_pred_inv], axis=0)
+        self.P_filt = tf.concat(
+            [tf.expand_dims(P_filt0, axis=0), P_filt], axis=0)
+
+    def _build_filter_means(self):
+
+        # information contributed by each observation, C^T R^-1 (y_t - d):
+        # batch_size x num_time_pts x dim_latent
+        self.obs_info = tf.tensordot(
+            (self.input - self.d) * self.R_inv, self.C, axes=[[2], [1]])
+
+        def filter_update(outputs, inputs):
+            m_filt = outputs[1]
+            obs_info, P_pred_inv, P_filt = inputs
+            # predict
+            m_pred = tf.matmul(m_filt, self.A, transpose_b=True)
+            # update
+            m_filt = tf.matmul(
+                tf.matmul(m_pred, P_pred_inv) + obs_info, P_filt)
+            return [m_pred, m_filt]
+
+        # scan over time dimension: T x batch_size x dim_latent
+        obs_info = tf.transpose(self.obs_info, perm=[1, 0, 2])
+
+        m_pred0 = tf.tile(self.z0_mean, [tf.shape(self.input)[0], 1])
+        m_filt0 = tf.matmul(
+            tf.matmul(m_pred0, self.Q0_inv) + obs_info[0], self.P_filt[0])
+
+        m_pred, m_filt = tf.scan(
+            fn=filter_update,
+            elems=[obs_info[1:], self.P_pred_inv[1:], self.P_filt[1:]],
+            initializer=[m_pred0, m_filt0])
+
+        # T x batch_size x dim_latent
+        self.m_pred = tf.concat(
+            [tf.expand_dims(m_pred0, axis=0), m_pred], axis=0)
+        self.m_filt = tf.concat(
+            [tf.expand_dims(m_filt0, axis=0), m_filt], axis=0)
+
+    def _build_smoother_covariances(self):
+
+        # smoother gains J_t = P_filt_t A^T P_pred_{t+1}^-1:
+        # T-1 x dim_latent x dim_latent
+        self.J = tf.matmul(
+            tf.tensordot(self.P_filt[:-1], self.A, axes=[[2], [1]]),
+            self.P_pred_inv[1:])
+
+        # covariance of z_t | z_{t+1}, y_{1:t}, computed in information form
+        # so that it is positive definite by construction
+        AQ_invA = tf.matmul(tf.matmul(self.A, self.Q_inv, transpose_a=True),
+                            self.A)
+        P_cond = tf.map_fn(
+            lambda P: self._spd_inverse(self._spd_inverse(P) + AQ_invA),
+            self.P_filt[:-1])
+        self.P_cond_chol = tf.cholesky(P_cond)
+
+        def smoother_update(outputs, inputs):
+            P_smooth_next = outputs
+            P_filt, P_pred_next, J = inputs
+            return P_filt + tf.matmul(
+                tf.matmul(J, P_smooth_next - P_pred_next), J,
+                transpose_b=True)
+
+        # backward scan over time dimension
+        P_smooth = tf.scan(
+            fn=smoother_update,
+            elems=[self.P_filt[:-1], self.P_pred[1:], self.J],
+            initializer=self.P_filt[-1], reverse=True)
+
+        # T x dim_latent x dim_latent
+        P_smooth = tf.concat(
+            [P_smooth, tf.expand_dims(self.P_filt[-1], axis=0)], axis=0)
+        P_smooth_lag = tf.matmul(P_smooth[1:], self.J, transpose_b=True)
+
+        # covariances do not depend on the data; copy over batch to match
+        # the other inference networks:
+        #   self.post_z_covs: B x T x D x D
+        #   self.post_z_covs_lag: B x (T-1) x D x D; cov(z_{t+1}, z_t)
+        batch_size = tf.shape(self.input)[0]
+        self.post_z_covs = tf.tile(
+            tf.expand_dims(P_smooth, axis=0), [batch_size, 1, 1, 1])
+        self.post_z_covs_lag = tf.tile(
+            tf.expand_dims(P_smooth_lag, axis=0), [batch_size, 1, 1, 1])
+
+    def _build_smoother_means(self):
+
+        def smoother_update(outputs, inputs):
+            m_smooth_next = outputs
+            m_filt, m_pred_next, J = inputs
+            return m_filt + tf.matmul(
+                m_smooth_next - m_pred_next, J, transpose_b=True)
+
+        # backward scan over time dimension
+        m_smooth = tf.scan(
+            fn=smoother_update,
+            elems=[self.m_filt[:-1], self.m_pred[1:], self.J],
+            initializer=self.m_filt[-1], reverse=True)
+        m_smooth = tf.concat(
+            [m_smooth, tf.expand_dims(self.m_filt[-1], axis=0)], axis=0)
+
+        # batch_size x num_time_pts x dim_latent
+        self.post_z_means = tf.transpose(m_smooth, perm=[1, 0, 2])
+
+    def _build_posterior_samples(self):
+        """Forward-filter backward-sample draws from the exact posterior"""
+
+        # num_time_pts x batch_size x num_mc_samples x dim_latent
+        self.samples_z = tf.transpose(self._base_samples(
+            [tf.shape(self.input)[0],
+             self.num_mc_samples, self.num_time_pts, self.dim_latent],
+            mc_axis=1), perm=[2, 0, 1, 3])
+
+        def sample_update(outputs, inputs):
+            z_next = outputs
+            m_filt, m_pred_next, J, P_cond_chol, samples_z = inputs
+            # z_t | z_{t+1}, y_{1:t}
+            z_mean = tf.expand_dims(m_filt, axis=1) + tf.tensordot(
+                z_next - tf.expand_dims(m_pred_next, axis=1), J,
+                axes=[[2], [1]])
+            return z_mean + tf.tensordot(
+                samples_z, P_cond_chol, axes=[[2], [1]])
+
+        # sample last time point from filtering distribution
+        z_last = tf.expand_dims(self.m_filt[-1], axis=1) + tf.tensordot(
+            self.samples_z[-1], tf.cholesky(self.P_filt[-1]),
+            axes=[[2], [1]])
+
+        # backward scan over time dimension: T x batch_size x num_mc_samples x
+        # dim_latent
+        samples = tf.scan(
+            fn=sample_update,
+            elems=[self.m_filt[:-1], self.m_pred[1:], self.J,
+                   self.P_cond_chol, self.samples_z[:-1]],
+            initializer=z_last, reverse=True)
+        samples = tf.concat(
+            [samples, tf.expand_dims(z_last, axis=0)], axis=0)
+
+        # batch_size x num_mc_samples x num_time_pts x dim_latent
+        self.post_z_samples = tf.transpose(samples, perm=[1, 2, 0, 3])
+
+    def _build_marginal_likelihood(self):
+
+        # one-step predictive distribution of observations is
+        #   y_t ~ N(m_pred_t C + d, S_t), S_t = C^T P_pred_t C + R
+        # with
+        #   ln|S_t| = ln|R| + ln|P_pred_t| - ln|P_filt_t|
+        #   e^T S_t^-1 e = e^T R^-1 e - (C R^-1 e)^T P_filt_t (C R^-1 e)
+        def ln_det(M):
+            return 2.0 * tf.reduce_sum(
+                tf.log(tf.matrix_diag_part(tf.cholesky(M))), axis=-1)
+
+        ln_det_S = tf.reduce_sum(tf.log(self.R)) \
+            + ln_det(self.P_pred) - ln_det(self.P_filt)
+
+        # residuals: T x batch_size x dim_obs
+        res_y = tf.transpose(self.input, perm=[1, 0, 2]) - self.d \
+            - tf.tensordot(self.m_pred, self.C, axes=[[2], [0]])
+        res_y_info = tf.tensordot(
+            res_y * self.R_inv, self.C, axes=[[2], [1]])
+        quad = tf.reduce_sum(tf.square(res_y) * self.R_inv, axis=2) \
+            - tf.reduce_sum(
+                tf.matmul(res_y_info, self.P_filt) * res_y_info, axis=2)
+
+        # T x batch_size
+        log_like = -0.5 * (
+            quad + tf.expand_dims(ln_det_S, axis=1)
+            + self.dim_input * np.log(2.0 * np.pi))
+
+        # sum over time dimension: batch_size
+        self.log_marginal_likelihood = tf.reduce_sum(log_like, axis=0)
+
+    def evidence(self):
+        """Log marginal likelihood, averaged over minibatch samples"""
+        return tf.reduce_mean(self.log_marginal_likelihood)
+
+    def entropy(self):
+        """Entropy of posterior"""
+
+        # posterior factorizes as p(z_T | y) \prod_t p(z_t | z_{t+1}, y), so
+        # the log-determinant of the covariance is the sum of the
+        # log-determinants of the conditional covariances
+        ln_det = 2.0 * tf.reduce_sum(
+            tf.log(tf.matrix_diag_part(self.P_cond_chol))) \
+            + 2.0 * tf.reduce_sum(
+                tf.log(tf.matrix_diag_part(tf.cholesky(self.P_filt[-1]))))
+
+        return self._entropy_from_ln_det(ln_det)
+
+    def sample(self, sess, observations, seed=None):
+        """
+        Draw samples from posterior
+
+        Args:
+            sess (tf.Session object)
+            observations (batch_size x num_time_pts x num_inputs numpy array)
+            seed (int, optional)
+
+        Returns:
+            batch_size x num_mc_samples x num_time_pts x dim_latent numpy array
+
+        """
+
+        if seed is not None:
+            tf.set_random_seed(seed)
+
+        return sess.run(
+            self.post_z_samples,
+            feed_dict={self.input: observations})
+
+    def get_params(self, sess):
+        """Get parameters of generative model"""
+
+        A, z0_mean, Q_sqrt, Q, Q0_sqrt, Q0 = sess.run(
+            [self.A, self.z0_mean, self.Q_sqrt, self.Q, self.Q0_sqrt, self.Q0])
+
+        param_dict = {'A': A, 'z0_mean': z0_mean, 'Q': Q, 'Q0': Q0,
+                      'Q_sqrt': Q_sqrt, 'Q0_sqrt': Q0_sqrt}
+
+        return param_dict
+
+    def get_posterior_means(self, sess, input_data):
+        """Get posterior means conditioned on observations"""
+
+        feed_dict = {self.input: input_data}
+
+        return sess.run(self.post_z_means, feed_dict=feed_dict)
+
+    def get_posterior_covariances(self, sess, input_data):
+        """
+        Get posterior marginal covariances and lag-one cross-covariances
+        conditioned on observations; see
+        `SmoothingLDS.get_posterior_covariances`
+        """
+
+        feed_dict = {self.input: input_data}
+
+        return sess.run(
+            [self.post_z_covs, self.post_z_covs_lag], feed_dict=feed_dict)
+
+
+class LaplaceLDS(InferenceNetwork):
+    """
+    Laplace approximation to the posterior of a dynamical system with Poisson
+    observations
+
+    z_0 ~ N(z0_mean, Q0)
+    z_t ~ N(A z_{t-1}, Q)
+    y_t ~ Poisson(f(z_t C + d)),  f = softplus | exp
+
+    The posterior mode of each trial is found by Newton iterations using the
+    current parameters of the generative model (no inference network is
+    trained). The Hessian of the log posterior is block-tridiagonal, so each
+    step is a block Cholesky decomposition followed by two block-bidiagonal
+    solves. The Fisher information of the observations is used in place of
+    their Hessian so that each step (and the resulting posterior covariance)
+    is positive definite (for the exponential link the two coincide, up to
+    the 1e-3 offset inside the log). Steps are halved for each trial until
+    they do not decrease its log posterior; the iterations stop early if no
+    trial accepts a step (`newton_stalled`). Whether the mode of each trial
+    converged and the size of its final gradient are available as
+    `newton_converged` and `newton_grad_norm`.
+
+    The mode is treated as a constant when differentiating the Laplace
+    evidence with respect to the model parameters. This is exact for the log
+    joint term, whose gradient wrt the mode vanishes there, but not for the
+    log-determinant of the posterior precision, which depends on the mode
+    through the observation Fisher information; the implicit dependence of
+    that term on the parameters is ignored, so the evidence gradient is an
+    approximation.
+
+    The input to this network is the observations themselves; the emissions
+    parameters C and d must be supplied in the `param_dict` passed to
+    `build_graph` (see `NetFLDS.initialize_readout_vars`).
+    """
+
+    # posterior computed from model; fit by Laplace-approximated evidence
+    fit_evidence = True
+    requires_prior_precisions = True
+
+    def __init__(
+            self, dim_input=None, dim_latent=None, num_mc_samples=1,
+            num_time_pts=None, max_newton_iters=20, newton_tol=1e-5,
+            newton_grad_tol=1e-3, max_step_halvings=10, sample_type='iid'):
+        """
+        Args:
+            dim_input (int): dimension of observations
+            dim_latent (int): dimension of latent state
+            num_mc_samples (int): number of samples drawn from the posterior
+            num_time_pts (int): number of time points per observation of the
+                dynamical sequence
+            max_newton_iters (int): maximum number of Newton iterations
+            newton_tol (float): Newton iterations stop once the largest change
+                in the latent states is smaller than this tolerance
+            newton_grad_tol (float): the mode of a trial is reported as
+                converged if the largest absolute gradient of its log
+                posterior is smaller than this tolerance
+            max_step_halvings (int): maximum number of times the Newton step
+                of a trial is halved when it decreases the log posterior;
+                the trial is not updated if no step improves it
+            sample_type (str): 'iid' | 'antithetic' | 'sobol'; see
+                InferenceNetwork
+
+        """
+
+        super().__init__(
+            dim_input=dim_input, dim_latent=dim_latent,
+            num_mc_samples=num_mc_samples, sample_type=sample_type)
+
+        self.num_time_pts = num_time_pts
+        self.max_newton_iters = max_newton_iters
+        self.newton_tol = newton_tol
+        self.newton_grad_tol = newton_grad_tol
+        self.max_step_halvings = max_step_halvings
+
+    def build_graph(self, inputs, param_dict):
+        """
+        Build tensorflow computation graph for Laplace approximation
+
+        Raises:
+            ValueError: if observation model is not Poisson
+
+        """
+
+        if param_dict['noise_dist'] != 'poisson':
+            raise ValueError('LaplaceLDS requires a Poisson observation model')
+
+        # set prior variables generated elsewhere
+        self.z0_mean = param_dict['z0_mean']
+        self.A = param_dict['A']
+        self.Q0_sqrt = param_dict['Q0_sqrt']
+        self.Q_sqrt = param_dict['Q_sqrt']
+        self.Q0 = param_dict['Q0']
+        self.Q = param_dict['Q']
+        self.Q0_inv = param_dict['Q0_inv']
+        self.Q_inv = param_dict['Q_inv']
+        self.Q0_chol = param_dict['Q0_chol']
+        self.Q_chol = param_dict['Q_chol']
+        # set emissions variables generated elsewhere
+        self.C = param_dict['C']
+        self.d = param_dict['d']
+        self.poisson_link = param_dict['poisson_link']
+        self.input = inputs
+
+        with tf.variable_scope('prior_precision'):
+            self._build_prior_precision()
+
+        with tf.variable_scope('posterior_mode'):
+            self._build_posterior_mode()
+
+        with tf.variable_scope('posterior_covariances'):
+            self._build_posterior_covariances()
+
+        with tf.variable_scope('posterior_samples'):
+            self._build_posterior_samples()
+
+        with tf.variable_scope('marginal_likelihood'):
+            self._build_marginal_likelihood()
+
+    def _build_prior_precision(self):
+
+        # precision of the prior over z_{0:T-1} is block-tridiagonal, with
+        # diagonal blocks
+        #   Q0^-1 + A^T Q^-1 A, Q^-1 + A^T Q^-1 A, ..., Q^-1
+        # and (lower) off-diagonal blocks -Q^-1 A
+        AQ_invA = tf.matmul(
+            tf.matmul(self.A, self.Q_inv, transpose_a=True), self.A)
+        self.prior_diag = tf.concat(
+            [tf.expand_dims(self.Q0_inv + AQ_invA, axis=0),
+             tf.tile(tf.expand_dims(self.Q_inv + AQ_invA, axis=0),
+                     [self.num_time_pts - 2, 1, 1]),
+             tf.expand_dims(self.Q_inv, axis=0)], axis=0)
+        self.prior_ldiag = tf.tile(
+            tf.expand_dims(-tf.matmul(self.Q_inv, self.A), axis=0),
+            [self.num_time_pts - 1, 1, 1])
+
+    def _rates(self, z):
+        """Firing rates and their derivatives wrt the linear predictor"""
+        eta = tf.tensordot(z, self.C, axes=[[len(z.shape) - 1], [0]]) + self.d
+        if self.poisson_link == 'exponential':
+            rates = tf.exp(eta)
+            return rates, rates
+        return tf.nn.softplus(eta), tf.nn.sigmoid(eta)
+
+    def _prior_residuals(self, z):
+        res_z0 = z[..., 0, :] - self.z0_mean
+        res_z = z[..., 1:, :] - tf.tensordot(
+            z[..., :-1, :], self.A, axes=[[len(z.shape) - 1], [1]])
+        return res_z0, res_z
+
+    def _log_joint(self, z):
+        """
+        Log joint density of observations and latent states of each trial, up
+        to terms that do not depend on `z` (... x batch_size x num_time_pts x
+        dim_latent tf.Tensor)
+        """
+
+        rates, _ = self._rates(z)
+        log_like = tf.reduce_sum(
+            self.input * tf.log(rates + 1e-3) - rates, axis=[-2, -1])
+
+        res_z0, res_z = self._prior_residuals(z)
+        quad = tf.reduce_sum(
+            tf.tensordot(res_z0, self.Q0_inv, axes=[[len(z.shape) - 2], [0]])
+            * res_z0, axis=-1) \
+            + tf.reduce_sum(tf.tensordot(
+                res_z, self.Q_inv, axes=[[len(z.shape) - 1], [0]]) * res_z,
+                axis=[-2, -1])
+
+        return log_like - 0.5 * quad
+
+    def _newton_terms(self, z):
+        """
+        Gradient of the log posterior and block-tridiagonal blocks of the
+        negative (Fisher) Hessian at `z`
+        """
+
+        rates, drates = self._rates(z)
+
+        # gradient of log prior
+        res_z0, res_z = self._prior_residuals(z)
+        res_z0_Q0_inv = tf.matmul(res_z0, self.Q0_inv)
+        res_z_Q_inv = tf.tensordot(res_z, self.Q_inv, axes=[[2], [0]])
+        zeros = tf.zeros_like(res_z0_Q0_inv[:, None, :])
+        grad = -tf.concat([tf.expand_dims(res_z0_Q0_inv, axis=1),
+                           res_z_Q_inv], axis=1) \
+            + tf.concat([tf.tensordot(res_z_Q_inv, self.A, axes=[[2], [0]]),
+                         zeros], axis=1)
+
+        # gradient of log likelihood (with the 1e-3 offset inside the log used
+        # by the generative model)
+        grad += tf.tensordot(
+            (self.input / (rates + 1e-3) - 1.0) * drates, self.C,
+            axes=[[2], [1]])
+
+        # Fisher information of observations, C diag(w_t) C^T
+        weights = tf.square(drates) / (rates + 1e-3)
+        diag = tf.tensordot(
+            self.C * tf.expand_dims(weights, axis=2), self.C,
+            axes=[[3], [1]]) + self.prior_diag
+        ldiag = tf.tile(
+            tf.expand_dims(self.prior_ldiag, axis=0),
+            [tf.shape(z)[0], 1, 1, 1])
+
+        return grad, diag, ldiag
+
+    def _build_posterior_mode(self):
+
+        # candidate step sizes 1, 1/2, 1/4, ...
+        step_sizes = tf.constant(
+            0.5 ** np.arange(self.max_step_halvings + 1), dtype=self.dtype)
+        batch_size = tf.shape(self.input)[0]
+
+        def newton_step(i, z, log_joint, change, stalled):
+            grad, diag, ldiag = self._newton_terms(z)
+            chol = blk_tridiag_chol_batch(diag, ldiag)
+            delta = blk_chol_inv_batch(
+                chol[0], chol[1], grad, lower=True, transpose=False)
+            delta = blk_chol_inv_batch(
+                chol[0], chol[1], delta, lower=False, transpose=True)
+
+            # step halving; evaluate the log posterior at all candidate steps
+            # (num_steps x batch_size) and take the largest one that does not
+            # decrease it, or no step if all of them do
+            log_joints = self._log_joint(
+                z + step_sizes[:, None, None, None] * delta)
+            improves = tf.greater_equal(log_joints, log_joint)
+            accept = tf.reduce_any(improves, axis=0)
+            indxs = tf.stack([
+                tf.argmax(tf.cast(improves, tf.int32), axis=0,
+                          output_type=tf.int32),
+                tf.range(batch_size)], axis=1)
+            step = tf.where(
+                accept, tf.gather(step_sizes, indxs[:, 0]),
+                tf.zeros_like(log_joint))
+            delta *= step[:, None, None]
+            log_joint = tf.where(
+                accept, tf.gather_nd(log_joints, indxs), log_joint)
+
+            return [i + 1, z + delta, log_joint, tf.reduce_max(tf.abs(delta)),
+                    tf.logical_not(tf.reduce_any(accept))]
+
+        def not_converged(i, z, log_joint, change, stalled):
+            return tf.logical_and(
+                tf.logical_and(i < self.max_newton_iters,
+                               change > self.newton_tol),
+                tf.logical_not(stalled))
+
+        z_init = tf.zeros(
+            [batch_size, self.num_time_pts, self.dim_latent],
+            dtype=self.dtype)
+        self.num_newton_iters, z_mode, _, _, self.newton_stalled = \
+            tf.while_loop(
+                not_converged, newton_step,
+                [tf.constant(0), z_init, self._log_joint(z_init),
+                 tf.constant(np.inf, dtype=self.dtype), tf.constant(False)])
+
+        # the mode is treated as a constant when fitting the model parameters;
+        # its own gradient vanishes in the log joint at the mode, but the
+        # dependence of the posterior precision (and its log-determinant in
+        # the evidence) on the mode is ignored, so the evidence gradient is
+        # approximate
+        self.post_z_means = tf.stop_gradient(z_mode)
+
+    def _build_posterior_covariances(self):
+
+        # posterior precision at the mode
+        grad, diag, ldiag = self._newton_terms(self.post_z_means)
+        self.chol_decomp_Sinv = blk_tridiag_chol_batch(diag, ldiag)
+
+        # largest absolute gradient of the log posterior at the mode of each
+        # trial; should be close to zero
+        self.newton_grad_norm = tf.reduce_max(tf.abs(grad), axis=[1, 2])
+        tf.summary.scalar(
+            'newton_grad_norm', tf.reduce_max(self.newton_grad_norm))
+
+        # `False` for trials whose mode did not reach the gradient tolerance,
+        # whether the iterations stopped at `max_newton_iters` or stalled
+        self.newton_converged = tf.less_equal(
+            self.newton_grad_norm, self.newton_grad_tol)
+        tf.summary.scalar(
+            'newton_converged',
+            tf.reduce_mean(tf.cast(self.newton_converged, self.dtype)))
+
+        # marginal and lag-one covariances:
+        #   self.post_z_covs: B x T x D x D
+        #   self.post_z_covs_lag: B x (T-1) x D x D; cov(z_{t+1}, z_t)
+        self.post_z_covs, self.post_z_covs_lag = blk_chol_selective_inv_batch(
+            self.chol_decomp_Sinv[0], self.chol_decomp_Sinv[1])
+
+    def _build_posterior_samples(self):
+
+        self.samples_z = self._base_samples(
+            [tf.shape(self.input)[0],
+             self.num_time_pts, self.dim_latent, self.num_mc_samples],
+            mc_axis=3)
+
+        # batch_size x num_time_pts x dim_latent x num_mc_samples
+        rands = blk_chol_inv_multi_batch(
+            self.chol_decomp_Sinv[0], self.chol_decomp_Sinv[1],
+            self.samples_z, lower=False, transpose=True)
+        rands = tf.transpose(rands, perm=[0, 3, 1, 2])
+
+        self.post_z_samples = tf.expand_dims(self.post_z_means, axis=1) + rands
+
+    def _build_marginal_likelihood(self):
+
+        # log p(y) ~ log p(y | z*) + log p(z*) + DT/2 log(2 pi) - 1/2 ln|H|
+        log_joint = self._log_joint(self.post_z_means) - tf.reduce_sum(
+            tf.lgamma(1.0 + self.input), axis=[1, 2])
+
+        def ln_det(L):
+            return 2.0 * tf.reduce_sum(tf.log(tf.matrix_diag_part(L)))
+
+        # log-determinant of posterior precision for each trial
+        self.ln_det_Sinv = 2.0 * tf.reduce_sum(
+            tf.log(tf.matrix_diag_part(self.chol_decomp_Sinv[0])),
+            axis=[1, 2])
+
+        # 2 pi terms of prior and Laplace integral cancel
+        self.log_marginal_likelihood = log_joint - 0.5 * (
+            ln_det(self.Q0_chol)
+            + (self.num_time_pts - 1) * ln_det(self.Q_chol) + self.ln_det_Sinv)
+
+    def evidence(self):
+        """Laplace approximation of log marginal likelihood, averaged over
+        minibatch samples"""
+        return tf.reduce_mean(self.log_marginal_likelihood)
+
+    def entropy(self):
+        """Entropy of Laplace approximation"""
+        # mean over batch dimension
+        ln_det = -tf.reduce_mean(self.ln_det_Sinv)
+        return self._entropy_from_ln_det(ln_det)
+
+    def sample(self, sess, observations, seed=None):
+        """
+        Draw samples from Laplace approximation
+
+        Args:
+            sess (tf.Session object)
+            observations (batch_size x num_time_pts x num_inputs numpy array)
+            seed (int, optional)
+
+        Returns:
+            batch_size x num_mc_samples x num_time_pts x dim_latent numpy array
+
+        """
+
+        if seed is not None:
+            tf.set_random_seed(seed)
+
+        return sess.run(
+            self.post_z_samples,
+            feed_dict={self.input: observations})
+
+    def get_params(self, sess):
+        """Get parameters of generative model"""
+
+        A, z0_mean, Q_sqrt, Q, Q0_sqrt, Q0 = sess.run(
+            [self.A, self.z0_mean, self.Q_sqrt, self.Q, self.Q0_sqrt, self.Q0])
+
+        param_dict = {'A': A, 'z0_mean': z0_mean, 'Q': Q, 'Q0': Q0,
+                      'Q_sqrt': Q_sqrt, 'Q0_sqrt': Q0_sqrt}
+
+        return param_dict
+
+    def get_posterior_means(self, sess, input_data):
+        """Get posterior modes conditioned on observations"""
+
+        feed_dict = {self.input: input_data}
+
+        return sess.run(self.post_z_means, feed_dict=feed_dict)
+
+    def get_posterior_covariances(self, sess, input_data):
+        """
+        Get Laplace covariances and lag-one cross-covariances conditioned on
+        observations; see `SmoothingLDS.get_posterior_covariances`
+        """
+
+        feed_dict = {self.input: input_data}
+
+        return sess.run(
+            [self.post_z_covs, self.post_z_covs_lag], feed_dict=feed_dict)
@@ -335,7 +335,8 @@ class DynamicalModel(Model):
 
     def __init__(
             self, inf_network=None, inf_network_params=None, gen_model=None,
-            gen_model_params=None, np_seed=0, tf_seed=0):
+            gen_model_params=None, np_seed=0, tf_seed=0, elbo_type='mc',
+            mc_chunk_size=None):
         """
         Constructor for full Model; combines an inference network with a
         generative model and provides training functions
@@ -347,6 +348,26 @@ class DynamicalModel(Model):
             gen_model_params (dict)
             np_seed (int)
             tf_seed (int)
+            elbo_type (str): 'mc' | 'analytic'
+                'mc': expected log joint is estimated with samples from the
+                    approximate posterior
+                'analytic': expected log joint is computed in closed form from
+                    the posterior means and covariances; requires a
+                    generative model with linear readouts and either gaussian
+                    noise or poisson noise with an exponential link, and an
+                    inference network that provides posterior covariances
+                    (e.g. SmoothingLDS)
+            mc_chunk_size (int, optional): if not `None`, the likelihood of
+                the 'mc' elbo is evaluated over this many monte carlo samples
+                at a time in a graph loop, so that memory for the predicted
+                observations does not grow with the number of samples; sparse
+                observations are not used in this mode
+
+        Raises:
+            ValueError: if `elbo_type` is not a valid string
+            ValueError: if `elbo_type` is 'analytic' and the expected log
+                likelihood of the generative model has no closed form
+            ValueError: if `mc_chunk_size` is used with the 'analytic' elbo
 
         """
 
@@ -355,6 +376,23 @@ class DynamicalModel(Model):
             gen_model=gen_model, gen_model_params=gen_model_params,
             np_seed=np_seed, tf_seed=tf_seed)
 
+        if elbo_type not in ['mc', 'analytic']:
+            raise ValueError(
+                '"%s" is not a valid string for specifying the elbo type' %
+                elbo_type)
+        if elbo_type == 'analytic' \
+                and not self.gen_net.has_analytic_likelihood():
+            raise ValueError(
+                'analytic elbo requires linear readouts with gaussian noise '
+                'or poisson noise with an exponential link')
+        self.elbo_type = elbo_type
+        self.constructor_inputs['elbo_type'] = elbo_type
+        if mc_chunk_size is not None and elbo_type == 'analytic':
+            raise ValueError(
+                'mc_chunk_size is not available with the analytic elbo')
+        self.mc_chunk_size = mc_chunk_size
+        self.constructor_inputs['mc_chunk_size'] = mc_chunk_size
+
         # to clean up training functions
         self.dim_obs = self.gen_net.dim_obs
         self.dim_latent = self.gen_net.dim_latent
@@ -363,6 +401,10 @@ class DynamicalModel(Model):
 
         # observations
         self.y_true = []
+        # data-only terms of log likelihood
+        self.y_consts = None
+        # observations in sparse format (optional)
+        self.y_sparse = None
 
     def build_graph(self):
         """Build tensorflow computation graph for model"""
@@ -375,10 +417,34 @@ class DynamicalModel(Model):
         This function uses the log-joint/entropy formulation of the ELBO
         """
 
+        if self.inf_net.fit_evidence:
+            # posterior computed from model; maximize log marginal likelihood
+            # directly
+            with tf.variable_scope('evidence'):
+                self.evidence = self.inf_net.evidence()
+            self.objective = -self.evidence
+            tf.summary.scalar('evidence', self.evidence)
+            return
+
         # expected value of log joint distribution
         with tf.variable_scope('log_joint'):
-            self.log_joint = self.gen_net.log_density(
-                self.y_true, self.inf_net.post_z_samples)
+            if self.elbo_type == 'analytic':
+                if not hasattr(self.inf_net, 'post_z_covs'):
+                    raise ValueError(
+                        'analytic elbo requires an inference network that '
+                        'provides posterior covariances')
+                self.log_joint = self.gen_net.expected_log_density(
+                    self.y_true, self.inf_net.post_z_means,
+                    self.inf_net.post_z_covs, self.inf_net.post_z_covs_lag,
+                    y_consts=self.y_consts)
+            elif self.mc_chunk_size is not None:
+                self.log_joint = self.gen_net.log_density_chunked(
+                    self.y_true, self.inf_net.post_z_samples,
+                    self.mc_chunk_size, y_consts=self.y_consts)
+            else:
+                self.log_joint = self.gen_net.log_density(
+                    self.y_true, self.inf_net.post_z_samples,
+                    y_consts=self.y_consts, y_sparse=self.y_sparse)
 
         # entropy of approximate posterior
         with tf.variable_scope('entropy'):
@@ -463,6 +529,36 @@ class DynamicalModel(Model):
 
         return posterior_means
 
+    def get_posterior_covariances(self, input_data=None, checkpoint_file=None):
+        """
+        Get posterior marginal covariances and lag-one cross-covariances from
+        inference network
+
+        Args:
+            input_data (num_samples x num_time_pts x dim_obs tf.Tensor):
+                data on which to condition the posterior covariances
+            checkpoint_file (str, optional): location of checkpoint file
+                specifying model from which to generate samples; if `None`,
+                will then look for a checkpoint file created upon model
+                initialization
+
+        Returns:
+            posterior_covs (num_samples x num_time_pts x dim_latent x
+                dim_latent tf.Tensor): cov(z_t, z_t)
+            posterior_covs_lag (num_samples x num_time_pts-1 x dim_latent x
+                dim_latent tf.Tensor): cov(z_{t+1}, z_t)
+
+        """
+
+        self._check_graph()
+
+        with tf.Session(graph=self.graph, config=self.sess_config) as sess:
+            self.restore_model(sess, checkpoint_file=checkpoint_file)
+            posterior_covs, posterior_covs_lag = \
+                self.inf_net.get_posterior_covariances(sess, input_data)
+
+        return posterior_covs, posterior_covs_lag
+
     def get_cost(self, data=None, indxs=None, checkpoint_file=None):
         """
         User function for retrieving cost
@@ -503,30 +599,43 @@ class LDSModel(DynamicalModel):
 
     def __init__(
             self, inf_network=None, inf_network_params=None, gen_model=None,
-            gen_model_params=None, couple_params=True, np_seed=0, tf_seed=0):
+            gen_model_params=None, couple_params=True, np_seed=0, tf_seed=0,
+            elbo_type='mc', mc_chunk_size=None):
         """
         Constructor for full Model; see DynamicalModel for arg documentation
 
         Args:
             inf_network (InferenceNetwork class):
-                MeanFieldGaussian | MeanFieldGaussianTemporal | SmoothingLDS
+                MeanFieldGaussian | MeanFieldGaussianTemporal | SmoothingLDS |
+                KalmanSmoother | LaplaceLDS
             inf_network_params (dict): see constructors in inference.py
             gen_model (GenerativeModel class)
                 NetFLDS | NetLDS | FLDS | LDS
             gen_model_params (dict): see constructors in generative.py
             couple_params (bool): couple dynamical parameters of generative
                 model and approximate posterior; only used when
-                inf_network=SmoothingLDS and gen_model=*LDS
+                inf_network=SmoothingLDS and gen_model=*LDS; must be `True`
+                for inf_network=KalmanSmoother | LaplaceLDS
             np_seed (int): for training minibatches
             tf_seed (int): for initializing tf.Variables (sampling functions
                 have their own seed arguments)
+            elbo_type (str): 'mc' | 'analytic'
+            mc_chunk_size (int, optional)
+
+        Raises:
+            ValueError: if an inference network that is fit by the evidence
+                (e.g. KalmanSmoother) is used with uncoupled parameters
 
         """
 
         super().__init__(
             inf_network=inf_network, inf_network_params=inf_network_params,
             gen_model=gen_model, gen_model_params=gen_model_params,
-            np_seed=np_seed, tf_seed=tf_seed)
+            np_seed=np_seed, tf_seed=tf_seed, elbo_type=elbo_type,
+            mc_chunk_size=mc_chunk_size)
+        if self.inf_net.fit_evidence and not couple_params:
+            raise ValueError(
+                '%s requires couple_params=True' % inf_network.__name__)
         self.couple_params = couple_params
 
         self.constructor_inputs['model_class'] = LDSModel
@@ -551,7 +660,7 @@ class LDSModel(DynamicalModel):
             # NOTE: requires that `dim_obs` input to generative model
             # constructor is in same order as the data
             with tf.variable_scope('data'):
-                y_true, inf_input, lin_preds = \
+                y_true, self.y_consts, self.y_sparse, inf_input, lin_preds = \
                     self.trainer._build_data_pipeline(
                         self.num_time_pts, self.dim_obs, self.dim_input,
                         self.gen_net.dim_predictors)
@@ -571,6 +680,16 @@ class LDSModel(DynamicalModel):
 
                 with tf.variable_scope('shared_vars'):
                     param_dict = self.gen_net.initialize_prior_vars()
+                    if self.inf_net.requires_prior_precisions:
+                        param_dict.update(
+                            self.gen_net.initialize_prior_precisions(
+                                param_dict))
+
+                if self.inf_net.fit_evidence:
+                    # posterior also requires the observation model
+                    with tf.variable_scope('generative_model'):
+                        param_dict.update(
+                            self.gen_net.initialize_readout_vars())
 
                 with tf.variable_scope('inference_network'):
                     self.inf_net.build_graph(inf_input, param_dict)
@@ -584,6 +703,10 @@ class LDSModel(DynamicalModel):
                 with tf.variable_scope('inference_network'):
                     with tf.variable_scope('model_params'):
                         param_dict = self.gen_net.initialize_prior_vars()
+                        if self.inf_net.requires_prior_precisions:
+                            param_dict.update(
+                                self.gen_net.initialize_prior_precisions(
+                                    param_dict))
                     self.inf_net.build_graph(param_dict)
 
                 with tf.variable_scope('generative_model'):
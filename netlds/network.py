@@ -92,6 +92,10 @@ class Network(object):
 
     def build_graph(self):
 
+        # layers may already have been built elsewhere
+        if self.layers:
+            return
+
         for _, layer_params in enumerate(self.params):
             self.layers.append(tf.layers.Dense(**layer_params))
 
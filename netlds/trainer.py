@@ -5,6 +5,8 @@ import tensorflow as tf
 import os
 import time
 import copy
+import math
+from concurrent.futures import ThreadPoolExecutor
 
 
 class Trainer(object):
@@ -34,6 +36,10 @@ class Trainer(object):
 
         # training info
         self.epochs_training = 100
+        self.epochs_mstep = None
+        self.epochs_irls = None
+        self.irls_iters = 5
+        self.sparse_obs = False
         self.batch_size = 1
         self.early_stop_mode = 0  # to get rid of
         self.early_stop = 0
@@ -47,13 +53,302 @@ class Trainer(object):
         self.summaries_dir = None
         self.writers = {'train': None, 'test': None, 'validation': None}
         self.run_diagnostics = False
+        self.grad_var_reps = None
 
     def _build_optimizer(self, model):
         """Define one step of the optimization routine"""
 
-        model.train_step = \
-            self.optimizer(**self.opt_params[self.learning_alg]).minimize(
-                model.objective)
+        var_list = tf.trainable_variables()
+
+        # variables with closed-form or second-order updates are not touched
+        # by the gradient optimizer
+        fixed_vars = []
+        if self.epochs_mstep is not None:
+            with tf.variable_scope('mstep'):
+                self._build_mstep(model)
+            fixed_vars += list(self.mstep_vars.values())
+        if self.epochs_irls is not None:
+            with tf.variable_scope('irls'):
+                self._build_irls(model)
+            fixed_vars += list(self.irls_vars.values())
+        fixed_var_names = [var.name for var in fixed_vars]
+        var_list = [var for var in var_list if var.name not in fixed_var_names]
+
+        # gradients evaluated separately for monitoring their variance
+        if self.grad_var_reps is not None:
+            self.grad_ops = [
+                tf.convert_to_tensor(grad) for grad in tf.gradients(
+                    model.objective, var_list) if grad is not None]
+
+        if var_list:
+            model.train_step = \
+                self.optimizer(**self.opt_params[self.learning_alg]).minimize(
+                    model.objective, var_list=var_list)
+        else:
+            model.train_step = tf.no_op()
+
+    def _build_mstep(self, model):
+        """
+        Define placeholders and assign ops for closed-form (EM) updates of the
+        linear-Gaussian parameters of the generative model
+
+        Raises:
+            ValueError: if inference network does not provide posterior
+                covariances
+            ValueError: if the generative model uses a low-rank innovation
+                covariance or block-structured dynamics
+
+        """
+
+        if not hasattr(model.inf_net, 'post_z_covs'):
+            raise ValueError(
+                'M-step requires an inference network that provides '
+                'posterior covariances (SmoothingLDS | KalmanSmoother)')
+        if model.gen_net.innovation_rank is not None \
+                or model.gen_net.block_dynamics:
+            raise ValueError(
+                'M-step requires dense dynamics and innovation covariance '
+                'parameters')
+
+        gen_net = model.gen_net
+
+        # dynamics variables
+        self.mstep_vars = {
+            'z0_mean': gen_net.z0_mean,
+            'A': gen_net.A,
+            'Q_sqrt': gen_net.Q_sqrt,
+            'Q0_sqrt': gen_net.Q0_sqrt}
+
+        # observation model variables
+        if gen_net.is_linear_gaussian():
+            for pop, _ in enumerate(gen_net.dim_obs):
+                layer = gen_net.networks[pop].layers[0]
+                self.mstep_vars['C_%02i' % pop] = layer.kernel
+                self.mstep_vars['d_%02i' % pop] = layer.bias
+                self.mstep_vars['R_sqrt_%02i' % pop] = gen_net.R_sqrt[pop]
+
+        self.mstep_phs, model.mstep_step = self._build_assign_ops(
+            self.mstep_vars)
+
+    def _build_irls(self, model):
+        """
+        Define placeholders and assign ops for refitting the readouts of
+        Poisson populations with iteratively reweighted least squares
+
+        Raises:
+            ValueError: if inference network does not provide posterior
+                covariances
+            ValueError: if generative model does not have Poisson populations
+                with linear readouts
+
+        """
+
+        if not hasattr(model.inf_net, 'post_z_covs'):
+            raise ValueError(
+                'IRLS refits require an inference network that provides '
+                'posterior covariances (SmoothingLDS | KalmanSmoother)')
+
+        gen_net = model.gen_net
+        if gen_net.noise_dist != 'poisson' or not gen_net.has_linear_readout():
+            raise ValueError(
+                'IRLS refits require Poisson populations with linear '
+                'readouts and no linear predictors')
+
+        self.irls_vars = {}
+        for pop, _ in enumerate(gen_net.dim_obs):
+            layer = gen_net.networks[pop].layers[0]
+            self.irls_vars['C_%02i' % pop] = layer.kernel
+            self.irls_vars['d_%02i' % pop] = layer.bias
+
+        self.irls_phs, model.irls_step = self._build_assign_ops(
+            self.irls_vars)
+
+    def _build_assign_ops(self, var_dict):
+        """Placeholders and a single grouped op for assigning variables"""
+
+        phs = {}
+        assign_ops = []
+        for name, var in var_dict.items():
+            phs[name] = tf.placeholder(
+                dtype=self.dtype, shape=var.shape, name=name + '_ph')
+            assign_ops.append(tf.assign(var, phs[name]))
+
+        return phs, tf.group(*assign_ops)
+
+    def _train_mstep(self, sess, model, data, indxs):
+        """
+        Accumulate posterior sufficient statistics over the data indexed by
+        `indxs` and assign closed-form updates to the generative parameters
+        """
+
+        gen_net = model.gen_net
+        dim_latent = sum(gen_net.dim_latent)
+        num_time_pts = gen_net.num_time_pts
+        linear_gaussian = gen_net.is_linear_gaussian()
+
+        # posterior sufficient statistics
+        z0_sum = np.zeros(dim_latent)
+        z0z0_sum = np.zeros((dim_latent, dim_latent))
+        S00 = np.zeros((dim_latent, dim_latent))  # sum E[z_t z_t^T], t < T
+        S11 = np.zeros((dim_latent, dim_latent))  # sum E[z_t z_t^T], t > 0
+        S10 = np.zeros((dim_latent, dim_latent))  # sum E[z_t z_{t-1}^T]
+        if linear_gaussian:
+            dim_obs = sum(gen_net.dim_obs)
+            Szz = np.zeros((dim_latent, dim_latent))
+            Sz = np.zeros(dim_latent)
+            Syz = np.zeros((dim_obs, dim_latent))
+            Sy = np.zeros(dim_obs)
+            Syy = np.zeros(dim_obs)
+
+        num_batches = int(np.ceil(len(indxs) / self.batch_size))
+        for batch in range(num_batches):
+            batch_indxs = indxs[
+                batch * self.batch_size: (batch + 1) * self.batch_size]
+            feed_dict = self._get_feed_dict(data=data, batch_indxs=batch_indxs)
+            means, covs, covs_lag = sess.run(
+                [model.inf_net.post_z_means, model.inf_net.post_z_covs,
+                 model.inf_net.post_z_covs_lag], feed_dict=feed_dict)
+            Ezz = covs + np.einsum('bti,btj->btij', means, means)
+            Ezz_lag = covs_lag + np.einsum(
+                'bti,btj->btij', means[:, 1:], means[:, :-1])
+            z0_sum += np.sum(means[:, 0], axis=0)
+            z0z0_sum += np.sum(Ezz[:, 0], axis=0)
+            S00 += np.sum(Ezz[:, :-1], axis=(0, 1))
+            S11 += np.sum(Ezz[:, 1:], axis=(0, 1))
+            S10 += np.sum(Ezz_lag, axis=(0, 1))
+            if linear_gaussian:
+                y = data['observations'][batch_indxs]
+                Szz += np.sum(Ezz, axis=(0, 1))
+                Sz += np.sum(means, axis=(0, 1))
+                Syz += np.einsum('bti,btj->ij', y, means)
+                Sy += np.sum(y, axis=(0, 1))
+                Syy += np.sum(np.square(y), axis=(0, 1))
+
+        def cov_sqrt(cov):
+            # the model adds a floor of 1e-6 * I to the squared variable;
+            # remove it and clip the eigenvalues to keep the result positive
+            # definite
+            evals, evecs = np.linalg.eigh(
+                0.5 * (cov + cov.T) - 1e-6 * np.eye(dim_latent))
+            evals = np.maximum(evals, 1e-10 * max(np.max(evals), 1.0))
+            return np.linalg.cholesky(np.dot(evecs * evals, evecs.T))
+
+        num_trials = len(indxs)
+        updates = {}
+
+        # initial state
+        z0_mean = z0_sum / num_trials
+        Q0 = z0z0_sum / num_trials - np.outer(z0_mean, z0_mean)
+        updates['z0_mean'] = z0_mean[None, :]
+        updates['Q0_sqrt'] = cov_sqrt(Q0)
+
+        # dynamics; z_t = A z_{t-1}
+        A = np.linalg.solve(S00, S10.T).T
+        Q = (S11 - np.dot(A, S10.T)) / (num_trials * (num_time_pts - 1))
+        updates['A'] = A
+        updates['Q_sqrt'] = cov_sqrt(Q)
+
+        # observation model; y_t = z_t C + d for each population
+        if linear_gaussian:
+            num_obs = num_trials * num_time_pts
+            indx_z = 0
+            indx_y = 0
+            for pop, pop_dim_latent in enumerate(gen_net.dim_latent):
+                lat = slice(indx_z, indx_z + pop_dim_latent)
+                obs = slice(indx_y, indx_y + gen_net.dim_obs[pop])
+                # regress observations on [z, 1]
+                Sxx = np.block([
+                    [Szz[lat, lat], Sz[lat, None]],
+                    [Sz[None, lat], np.array([[num_obs]])]])
+                Syx = np.concatenate([Syz[obs, lat], Sy[obs, None]], axis=1)
+                W = np.linalg.solve(Sxx, Syx.T).T
+                R = (Syy[obs] - np.sum(W * Syx, axis=1)) / num_obs
+                updates['C_%02i' % pop] = W[:, :-1].T
+                updates['d_%02i' % pop] = W[:, -1]
+                # the model adds a floor of 1e-6 to the squared variable
+                updates['R_sqrt_%02i' % pop] = np.sqrt(
+                    np.maximum(R - 1e-6, 0.0))[None, :]
+                indx_z += pop_dim_latent
+                indx_y += gen_net.dim_obs[pop]
+
+        feed_dict = {
+            self.mstep_phs[name]: value for name, value in updates.items()}
+        sess.run(model.mstep_step, feed_dict=feed_dict)
+
+    def _train_irls(self, sess, model, data, indxs):
+        """
+        Refit the readout weights and biases of each Poisson population by
+        Fisher scoring (IRLS) on the expected log-likelihood under the
+        posterior over the data indexed by `indxs`; the expectation is
+        approximated with sigma points built from the posterior means and
+        covariances of each population's latent states. The expected
+        log-likelihood of each population before and after the refit is
+        stored in the `irls_log_likes` attribute (and printed if
+        `epochs_display` is not `None`); a refit that does not improve it is
+        rejected
+        """
+
+        gen_net = model.gen_net
+
+        # posterior means and covariances over all data
+        means = []
+        covs = []
+        num_batches = int(np.ceil(len(indxs) / self.batch_size))
+        for batch in range(num_batches):
+            batch_indxs = indxs[
+                batch * self.batch_size: (batch + 1) * self.batch_size]
+            feed_dict = self._get_feed_dict(data=data, batch_indxs=batch_indxs)
+            means_, covs_ = sess.run(
+                [model.inf_net.post_z_means, model.inf_net.post_z_covs],
+                feed_dict=feed_dict)
+            means.append(means_)
+            covs.append(covs_)
+        means = np.concatenate(means, axis=0).astype(np.float64)
+        covs = np.concatenate(covs, axis=0).astype(np.float64)
+        observations = data['observations'][indxs].astype(np.float64)
+
+        weights_init = sess.run(
+            [[self.irls_vars['C_%02i' % pop], self.irls_vars['d_%02i' % pop]]
+             for pop, _ in enumerate(gen_net.dim_obs)])
+
+        # offsets of each population in latent and observation spaces
+        indxs_z = np.cumsum([0] + list(gen_net.dim_latent))
+        indxs_y = np.cumsum([0] + list(gen_net.dim_obs))
+
+        def refit(pop):
+            lat = slice(indxs_z[pop], indxs_z[pop + 1])
+            obs = slice(indxs_y[pop], indxs_y[pop + 1])
+            weights = np.concatenate(
+                [weights_init[pop][0], weights_init[pop][1][None, :]],
+                axis=0).astype(np.float64)
+            return weights, self._irls_poisson(
+                means[:, :, lat], covs[:, :, lat, lat],
+                observations[:, :, obs], weights, self.irls_iters,
+                link=gen_net.poisson_link)
+
+        # populations are independent given the latent states
+        with ThreadPoolExecutor() as executor:
+            results = list(executor.map(refit, range(len(gen_net.dim_obs))))
+
+        feed_dict = {}
+        log_likes = []
+        for pop, (weights_init_, (weights_, ll_init, ll)) in \
+                enumerate(results):
+            # sum over neurons; keep the current weights if the refit does
+            # not improve the expected log-likelihood
+            ll_init = np.sum(ll_init)
+            ll = np.sum(ll)
+            if not ll >= ll_init:
+                weights_ = weights_init_
+                ll = ll_init
+            log_likes.append([ll_init, ll])
+            if self.epochs_display is not None:
+                print('    irls population %02i: expected log-likelihood '
+                      '%10.4f -> %10.4f' % (pop, ll_init, ll))
+            feed_dict[self.irls_phs['C_%02i' % pop]] = weights_[:-1]
+            feed_dict[self.irls_phs['d_%02i' % pop]] = weights_[-1]
+        self.irls_log_likes.append(log_likes)
+        sess.run(model.irls_step, feed_dict=feed_dict)
 
     def _build_data_pipeline(
             self, num_time_pts, dim_obs, dim_input, dim_predictors):
@@ -64,6 +359,39 @@ class Trainer(object):
                 dtype=self.dtype,
                 shape=[None, num_time_pts, sum(dim_obs)],
                 name='output_ph')
+        with tf.variable_scope('observations_consts'):
+            # data-only terms of the log likelihood for each trial and
+            # population (sum of log(y!)); fed from values precomputed once per
+            # dataset during training, otherwise computed from observations
+            log_factorials = []
+            indx_start = 0
+            for pop_dim in dim_obs:
+                indx_end = indx_start + pop_dim
+                log_factorials.append(tf.reduce_sum(tf.lgamma(
+                    1.0 + self.y_true_ph[:, :, indx_start:indx_end]),
+                    axis=[1, 2]))
+                indx_start = indx_end
+            self.y_consts_ph = tf.placeholder_with_default(
+                tf.stack(log_factorials, axis=1),
+                shape=[None, len(dim_obs)],
+                name='y_consts_ph')
+        if self.sparse_obs:
+            # same observations as `y_true_ph`, split into populations
+            # (batch_size x num_time_pts x pop_dim sparse tensors)
+            with tf.variable_scope('observations_sparse'):
+                self.y_sparse_phs = []
+                self.y_sparse_indxs = []
+                indx_start = 0
+                for pop, pop_dim in enumerate(dim_obs):
+                    indx_end = indx_start + pop_dim
+                    self.y_sparse_phs.append(tf.sparse_placeholder(
+                        dtype=self.dtype,
+                        shape=[None, num_time_pts, pop_dim],
+                        name='output_sparse_ph_%02i' % pop))
+                    self.y_sparse_indxs.append((indx_start, indx_end))
+                    indx_start = indx_end
+        else:
+            self.y_sparse_phs = None
         with tf.variable_scope('inference_input'):
             self.input_ph = tf.placeholder(
                 dtype=self.dtype,
@@ -82,7 +410,42 @@ class Trainer(object):
             else:
                 self.linear_predictors_phs = None
 
-        return self.y_true_ph, self.input_ph, self.linear_predictors_phs
+        return self.y_true_ph, self.y_consts_ph, self.y_sparse_phs, \
+            self.input_ph, self.linear_predictors_phs
+
+    @staticmethod
+    def _log_factorials(observations, dim_obs):
+        """
+        Sum of log(y!) over time and observation dimensions for each trial and
+        population
+
+        Args:
+            observations (num_reps x num_time_pts x sum(dim_obs) numpy array)
+            dim_obs (list of ints)
+
+        Returns:
+            num_reps x len(dim_obs) numpy array
+
+        """
+
+        counts = np.rint(observations)
+        if np.all(counts == observations) and np.all(counts >= 0):
+            # lookup table of log(k!) for integer counts
+            table = np.concatenate(
+                [[0.0], np.cumsum(np.log(np.arange(1, counts.max() + 1)))])
+            log_factorials = table[counts.astype(np.int64)]
+        else:
+            log_factorials = np.vectorize(math.lgamma)(1.0 + observations)
+
+        consts = []
+        indx_start = 0
+        for pop_dim in dim_obs:
+            indx_end = indx_start + pop_dim
+            consts.append(np.sum(
+                log_factorials[:, :, indx_start:indx_end], axis=(1, 2)))
+            indx_start = indx_end
+
+        return np.stack(consts, axis=1)
 
     def train(
             self, model=None, data=None, indxs=None, opt_params=None,
@@ -99,6 +462,10 @@ class Trainer(object):
                     observations as input, leave as `None`.
                 'linear_predictors' (list): each entry is a
                     num_reps x num_time_pts x dim_lin_pred numpy array
+                'y_consts' (num_reps x num_pops numpy array, optional):
+                    data-only terms of the log likelihood (sum of log(y!)) for
+                    poisson observations; computed once from observations if
+                    not present
             indxs (dict, optional): numpy arrays of indices
                 'train', 'test', 'validation'; 'test' indices are used for
                 early stopping if enabled
@@ -123,6 +490,10 @@ class Trainer(object):
             ValueError: If `epochs_summary` is not `None` and `output_dir` is
                 `None`
             ValueError: If `early_stop` > 0 and `test_indxs` is 'None'
+            ValueError: If `epochs_mstep` is not `None` and the graph was
+                built without the M-step ops
+            ValueError: If `epochs_irls` is not `None` and the graph was
+                built without the IRLS ops
 
         """
 
@@ -146,6 +517,10 @@ class Trainer(object):
             data['inf_input'] = data['observations']
         if 'linear_predictors' not in data:
             data['linear_predictors'] = []
+        if model.gen_net.noise_dist == 'poisson' and 'y_consts' not in data:
+            # computed once per dataset rather than on every training step
+            data['y_consts'] = self._log_factorials(
+                data['observations'], model.dim_obs)
 
         # Check values entered
         if self.epochs_ckpt is not None and output_dir is None:
@@ -168,6 +543,18 @@ class Trainer(object):
         if model.graph is None:
             model.build_graph()
 
+        # closed-form update ops are only added when the graph is built
+        if self.epochs_mstep is not None and (
+                getattr(model, 'mstep_step', None) is None
+                or model.mstep_step.graph is not model.graph):
+            raise ValueError(
+                'epochs_mstep must be set before the graph is built')
+        if self.epochs_irls is not None and (
+                getattr(model, 'irls_step', None) is None
+                or model.irls_step.graph is not model.graph):
+            raise ValueError(
+                'epochs_irls must be set before the graph is built')
+
         # intialize session
         with tf.Session(graph=model.graph, config=model.sess_config) as sess:
 
@@ -255,6 +642,8 @@ class Trainer(object):
         # store costs throughout training
         costs_train = []
         costs_test = []
+        self.grad_vars = []
+        self.irls_log_likes = []
 
         num_batches = indxs['train'].shape[0] // self.batch_size
 
@@ -282,6 +671,16 @@ class Trainer(object):
                     data=data, batch_indxs=batch_indxs)
 
                 sess.run(model.train_step, feed_dict=feed_dict)
+
+            # closed-form updates of linear-Gaussian parameters
+            if self.epochs_mstep is not None and (
+                    epoch % self.epochs_mstep == self.epochs_mstep - 1):
+                self._train_mstep(sess, model, data, indxs['train'])
+
+            # second-order refits of Poisson readouts
+            if self.epochs_irls is not None and (
+                    epoch % self.epochs_irls == self.epochs_irls - 1):
+                self._train_irls(sess, model, data, indxs['train'])
             epoch_time = time.time() - start
 
             # print training updates
@@ -292,6 +691,13 @@ class Trainer(object):
                     sess, model, data, indxs, epoch_time)
                 costs_train.append(cost_train)
                 costs_test.append(cost_test)
+                if self.grad_var_reps is not None:
+                    grad_var = self._get_gradient_variance(
+                        sess, model, data,
+                        train_indxs_perm[:self.batch_size])
+                    self.grad_vars.append(grad_var)
+                    print('    gradient variance (snapshot) = %10.4e'
+                          % grad_var)
 
             # save model checkpoints
             if self.epochs_ckpt is not None and (
@@ -337,8 +743,49 @@ class Trainer(object):
               'avg test cost = %10.4f' %
               (self.epoch, epoch_time, cost_train, cost_test))
 
+        # flag posterior modes that did not converge (LaplaceLDS)
+        if hasattr(model.inf_net, 'newton_converged'):
+            feed_dict = self._get_feed_dict(
+                data=data, batch_indxs=indxs['train'][:self.batch_size])
+            converged, grad_norm, stalled = sess.run(
+                [model.inf_net.newton_converged,
+                 model.inf_net.newton_grad_norm,
+                 model.inf_net.newton_stalled], feed_dict=feed_dict)
+            if not np.all(converged):
+                print('    newton iterations did not converge for %i of %i '
+                      'trials%s (max gradient norm = %10.4e)' %
+                      (np.sum(~converged), len(converged),
+                       ' (stalled)' if stalled else '',
+                       np.max(grad_norm[~converged])))
+
         return cost_train, cost_test
 
+    def _get_gradient_variance(self, sess, model, data, batch_indxs):
+        """
+        Estimate the variance of the stochastic gradient of the objective
+        due to posterior sampling, by repeatedly evaluating the gradient on
+        a single batch
+
+        This is a snapshot diagnostic at the current parameter values; it
+        excludes the variance due to minibatch selection and is not averaged
+        over the optimization steps taken between console updates.
+
+        Returns:
+            float: sum over all trainable parameters of the elementwise
+                gradient variances
+
+        """
+
+        feed_dict = self._get_feed_dict(data=data, batch_indxs=batch_indxs)
+
+        grads = []
+        for _ in range(self.grad_var_reps):
+            grads.append(np.concatenate(
+                [np.ravel(grad) for grad in
+                 sess.run(self.grad_ops, feed_dict=feed_dict)]))
+
+        return np.sum(np.var(np.stack(grads, axis=0), axis=0, ddof=1))
+
     def _train_save_summaries(
             self, sess, model, data, indxs, run_options, run_metadata):
 
@@ -452,6 +899,95 @@ class Trainer(object):
 
         return cost / len(indxs)
 
+    @staticmethod
+    def _irls_poisson(
+            means, covs, y, weights, num_iters, eps=1e-3, link='softplus'):
+        """
+        Fisher scoring for the readout of a single Poisson population,
+        y ~ Poisson(f(z C + d)); each neuron is an independent GLM, so the
+        updates are vectorized over neurons
+
+        Args:
+            means (num_trials x num_time_pts x dim_latent numpy array):
+                posterior means of the population's latent states
+            covs (num_trials x num_time_pts x dim_latent x dim_latent numpy
+                array): posterior covariances of the population's latent
+                states
+            y (num_trials x num_time_pts x dim_obs numpy array): observations
+            weights (dim_latent + 1 x dim_obs numpy array): initial weights,
+                with the bias in the last row
+            num_iters (int): number of Fisher scoring iterations
+            eps (float): constant added to rates inside the log, as in the
+                generative model's log density; only for the softplus link
+            link (str): 'softplus' | 'exponential'; nonlinearity f. The
+                exponential link is canonical, so Fisher scoring is Newton's
+                method, with IRLS weights `rate` and working response
+                `eta + (y - rate) / rate`
+
+        Returns:
+            dim_latent + 1 x dim_obs numpy array: refit weights
+            dim_obs numpy array: expected log-likelihood of each neuron with
+                the initial weights
+            dim_obs numpy array: expected log-likelihood of each neuron with
+                the refit weights
+
+        """
+
+        dim_latent = means.shape[-1]
+        dim_obs = y.shape[-1]
+
+        # sigma points m +/- sqrt(n) L_i, each with weight 1 / 2n, integrate
+        # the log-likelihood against the posterior
+        chol = np.linalg.cholesky(covs) * np.sqrt(dim_latent)
+        deltas = np.concatenate(
+            [np.swapaxes(chol, -1, -2), -np.swapaxes(chol, -1, -2)], axis=-2)
+        X = (means[:, :, None, :] + deltas).reshape(-1, dim_latent)
+        X = np.concatenate([X, np.ones((X.shape[0], 1))], axis=1)
+        Y = np.repeat(
+            y.reshape(-1, 1, dim_obs), 2 * dim_latent, axis=1)
+        Y = Y.reshape(-1, dim_obs)
+
+        def log_like(weights):
+            eta = np.dot(X, weights)
+            if link == 'exponential':
+                return np.mean(Y * eta - np.exp(eta), axis=0)
+            rates = np.logaddexp(0.0, eta)
+            return np.mean(Y * np.log(rates + eps) - rates, axis=0)
+
+        ll_init = ll = log_like(weights)
+        for _ in range(num_iters):
+            eta = np.dot(X, weights)
+            # score and Fisher information for each neuron, from the
+            # residuals and weights of the working least squares problem
+            if link == 'exponential':
+                rates = np.exp(eta)
+                residuals = Y - rates
+                irls_weights = rates
+            else:
+                rates = np.logaddexp(0.0, eta)
+                drates = 1.0 / (1.0 + np.exp(-eta))
+                residuals = (Y / (rates + eps) - 1.0) * drates
+                irls_weights = np.square(drates) / (rates + eps)
+            grad = np.dot(X.T, residuals) / X.shape[0]
+            info = np.einsum('mk,mp,ml->pkl', X, irls_weights, X) \
+                / X.shape[0] + 1e-8 * np.eye(dim_latent + 1)
+            step = np.linalg.solve(info, grad.T[:, :, None])[:, :, 0].T
+            # backtrack neurons whose log-likelihood does not improve
+            # (including steps that overflow)
+            step_size = np.ones(dim_obs)
+            for _ in range(10):
+                weights_new = weights + step_size * step
+                with np.errstate(over='ignore', invalid='ignore'):
+                    ll_new = log_like(weights_new)
+                worse = ~(ll_new >= ll)
+                if not np.any(worse):
+                    break
+                step_size[worse] /= 2.0
+            weights = np.where(worse, weights, weights_new)
+            ll = np.where(worse, ll, ll_new)
+
+        return weights, ll_init, ll
+
     def _get_feed_dict(self, data=None, batch_indxs=None):
         """Generates feed dict for training and other evaluation functions"""
 
@@ -462,15 +998,34 @@ class Trainer(object):
             for indx_, data_ in enumerate(data['linear_predictors']):
                 feed_dict[self.linear_predictors_phs[indx_]] = \
                     data_[batch_indxs, :, :]
+            if 'y_consts' in data:
+                feed_dict[self.y_consts_ph] = data['y_consts'][batch_indxs]
+            if self.sparse_obs:
+                self._add_sparse_obs(
+                    feed_dict, data['observations'][batch_indxs, :, :])
         else:
             feed_dict = {
                 self.y_true_ph: data['observations'],
                 self.input_ph: data['input_data']}
             for indx_, data_ in enumerate(data['linear_predictors']):
                 feed_dict[self.linear_predictors_phs[indx_]] = data_
+            if 'y_consts' in data:
+                feed_dict[self.y_consts_ph] = data['y_consts']
+            if self.sparse_obs:
+                self._add_sparse_obs(feed_dict, data['observations'])
 
         return feed_dict
 
+    def _add_sparse_obs(self, feed_dict, observations):
+        """Add non-zero observations of each population to feed dict"""
+
+        for pop, (indx_start, indx_end) in enumerate(self.y_sparse_indxs):
+            obs = observations[:, :, indx_start:indx_end]
+            indices = np.stack(np.nonzero(obs), axis=1)
+            feed_dict[self.y_sparse_phs[pop]] = tf.SparseTensorValue(
+                indices=indices, values=obs[tuple(indices.T)],
+                dense_shape=obs.shape)
+
     @classmethod
     def _set_optimizer_defaults(cls, learning_alg):
 
@@ -502,6 +1057,30 @@ class Trainer(object):
             batch_size (int): number of data points to use for each iteration
                 of training.
             epochs_training (int): max number of epochs.
+            epochs_mstep (int, optional): number of epochs between closed-form
+                (EM) updates of the linear-Gaussian generative parameters
+                (A, Q, z0_mean, Q0 and, for linear-Gaussian observation
+                models, C, d, R) from posterior sufficient statistics
+                accumulated over the training data; these parameters are then
+                excluded from the gradient updates. Requires an inference
+                network that provides posterior covariances. Must be set
+                before the graph is built.
+            epochs_irls (int, optional): number of epochs between refits of
+                the readout weights and biases of Poisson populations by
+                iteratively reweighted least squares, run in parallel over
+                populations (softplus or exponential links); these parameters
+                are then excluded from the gradient updates. The expected
+                log-likelihood of each population before and after each refit
+                is stored in the `irls_log_likes` attribute (and printed if
+                `epochs_display` is not `None`), and refits that do not
+                improve it are rejected. Requires an inference network that
+                provides posterior covariances. Must be set before the graph
+                is built.
+            irls_iters (int): number of Fisher scoring iterations per refit
+            sparse_obs (bool): `True` to also feed the observations of each
+                population in sparse coordinate format, so that the
+                y * log(rate) term of a poisson likelihood is only evaluated
+                at non-zero counts; must be set before the graph is built
             epochs_display (int, optional): defines the number of epochs
                 between updates to the console.
             epochs_ckpt (int): number of epochs between saving checkpoint
@@ -522,6 +1101,17 @@ class Trainer(object):
             run_diagnostics (bool): `True` to record compute time and memory
                 usage of tensorflow ops during training and testing.
                 `epochs_summary` must not be `None`.
+            grad_var_reps (int, optional): if not `None`, the gradient of the
+                objective is evaluated this many times on a single training
+                batch at each console update, and the summed variance of its
+                elements is printed and stored in the `grad_vars` attribute.
+                This is a snapshot at the parameters of each console update
+                (from one batch, without minibatch noise), not the variance
+                of the estimator over training; useful for comparing
+                posterior sampling schemes (see the `sample_type` option of
+                the inference networks). Must be set
+                before the graph is built, and `epochs_display` must not be
+                `None`.
             adam (dict): dictionary of parameters for adam optimizer; see tf
                 documentation for details
                 'learning_rate' (float)
@@ -0,0 +1,255 @@
+"""
+Timing, memory and accuracy benchmarks for the block-tridiagonal routines in
+`netlds.chol_utils`
+
+Each configuration in the grid of time points (T), block size (n), batch size
+and number of right-hand sides builds a random symmetric positive definite
+block-tridiagonal matrix, and then times the Cholesky decomposition, the
+vector solves (`blk_chol_inv_batch`) and the multiple right-hand side solves
+(`blk_chol_inv_multi_batch`). Errors are measured against a dense NumPy
+reference and all results are written to a JSON file.
+
+Example:
+    python tests/benchmark_chol_utils.py --T 50 200 --n 2 10 --batch 1 16 \
+        --solver sequential parallel --output chol_benchmark.json
+"""
+
+import argparse
+import itertools
+import json
+import resource
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from netlds.chol_utils import blk_tridiag_chol_batch, blk_chol_inv_batch, \
+    blk_chol_inv_multi_batch, blk_tridiag_chol_parallel, \
+    blk_chol_inv_parallel, blk_chol_inv_multi_parallel
+
+
+def build_problem(num_time_pts, dim, batch_size, num_rhs, seed=0):
+    """
+    Build a batch of random symmetric positive definite block-tridiagonal
+    matrices and right-hand sides
+
+    Returns:
+        D (batch_size x T x n x n numpy array): diagonal blocks
+        B (batch_size x T-1 x n x n numpy array): lower off-diagonal blocks
+        y (batch_size x T x n x num_rhs numpy array): right-hand sides
+
+    """
+
+    rng = np.random.RandomState(seed)
+    X = rng.randn(batch_size, num_time_pts, dim, dim)
+    D = np.matmul(X, np.transpose(X, (0, 1, 3, 2))) \
+        + 3.0 * dim * np.eye(dim)
+    B = 0.5 * rng.randn(batch_size, num_time_pts - 1, dim, dim)
+    y = rng.randn(batch_size, num_time_pts, dim, num_rhs)
+
+    return D, B, y
+
+
+def dense_from_blocks(D, B, lower_only=False):
+    """Assemble the dense (T * n) x (T * n) matrix from its blocks"""
+
+    num_time_pts, dim = D.shape[0], D.shape[1]
+    M = np.zeros((num_time_pts * dim, num_time_pts * dim))
+    for t in range(num_time_pts):
+        M[t * dim:(t + 1) * dim, t * dim:(t + 1) * dim] = D[t]
+    for t in range(num_time_pts - 1):
+        M[(t + 1) * dim:(t + 2) * dim, t * dim:(t + 1) * dim] = B[t]
+        if not lower_only:
+            M[t * dim:(t + 1) * dim, (t + 1) * dim:(t + 2) * dim] = B[t].T
+
+    return M
+
+
+def build_graph(num_time_pts, dim, batch_size, num_rhs, solver='sequential',
+                dtype=tf.float64):
+    """
+    Build placeholders and the ops to benchmark; shapes are fully specified
+    since the parallel solvers require a static number of time points
+
+    Returns:
+        dict: placeholders (keys 'D', 'B', 'y') and ops (keys 'chol', 'inv',
+            'inv_multi')
+
+    """
+
+    D = tf.placeholder(
+        dtype=dtype, shape=[batch_size, num_time_pts, dim, dim])
+    B = tf.placeholder(
+        dtype=dtype, shape=[batch_size, num_time_pts - 1, dim, dim])
+    y = tf.placeholder(
+        dtype=dtype, shape=[batch_size, num_time_pts, dim, num_rhs])
+
+    if solver == 'sequential':
+        chol = blk_tridiag_chol_batch(D, B)
+        # L L^T x = y for the first right-hand side
+        x = blk_chol_inv_batch(
+            chol[0], chol[1], y[..., 0], lower=True, transpose=False)
+        x = blk_chol_inv_batch(
+            chol[0], chol[1], x, lower=False, transpose=True)
+        x_multi = blk_chol_inv_multi_batch(
+            chol[0], chol[1], y, lower=True, transpose=False)
+        x_multi = blk_chol_inv_multi_batch(
+            chol[0], chol[1], x_multi, lower=False, transpose=True)
+    elif solver == 'parallel':
+        chol = blk_tridiag_chol_parallel(D, B)
+        x = blk_chol_inv_parallel(
+            chol[0], chol[1], y[..., 0], lower=True, transpose=False)
+        x = blk_chol_inv_parallel(
+            chol[0], chol[1], x, lower=False, transpose=True)
+        x_multi = blk_chol_inv_multi_parallel(
+            chol[0], chol[1], y, lower=True, transpose=False)
+        x_multi = blk_chol_inv_multi_parallel(
+            chol[0], chol[1], x_multi, lower=False, transpose=True)
+    else:
+        raise ValueError(
+            '"%s" is not a valid string for specifying the solver' % solver)
+
+    return {'D': D, 'B': B, 'y': y,
+            'chol': chol, 'inv': x, 'inv_multi': x_multi}
+
+
+def peak_bytes(run_metadata):
+    """Largest allocator peak recorded in the step stats of a single run"""
+
+    peak = 0
+    for dev_stats in run_metadata.step_stats.dev_stats:
+        for node_stats in dev_stats.node_stats:
+            for memory in node_stats.memory:
+                peak = max(peak, memory.peak_bytes)
+
+    return peak
+
+
+def time_op(sess, op, feed_dict, num_reps):
+    """
+    Time repeated evaluations of `op`; the first (warm-up) evaluation is also
+    used to record memory usage
+
+    Returns:
+        dict: wall times in seconds, peak allocator bytes and op output
+
+    """
+
+    run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+    run_metadata = tf.RunMetadata()
+    output = sess.run(
+        op, feed_dict=feed_dict, options=run_options,
+        run_metadata=run_metadata)
+
+    times = []
+    for _ in range(num_reps):
+        start = time.time()
+        sess.run(op, feed_dict=feed_dict)
+        times.append(time.time() - start)
+
+    return {
+        'time_median': float(np.median(times)),
+        'time_min': float(np.min(times)),
+        'peak_bytes': int(peak_bytes(run_metadata)),
+        'output': output}
+
+
+def benchmark(num_time_pts, dim, batch_size, num_rhs, solver='sequential',
+              num_reps=10, dtype=tf.float64, seed=0):
+    """Time and check all ops for a single configuration"""
+
+    D, B, y = build_problem(num_time_pts, dim, batch_size, num_rhs, seed=seed)
+
+    results = {
+        'T': num_time_pts, 'n': dim, 'batch_size': batch_size,
+        'num_rhs': num_rhs, 'solver': solver, 'dtype': dtype.name}
+
+    with tf.Graph().as_default():
+        ops = build_graph(
+            num_time_pts, dim, batch_size, num_rhs, solver=solver,
+            dtype=dtype)
+        feed_dict = {ops['D']: D, ops['B']: B, ops['y']: y}
+        with tf.Session() as sess:
+            for name in ['chol', 'inv', 'inv_multi']:
+                results[name] = time_op(
+                    sess, ops[name], feed_dict, num_reps)
+
+    # errors against dense reference
+    chol = results['chol'].pop('output')
+    x = results['inv'].pop('output')
+    x_multi = results['inv_multi'].pop('output')
+    err_chol, err_inv, err_inv_multi = 0.0, 0.0, 0.0
+    for b in range(batch_size):
+        full = dense_from_blocks(D[b], B[b])
+        full_norm = np.linalg.norm(full)
+        L = dense_from_blocks(chol[0][b], chol[1][b], lower_only=True)
+        err_chol = max(
+            err_chol, np.linalg.norm(np.dot(L, L.T) - full) / full_norm)
+        rhs = y[b].reshape(num_time_pts * dim, num_rhs)
+        soln = np.linalg.solve(full, rhs)
+        soln_norm = np.linalg.norm(soln[:, 0])
+        err_inv = max(
+            err_inv,
+            np.linalg.norm(x[b].reshape(-1) - soln[:, 0]) / soln_norm)
+        err_inv_multi = max(
+            err_inv_multi,
+            np.linalg.norm(x_multi[b].reshape(-1, num_rhs) - soln)
+            / np.linalg.norm(soln))
+    results['chol']['rel_error'] = float(err_chol)
+    results['inv']['rel_error'] = float(err_inv)
+    results['inv_multi']['rel_error'] = float(err_inv_multi)
+
+    # resident set size of the process so far (kilobytes on linux)
+    results['max_rss_kb'] = int(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+    return results
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description='benchmark block-tridiagonal Cholesky routines')
+    parser.add_argument('--T', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--n', type=int, nargs='+', default=[2, 10])
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 16])
+    parser.add_argument('--rhs', type=int, nargs='+', default=[1, 8])
+    parser.add_argument(
+        '--solver', type=str, nargs='+', default=['sequential'],
+        choices=['sequential', 'parallel'])
+    parser.add_argument(
+        '--dtype', type=str, default='float64',
+        choices=['float32', 'float64'])
+    parser.add_argument('--num_reps', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--output', type=str, default='chol_utils_benchmark.json')
+    args = parser.parse_args()
+
+    dtype = tf.float32 if args.dtype == 'float32' else tf.float64
+
+    results = []
+    for solver, T, n, batch_size, num_rhs in itertools.product(
+            args.solver, args.T, args.n, args.batch, args.rhs):
+        result = benchmark(
+            T, n, batch_size, num_rhs, solver=solver,
+            num_reps=args.num_reps, dtype=dtype, seed=args.seed)
+        results.append(result)
+        print('%10s T=%4i n=%3i batch=%3i rhs=%3i | '
+              'chol %8.2f ms (err %.1e) | inv %8.2f ms (err %.1e) | '
+              'inv_multi %8.2f ms (err %.1e)' % (
+                  solver, T, n, batch_size, num_rhs,
+                  1e3 * result['chol']['time_median'],
+                  result['chol']['rel_error'],
+                  1e3 * result['inv']['time_median'],
+                  result['inv']['rel_error'],
+                  1e3 * result['inv_multi']['time_median'],
+                  result['inv_multi']['rel_error']))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('results saved to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()